@@ -0,0 +1,80 @@
+"""
+Benchmark of the availability cache on a replayed day of availability webhooks.
+
+Replays a day of availability deliveries, one every five minutes, each carrying
+the status of every charging station with a small fraction of them changed,
+through `write_availabilities_to_db` against a local SQLite stand-in. The run
+is repeated with the availability cache disabled and enabled, and the SQL
+statements, bound parameters, connection checkouts and wall time of each run
+are reported.
+
+Usage:
+    python benchmarks/bench_availability_cache.py --stations 2000 --deliveries 288
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import event
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from benchmarks.synthetic import make_availability_deliveries
+
+
+def count_parameters(parameters, executemany):
+    """Returns the number of values bound to a statement."""
+    if executemany:
+        return sum(len(row) for row in parameters)
+    return len(parameters)
+
+
+def run(name, cache_size, frames):
+    """Replays the deliveries and prints the database work and wall time."""
+    database_utils.AVAILABILITY_CACHE.max_size = cache_size
+    engine = database_utils.get_local_engine()
+    statements = []
+    event.listen(
+        engine,
+        "before_cursor_execute",
+        lambda *args: statements.append(count_parameters(args[3], args[5])),
+    )
+    database_utils.set_engine(engine)
+    start = time.perf_counter()
+    for frame in frames:
+        database_utils.write_availabilities_to_db(frame)
+    elapsed = time.perf_counter() - start
+    checkouts = database_utils.get_pool_stats()["checkouts"]
+    print(
+        f"{name:<10} {len(frames):>5} deliveries {len(statements):>6} statements "
+        f"{sum(statements):>9} parameters {checkouts:>5} checkouts {elapsed:>7.2f} s"
+    )
+    if cache_size:
+        print(f"{'':<10} {database_utils.get_availability_cache_stats()}")
+    database_utils.set_engine(None)
+
+
+def main():
+    """Parses arguments and replays the deliveries with and without the cache."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=int, default=2000)
+    parser.add_argument("--deliveries", type=int, default=288)
+    parser.add_argument("--changed", type=float, default=0.03)
+    args = parser.parse_args()
+
+    frames = [
+        pd.DataFrame(batch)
+        for batch in make_availability_deliveries(
+            args.stations, args.deliveries, args.changed
+        )
+    ]
+    run("no cache", 0, frames)
+    run("cache", args.stations, frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the SCD Type 2 and event-log availability storage modes as history grows.
+
+Replays days of availability deliveries, one every five minutes, each carrying
+the status of every charging station with a fraction of them changed, through
+`write_availabilities_to_db` against a local SQLite stand-in. Each storage mode
+is run in turn (with the availability cache disabled, so every row reaches the
+database), and the mean write time of the first and last days is reported
+together with the rows stored.
+
+Usage:
+    python benchmarks/bench_availability_storage.py --stations 2000 --days 2
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import func, select
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode.database_utils import EVRoamAvailabilities, EVRoamAvailabilityEvents
+from benchmarks.synthetic import make_availability_deliveries
+
+DELIVERIES_PER_DAY = 288
+
+
+def run(mode, frames):
+    """Replays the deliveries in one storage mode and prints the write times."""
+    database_utils.AVAILABILITY_STORAGE_MODE = mode
+    database_utils.AVAILABILITY_CACHE.max_size = 0
+    database_utils.set_engine(database_utils.get_local_engine())
+    timings = []
+    for frame in frames:
+        start = time.perf_counter()
+        database_utils.write_availabilities_to_db(frame)
+        timings.append(time.perf_counter() - start)
+    model = EVRoamAvailabilityEvents if mode == "events" else EVRoamAvailabilities
+    with database_utils.session_scope() as session:
+        rows = session.execute(select(func.count()).select_from(model)).scalar()
+    first = sum(timings[:DELIVERIES_PER_DAY]) / len(timings[:DELIVERIES_PER_DAY])
+    last = sum(timings[-DELIVERIES_PER_DAY:]) / len(timings[-DELIVERIES_PER_DAY:])
+    print(
+        f"{mode:<7} first day {first * 1000:>7.1f} ms/delivery "
+        f"last day {last * 1000:>7.1f} ms/delivery {rows:>9} rows stored"
+    )
+    database_utils.set_engine(None)
+
+
+def main():
+    """Parses arguments and replays the deliveries in each storage mode."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stations", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=2)
+    parser.add_argument("--changed", type=float, default=0.03)
+    args = parser.parse_args()
+
+    frames = [
+        pd.DataFrame(batch)
+        for batch in make_availability_deliveries(
+            args.stations, DELIVERIES_PER_DAY * args.days, args.changed
+        )
+    ]
+    run("scd2", frames)
+    run("events", frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark of event payload downloads within one listener invocation.
+
+Serves availability payloads from a local HTTP stub with artificial latency
+and times `event_utils.process_events` with one download worker (sequential,
+as before) and with the configured pool of workers. Database writes are
+skipped.
+
+Usage:
+    python benchmarks/bench_event_downloads.py --events 8 --latency 0.5
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+from unittest import mock
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import event_utils
+from tests.http_stub import StubServer
+
+
+def main():
+    """Parses arguments and times sequential and concurrent downloads."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--events", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        server.add_route(
+            "/availabilities/1.json", lambda path, query: (200, [{"n": query["n"]}])
+        )
+        events = [
+            {
+                "eventType": "EVRoam.Changed",
+                "data": {
+                    "url": server.url(
+                        f"/availabilities/1.json?n={index}"
+                        f"&delay={args.latency * (1 + index / args.events)}"
+                    )
+                },
+            }
+            for index in range(args.events)
+        ]
+        slowest = args.latency * (1 + (args.events - 1) / args.events)
+        print(f"slowest single download {slowest:.2f} s")
+        for workers in (event_utils.DOWNLOAD_WORKERS, 1):
+            with mock.patch.object(
+                event_utils, "DOWNLOAD_WORKERS", workers
+            ), mock.patch.object(event_utils, "process_json_data"):
+                start = time.perf_counter()
+                event_utils.process_events(events)
+                elapsed = time.perf_counter() - start
+            print(f"{workers:>3} workers {args.events:>4} events {elapsed:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Microbenchmark of change-hash computation over a charging station snapshot.
+
+Compares hashing each row with `generate_hash_key` inside an `iterrows` loop
+against the vectorized `generate_hash_keys`, and checks both give the same
+digests.
+
+Usage:
+    python benchmarks/bench_hashing.py --rows 50000
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode.database_utils import EVRoamChargingStations
+from benchmarks.synthetic import make_chargingstations
+
+HASH_KEYS = database_utils.get_dynamic_hash_keys(
+    EVRoamChargingStations, exclude=["WaterMark", "ODS", "ChargingStationId"]
+)
+
+
+def per_row(dataframe):
+    """Hashes each row with generate_hash_key."""
+    return [
+        database_utils.generate_hash_key(*[row[key] for key in HASH_KEYS])
+        for _, row in dataframe.iterrows()
+    ]
+
+
+def vectorized(dataframe):
+    """Hashes all rows with generate_hash_keys."""
+    return database_utils.generate_hash_keys(dataframe, HASH_KEYS).tolist()
+
+
+def main():
+    """Parses arguments and times both hashing approaches."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    dataframe = pd.DataFrame(make_chargingstations(args.rows))
+    dataframe = dataframe.where(pd.notnull(dataframe), None)
+    results = {}
+    for name, function in (("per-row", per_row), ("vectorized", vectorized)):
+        start = time.perf_counter()
+        results[name] = function(dataframe)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:<10} {args.rows:>8} rows {elapsed:>8.2f} s "
+            f"{args.rows / elapsed:>10.0f} rows/s"
+        )
+    assert results["per-row"] == results["vectorized"], "digests differ"
+
+
+if __name__ == "__main__":
+    main()
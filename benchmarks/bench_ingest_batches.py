@@ -0,0 +1,83 @@
+"""
+Benchmark of batched commits against a single transaction per snapshot.
+
+Writes a synthetic site snapshot with `write_in_batches` into a SQLite file
+standing in for the database, once in a single transaction and once per batch
+size. For each run the throughput and the longest and mean transaction are
+reported; a transaction holds its write locks until it commits, so the
+longest transaction bounds how long other writers wait. With `--poison`, that
+many rows the database rejects are mixed into the snapshot to show the cost of
+isolating them.
+
+Usage:
+    python benchmarks/bench_ingest_batches.py --rows 20000 --batch-rows 5000 1000 250
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+from sqlalchemy import event
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode.database_utils import EVRoamSites
+from benchmarks.synthetic import make_sites
+
+
+def run(dataframe, batch_rows):
+    """Writes the snapshot into a fresh database and returns its timings."""
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ["LocalBlobStoragePath"] = directory
+        engine = database_utils.get_local_engine(str(Path(directory) / "evroam.db"))
+        database_utils.set_engine(engine)
+        transactions = []
+        began = {}
+        event.listen(engine, "begin", lambda connection: began.update(at=time.perf_counter()))
+        for name in ("commit", "rollback"):
+            event.listen(
+                engine,
+                name,
+                lambda connection: transactions.append(time.perf_counter() - began["at"]),
+            )
+        start = time.perf_counter()
+        counts, _ = database_utils.write_in_batches(
+            EVRoamSites, "SiteId", dataframe, batch_rows=batch_rows
+        )
+        elapsed = time.perf_counter() - start
+        database_utils.set_engine(None)
+    return counts, elapsed, transactions
+
+
+def main():
+    """Parses arguments and measures each batch size."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--batch-rows", type=int, nargs="+", default=[5000, 1000, 250])
+    parser.add_argument("--poison", type=int, default=0)
+    args = parser.parse_args()
+
+    sites = make_sites(args.rows)
+    for index in range(args.poison):
+        # Reusing the surrogate key of the first site violates the primary key
+        sites[(index + 1) * len(sites) // (args.poison + 1)]["ODSdboEVRoamSitesSKID"] = 1
+    dataframe = pd.DataFrame(sites)
+    for batch_rows in [0, *args.batch_rows]:
+        counts, elapsed, transactions = run(dataframe, batch_rows)
+        name = "single" if batch_rows == 0 else f"{batch_rows} rows"
+        print(
+            f"{name:<10} {args.rows / elapsed:>8.0f} rows/s "
+            f"{len(transactions):>5} transactions, longest "
+            f"{max(transactions) * 1000:>8.1f} ms, mean "
+            f"{sum(transactions) / len(transactions) * 1000:>8.1f} ms, "
+            f"{counts['dead_lettered']} dead-lettered"
+        )
+
+
+if __name__ == "__main__":
+    main()
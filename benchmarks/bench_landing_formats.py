@@ -0,0 +1,70 @@
+"""
+Benchmark of the Parquet landing zone against the CSV exports of the scripts.
+
+Builds a synthetic charging station snapshot shaped like the EVRoam API results,
+exports it to CSV as `scripts/get_evroam_chargingstations.py` does, and lands it
+as Parquet with `landing_utils` in a temporary local directory. The size of each
+file and the time to load it back into a DataFrame are reported.
+
+Usage:
+    python benchmarks/bench_landing_formats.py --rows 10000 50000
+"""
+
+import io
+import sys
+import time
+import argparse
+import tempfile
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import landing_utils
+from sharedCode import schema_utils
+from sharedCode.storage_utils import LocalBlobStore
+from benchmarks.synthetic import make_chargingstation_payloads
+
+
+def timed(function, *args):
+    """Returns the result of a call and its wall time in seconds."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def run(rows):
+    """Compares the CSV export and the Parquet landing of one snapshot."""
+    payloads = make_chargingstation_payloads(rows)
+
+    dataframe = pd.json_normalize(payloads)
+    schema_utils.normalize_columns(dataframe)
+    csv_bytes = dataframe.to_csv(index=False).encode("utf-8")
+    _, csv_load = timed(pd.read_csv, io.BytesIO(csv_bytes))
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = LocalBlobStore(directory, "landing")
+        blob_name = landing_utils.write_payload(
+            "chargingstations", payloads, kind="snapshot", store=store
+        )
+        parquet_size = len(store.download_blob(blob_name))
+        _, parquet_load = timed(landing_utils.read_payload, blob_name, store)
+
+    print(
+        f"{rows:>8} rows  csv {len(csv_bytes) / 2**20:>7.2f} MiB {csv_load * 1000:>7.1f} ms  "
+        f"parquet {parquet_size / 2**20:>7.2f} MiB {parquet_load * 1000:>7.1f} ms"
+    )
+
+
+def main():
+    """Parses arguments and runs each snapshot size."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000])
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of the per-row, set-based and staged SCD Type 2 write paths.
+
+Writes a synthetic site snapshot into a local SQLite stand-in twice: once into
+an empty table, then again with a fraction of the rows changed. For each pass
+the wall time and the number of SQL statements sent to the database are
+reported.
+
+Usage:
+    python benchmarks/bench_scd2_merge.py --rows 10000
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode.database_utils import EVRoamSites
+from benchmarks.synthetic import make_sites, mutate
+
+HASH_KEYS = database_utils.get_dynamic_hash_keys(
+    EVRoamSites, exclude=["WaterMark", "ODS", "SiteId"]
+)
+
+
+def per_row(session, records):
+    """Writes the records with one add_or_update_record call per row."""
+    for record in records:
+        fields = dict(record)
+        site_id = fields.pop("SiteId")
+        database_utils.add_or_update_record(
+            EVRoamSites, {"SiteId": site_id}, HASH_KEYS, session=session, **fields
+        )
+
+
+def bulk(session, records):
+    """Writes the records with a single merge_records call."""
+    database_utils.merge_records(EVRoamSites, "SiteId", HASH_KEYS, records, session)
+
+
+def staged(session, records):
+    """Writes the records through a temporary staging table."""
+    database_utils.merge_records_staged(EVRoamSites, "SiteId", HASH_KEYS, records, session)
+
+
+def run(name, write, snapshots):
+    """Runs each snapshot through `write` and prints statements and wall time."""
+    engine = database_utils.get_local_engine()
+    database_utils.create_tables(engine)
+    statements = []
+    event.listen(
+        engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    session_factory = sessionmaker(bind=engine)
+    for label, records in snapshots:
+        statements.clear()
+        session = session_factory()
+        start = time.perf_counter()
+        write(session, records)
+        session.commit()
+        elapsed = time.perf_counter() - start
+        session.close()
+        print(
+            f"{name:<8} {label:<10} {len(records):>8} rows "
+            f"{len(statements):>8} statements {elapsed:>8.2f} s"
+        )
+    engine.dispose()
+
+
+def main():
+    """Parses arguments and runs each write path."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--changed", type=float, default=0.05)
+    args = parser.parse_args()
+
+    initial = make_sites(args.rows)
+    snapshots = [
+        ("initial", initial),
+        ("update", mutate(initial, args.changed, "Name")),
+    ]
+    run("per-row", per_row, snapshots)
+    run("bulk", bulk, snapshots)
+    run("staged", staged, snapshots)
+
+
+if __name__ == "__main__":
+    main()
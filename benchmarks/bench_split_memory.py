@@ -0,0 +1,99 @@
+"""
+Memory benchmark of splitting charging stations and availabilities.
+
+Normalises a large synthetic `/consumer/api/ChargingStation` payload once, then
+prepares both entity frames for the SCD Type 2 merge in two ways: as the timer
+used to, copying each entity frame, deduplicating and dropping rows with
+missing keys in place, and replacing NaN with None before hashing; and with
+`pipeline_utils.split_chargingstations`, which selects both frames as views of
+the payload and hashes them as they are, leaving NaN to be replaced by None
+when rows are bound. Peak Python memory above the normalised payload is
+measured with tracemalloc, for the split alone and followed by hashing. Arrow
+buffers of `str` columns are not traced.
+
+Usage:
+    python benchmarks/bench_split_memory.py --rows 100000
+"""
+
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("EvroamSubscriptionKey", "benchmark")
+# pylint: disable=wrong-import-position
+from constants import AVAILABILITIES_COLUMNS, CHARGINGSTATIONS_DROP_COLUMNS, JSON_KEYS
+from sharedCode import database_utils
+from sharedCode import pipeline_utils
+from sharedCode import schema_utils
+from benchmarks.synthetic import make_chargingstation_payloads
+
+MODELS = (
+    (database_utils.EVRoamAvailabilities, "ChargingStationId"),
+    (database_utils.EVRoamChargingStations, "ChargingStationId"),
+)
+
+
+def legacy_split(dataframe):
+    """Copies and cleans each entity frame, then replaces NaN with None."""
+    availabilities = dataframe[AVAILABILITIES_COLUMNS].copy()
+    availabilities.drop_duplicates(inplace=True, subset=JSON_KEYS["availabilities"])
+    availabilities.dropna(inplace=True, subset=JSON_KEYS["availabilities"], how="any")
+    chargingstations = dataframe.drop(columns=CHARGINGSTATIONS_DROP_COLUMNS).copy()
+    chargingstations.drop_duplicates(inplace=True, subset=JSON_KEYS["chargingstations"])
+    chargingstations.dropna(inplace=True, subset=JSON_KEYS["chargingstations"], how="any")
+    return [
+        frame.where(pd.notnull(frame), None) for frame in (availabilities, chargingstations)
+    ]
+
+
+def hash_frames(frames):
+    """Computes the change hash of every row of both entity frames."""
+    hashes = []
+    for frame, (model, unique_key) in zip(frames, MODELS):
+        hash_keys = database_utils.get_dynamic_hash_keys(
+            model, exclude=["WaterMark", "ODS", unique_key]
+        )
+        hashes.append(database_utils.generate_hash_keys(frame, hash_keys))
+    return hashes
+
+
+def measure(prepare):
+    """Runs `prepare` and returns (peak MiB above the payload, seconds)."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    prepare()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak / 2**20, elapsed
+
+
+def main():
+    """Parses arguments and measures both ways of splitting the payload."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        dataframe = pd.json_normalize(make_chargingstation_payloads(rows))
+        schema_utils.normalize_columns(dataframe)
+        for name, split in (
+            ("legacy", legacy_split),
+            ("single-pass", pipeline_utils.split_chargingstations),
+        ):
+            split_peak, split_elapsed = measure(lambda split=split: split(dataframe))
+            peak, elapsed = measure(lambda split=split: hash_frames(split(dataframe)))
+            print(
+                f"{name:<12} {rows:>8} rows split peak {split_peak:>7.1f} MiB "
+                f"{split_elapsed:>6.2f} s, split and hash peak {peak:>7.1f} MiB "
+                f"{elapsed:>6.2f} s"
+            )
+
+if __name__ == "__main__":
+    main()
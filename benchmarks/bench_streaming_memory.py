@@ -0,0 +1,77 @@
+"""
+Memory benchmark of the charging station timer ingestion.
+
+Feeds synthetic `/consumer/api/ChargingStation` pages through the timer
+function twice: accumulating every page before building one DataFrame (as the
+timer used to), and streaming bounded batches of pages with
+`ingest_chargingstations`. Rows are written to a SQLite file standing in for
+the database. Peak Python memory is measured with tracemalloc; with streaming
+it should stay flat as the number of charging stations grows.
+
+Usage:
+    python benchmarks/bench_streaming_memory.py --rows 5000 10000 20000
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("EvroamSubscriptionKey", "benchmark")
+# pylint: disable=wrong-import-position
+import fetch_evroam_chargingstations as timer
+from sharedCode import database_utils
+from benchmarks.synthetic import make_chargingstation_payloads, paginate
+
+
+def accumulate(pages):
+    """Collects every page, then builds and writes one DataFrame per entity."""
+    all_data = []
+    for page in pages:
+        all_data.extend(page)
+    availabilities, chargingstations = timer.process_data_to_dataframes(all_data)
+    database_utils.write_availabilities_to_db(availabilities)
+    database_utils.write_chargingstations_to_db(chargingstations)
+
+
+def stream(pages):
+    """Normalises and writes bounded batches of pages as they arrive."""
+    timer.ingest_chargingstations(pages)
+
+
+def measure(ingest, payloads):
+    """Runs `ingest` into a fresh database and returns (peak MiB, seconds)."""
+    with tempfile.TemporaryDirectory() as directory:
+        database_utils.set_engine(
+            database_utils.get_local_engine(str(Path(directory) / "evroam.db"))
+        )
+        tracemalloc.start()
+        start = time.perf_counter()
+        ingest(paginate(payloads))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        database_utils.set_engine(None)
+    return peak / 2**20, elapsed
+
+
+def main():
+    """Parses arguments and measures both ingestion approaches."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[5000, 10000, 20000])
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        # Payloads are generated outside the measurement; the API would stream them
+        payloads = make_chargingstation_payloads(rows)
+        for name, ingest in (("accumulate", accumulate), ("stream", stream)):
+            peak, elapsed = measure(ingest, payloads)
+            print(f"{name:<10} {rows:>8} rows peak {peak:>8.1f} MiB {elapsed:>8.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+pytest configuration of the ingestion benchmark suite.
+
+The suite needs pytest-benchmark and is run explicitly, e.g.:
+
+    python -m pytest benchmarks --bench-rows 1000 10000 100000
+
+Each stage is timed by pytest-benchmark, then run once more under tracemalloc
+and a statement counter. Throughput, peak Python memory and the number of SQL
+statements are recorded in the benchmark's `extra_info`, so they are kept with
+the timings in `--benchmark-json` and `--benchmark-autosave` results.
+"""
+
+import os
+import time
+import tempfile
+import tracemalloc
+
+import pytest
+from sqlalchemy import event
+
+os.environ.setdefault("EvroamSubscriptionKey", "benchmark")
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode import landing_utils
+
+DEFAULT_ROWS = [1000, 10000, 100000]
+
+
+def pytest_addoption(parser):
+    """Adds the options of the benchmark suite."""
+    group = parser.getgroup("evroam", "EVRoam ingestion benchmarks")
+    group.addoption(
+        "--bench-rows",
+        type=int,
+        nargs="+",
+        default=DEFAULT_ROWS,
+        help="Dataset sizes to benchmark each stage at.",
+    )
+    group.addoption(
+        "--bench-rounds",
+        type=int,
+        default=3,
+        help="Timed rounds of each stage, each on fresh data.",
+    )
+
+
+def pytest_generate_tests(metafunc):
+    """Runs every benchmark taking `rows` at each of the `--bench-rows` sizes."""
+    if "rows" in metafunc.fixturenames:
+        metafunc.parametrize("rows", metafunc.config.getoption("--bench-rows"))
+
+
+class StatementCounter:
+    """Counts the SQL statements sent through an engine."""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self.on_execute)
+
+    def on_execute(self, *_):
+        """Counts one statement, or one executemany batch."""
+        self.count += 1
+
+
+class LocalDatabase:
+    """Installs a fresh in-memory SQLite engine with the EVRoam tables on demand."""
+
+    def __init__(self):
+        self.statements = None
+
+    def reset(self):
+        """Replaces the process-wide engine with an empty database."""
+        engine = database_utils.get_local_engine()
+        database_utils.set_engine(engine)
+        self.statements = StatementCounter(engine)
+
+
+@pytest.fixture(autouse=True)
+def local_environment(monkeypatch):
+    """Runs each benchmark with a local blob store and the landing zone disabled."""
+    with tempfile.TemporaryDirectory() as directory:
+        monkeypatch.setenv("LocalBlobStoragePath", directory)
+        monkeypatch.setattr(landing_utils, "LANDING_ENABLED", False)
+        yield
+    database_utils.set_engine(None)
+
+
+@pytest.fixture
+def database():
+    """The local database the write stages run against."""
+    return LocalDatabase()
+
+
+@pytest.fixture
+def measure_stage(benchmark, request):
+    """
+    Returns a function that benchmarks one pipeline stage.
+
+    The returned function takes the stage to run, a `setup` callable returning
+    its (args, kwargs) for each round, the number of rows it handles and, for
+    stages writing to the database, the `LocalDatabase` to reset before each
+    round. It returns the metrics recorded in `extra_info`.
+    """
+    rounds = request.config.getoption("--bench-rounds")
+
+    def measure(stage, setup, rows, database=None):
+        def prepare():
+            if database is not None:
+                database.reset()
+            return setup()
+
+        benchmark.pedantic(stage, setup=prepare, rounds=rounds, iterations=1)
+
+        args, kwargs = prepare()
+        tracemalloc.start()
+        start = time.perf_counter()
+        stage(*args, **kwargs)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        # Under --benchmark-disable the stage runs once and has no timing stats
+        mean = elapsed if benchmark.disabled else benchmark.stats.stats.mean
+        benchmark.extra_info.update(
+            {
+                "rows": rows,
+                "rows_per_second": rows / mean,
+                "peak_mib": peak / 2**20,
+                "traced_seconds": elapsed,
+                "statements": database.statements.count if database else 0,
+            }
+        )
+        return benchmark.extra_info
+
+    return measure
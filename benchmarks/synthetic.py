@@ -0,0 +1,203 @@
+"""
+Deterministic synthetic EVRoam records for local benchmarks.
+
+The generators return plain dictionaries whose keys match the columns of the
+EVRoam models, so they can be written through `sharedCode.database_utils`
+against a local SQLite engine. The `*_payloads` generators return results
+shaped like the raw EVRoam API responses instead, with camelCase field names.
+"""
+
+import json
+import random
+from datetime import datetime, timedelta
+
+STATUSES = ["Available", "Occupied", "Unavailable", "Unknown"]
+OPERATORS = ["ChargeNet", "Meridian", "Z Energy", "BP Pulse", "Jolt"]
+CONNECTOR_TYPES = ["Type 2 Socketed", "Type 2 CCS", "CHAdeMO", "Type 2 Tethered"]
+
+
+def make_sites(count, seed=0):
+    """Returns `count` site records."""
+    rng = random.Random(seed)
+    return [
+        {
+            "SiteId": f"site-{index:06d}",
+            "AccessLocations": None,
+            "Address": f"{rng.randint(1, 500)} Example Road, Town {index % 97}",
+            "CarParkCount": rng.randint(1, 20),
+            "HasCarparkCost": rng.random() < 0.3,
+            "HasTouristAttraction": rng.random() < 0.1,
+            "Is24Hours": rng.random() < 0.7,
+            "MaxTimeLimit": None,
+            "Name": f"Site {index}",
+            "Operator": rng.choice(OPERATORS),
+            "ProviderDeleted": False,
+        }
+        for index in range(count)
+    ]
+
+
+def _make_connectors(rng):
+    """Returns the nested connector list of one charging station."""
+    return [
+        {
+            "connectorType": rng.choice(CONNECTOR_TYPES),
+            "kwRated": rng.choice([7, 22, 50, 150]),
+            "operationalStatus": rng.choice(STATUSES),
+        }
+        for _ in range(rng.randint(1, 3))
+    ]
+
+
+def make_chargingstations(count, seed=0):
+    """
+    Returns `count` charging station records shaped like the flattened
+    `/consumer/api/ChargingStation` payload, with nested connectors.
+    """
+    rng = random.Random(seed)
+    return [
+        {
+            "ChargingStationId": f"cs-{index:06d}",
+            "SiteId": f"site-{index // 4:06d}",
+            "AssetId": f"asset-{index:06d}",
+            "Connectors": _make_connectors(rng),
+            "Current": rng.choice(["AC", "DC"]),
+            "DateFirstOperational": datetime(2018, 1, 1)
+            + timedelta(days=rng.randint(0, 2000)),
+            "FloorLevel": rng.choice([None, "1", "UG"]),
+            "HasChargingCost": rng.random() < 0.8,
+            "Images": None,
+            "InstallationStatus": "Commissioned",
+            "KwRated": rng.choice([7, 22, 50, 150]),
+            "Locationlat": -36.0 - rng.random() * 10,
+            "Locationlon": 174.0 + rng.random() * 4,
+            "Manufacturer": rng.choice(["ABB", "Tritium", "Kempower", None]),
+            "Model": rng.choice(["Terra 54", "RTM 75", None]),
+            "NextPlannedOutage": None,
+            "Operator": rng.choice(OPERATORS),
+            "Owner": rng.choice(OPERATORS),
+            "ProviderDeleted": False,
+        }
+        for index in range(count)
+    ]
+
+
+def _camel_case(record):
+    """Returns a model record with the field names of the raw API response."""
+    return {name[0].lower() + name[1:]: value for name, value in record.items()}
+
+
+def _json_time(value):
+    """Formats a datetime as the EVRoam API does."""
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_site_payloads(count, seed=0):
+    """Returns `count` site results shaped like the raw `/consumer/api/Site` response."""
+    return [_camel_case(record) for record in make_sites(count, seed)]
+
+
+def make_chargingstation_payloads(count, seed=0, start=datetime(2024, 1, 1), raw=False):
+    """
+    Returns `count` charging station results shaped like the raw
+    `/consumer/api/ChargingStation` response, with a nested `location` and
+    the availability fields. Timestamps are datetimes and `connectors` is a
+    JSON string so the rows can be written to the SQLite stand-in, unless
+    `raw` is set, in which case they are ISO strings and a nested list as
+    delivered by the API.
+    """
+    rng = random.Random(seed)
+    encode_time = _json_time if raw else lambda value: value
+    encode_connectors = (lambda value: value) if raw else json.dumps
+    return [
+        {
+            "chargingStationId": f"cs-{index:06d}",
+            "siteId": f"site-{index // 4:06d}",
+            "assetId": f"asset-{index:06d}",
+            "connectors": encode_connectors(_make_connectors(rng)),
+            "current": rng.choice(["AC", "DC"]),
+            "dateFirstOperational": encode_time(
+                datetime(2018, 1, 1) + timedelta(days=rng.randint(0, 2000))
+            ),
+            "floorLevel": rng.choice([None, "1", "UG"]),
+            "hasChargingCost": rng.random() < 0.8,
+            "images": None,
+            "installationStatus": "Commissioned",
+            "kwRated": rng.choice([7, 22, 50, 150]),
+            "location": {
+                "lat": -36.0 - rng.random() * 10,
+                "lon": 174.0 + rng.random() * 4,
+            },
+            "manufacturer": rng.choice(["ABB", "Tritium", "Kempower", None]),
+            "model": rng.choice(["Terra 54", "RTM 75", None]),
+            "nextPlannedOutage": None,
+            "operator": rng.choice(OPERATORS),
+            "owner": rng.choice(OPERATORS),
+            "providerDeleted": False,
+            "availabilityStatus": rng.choice(STATUSES),
+            "kwAvailable": float(rng.choice([7, 22, 50, 150])),
+            "availabilityTime": encode_time(
+                start + timedelta(seconds=rng.randint(0, 86400))
+            ),
+        }
+        for index in range(count)
+    ]
+
+
+def paginate(results, page_size=100):
+    """Yields `results` in pages, as `api_utils.fetch_pages` does."""
+    for start in range(0, len(results), page_size):
+        yield results[start : start + page_size]
+
+
+def make_availabilities(count, seed=0, start=datetime(2024, 1, 1)):
+    """Returns `count` availability records, one per charging station."""
+    rng = random.Random(seed)
+    return [
+        {
+            "ChargingStationId": f"cs-{index:06d}",
+            "AvailabilityStatus": rng.choice(STATUSES),
+            "AvailabilityTime": start + timedelta(seconds=rng.randint(0, 86400)),
+            "KwAvailable": float(rng.choice([7, 22, 50, 150])),
+            "Operator": rng.choice(OPERATORS),
+        }
+        for index in range(count)
+    ]
+
+
+def make_availability_payloads(count, seed=0, start=datetime(2024, 1, 1)):
+    """
+    Returns `count` availability results shaped like a webhook payload, one per
+    charging station, with datetimes so they can be written to the SQLite stand-in.
+    """
+    return [_camel_case(record) for record in make_availabilities(count, seed, start)]
+
+
+def make_availability_deliveries(stations, deliveries, changed, seed=2):
+    """
+    Returns a day of availability deliveries, one every five minutes, each with
+    the status of every station and a fraction of the statuses changed.
+    """
+    rng = random.Random(seed)
+    records = make_availabilities(stations)
+    batches = []
+    for delivery in range(deliveries):
+        if delivery:
+            for record in records:
+                if rng.random() < changed:
+                    record["AvailabilityStatus"] = rng.choice(STATUSES)
+                    record["AvailabilityTime"] += timedelta(minutes=5)
+        batches.append([dict(record) for record in records])
+    return batches
+
+
+def mutate(records, fraction, field, seed=1):
+    """Returns a copy of `records` with `field` changed on a fraction of them."""
+    rng = random.Random(seed)
+    mutated = []
+    for record in records:
+        record = dict(record)
+        if rng.random() < fraction:
+            record[field] = f"{record[field]} (updated)"
+        mutated.append(record)
+    return mutated
@@ -0,0 +1,113 @@
+"""
+Benchmark suite of the ingestion pipeline stages on synthetic EVRoam data.
+
+Every stage runs at each `--bench-rows` size: the webhook path
+(`event_utils.process_json_data`), the timer transform
+(`process_data_to_dataframes`), change hashing (`generate_hash_keys`, the
+column-wise counterpart of `generate_hash_key`) and the SCD Type 2 writers
+(`write_*_to_db`) loading an empty in-memory SQLite database with the real
+models. Besides the timings, each benchmark records its throughput, peak
+Python memory and SQL statement count; the statement count is also checked
+against a budget per committed batch, so a write that starts issuing
+statements per row fails the run.
+
+Usage:
+    python -m pytest benchmarks --bench-rows 1000 10000 100000
+"""
+
+import math
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+# pylint: disable=wrong-import-position
+import fetch_evroam_chargingstations
+from sharedCode import database_utils
+from sharedCode import event_utils
+from benchmarks.synthetic import (
+    make_availabilities,
+    make_availability_payloads,
+    make_chargingstation_payloads,
+    make_site_payloads,
+    make_sites,
+)
+
+# SQL statements a committed batch of any size may send: reading the current
+# hash keys, then inserting the new versions and expiring the old ones
+STATEMENTS_PER_BATCH = 4
+
+PAYLOADS = {
+    "sites": make_site_payloads,
+    "chargingstations": make_chargingstation_payloads,
+    "availabilities": make_availability_payloads,
+}
+WRITERS = {
+    "sites": database_utils.write_sites_to_db,
+    "chargingstations": database_utils.write_chargingstations_to_db,
+    "availabilities": database_utils.write_availabilities_to_db,
+}
+
+
+def make_snapshot(json_type, rows):
+    """Returns a snapshot of an entity as the timer functions hand it to the writers."""
+    if json_type == "sites":
+        return pd.DataFrame(make_sites(rows))
+    if json_type == "availabilities":
+        return pd.DataFrame(make_availabilities(rows))
+    _, chargingstations = fetch_evroam_chargingstations.process_data_to_dataframes(
+        make_chargingstation_payloads(rows)
+    )
+    return chargingstations
+
+
+def statement_budget(rows, entities=1):
+    """Returns the most statements writing `rows` rows of each entity may take."""
+    batches = math.ceil(rows / database_utils.INGEST_BATCH_ROWS)
+    return STATEMENTS_PER_BATCH * batches * entities
+
+
+@pytest.mark.parametrize("json_type", list(PAYLOADS))
+def test_process_json_data(measure_stage, database, rows, json_type):
+    """Normalises, hashes and writes one webhook payload."""
+    payload = PAYLOADS[json_type](rows)
+    url = f"https://example.invalid/{json_type}/1.json"
+    metrics = measure_stage(
+        event_utils.process_json_data, lambda: ((url, payload), {}), rows, database
+    )
+    # A charging stations payload also writes its availabilities
+    entities = 2 if json_type == "chargingstations" else 1
+    assert metrics["statements"] <= statement_budget(rows, entities)
+
+
+def test_process_data_to_dataframes(measure_stage, rows):
+    """Splits a raw charging station snapshot with nested values into entity frames."""
+    payload = make_chargingstation_payloads(rows, raw=True)
+    measure_stage(
+        fetch_evroam_chargingstations.process_data_to_dataframes,
+        lambda: ((payload,), {}),
+        rows,
+    )
+
+
+def test_generate_hash_keys(measure_stage, rows):
+    """Computes the change hash of every charging station row."""
+    _, chargingstations = fetch_evroam_chargingstations.process_data_to_dataframes(
+        make_chargingstation_payloads(rows, raw=True)
+    )
+    hash_keys = database_utils.get_model_metadata(
+        database_utils.EVRoamChargingStations, "ChargingStationId"
+    ).hash_keys
+    measure_stage(
+        database_utils.generate_hash_keys,
+        lambda: ((chargingstations, list(hash_keys)), {}),
+        rows,
+    )
+
+
+@pytest.mark.parametrize("json_type", list(WRITERS))
+def test_write_to_db(measure_stage, database, rows, json_type):
+    """Loads a snapshot into empty SCD Type 2 tables."""
+    dataframe = make_snapshot(json_type, rows)
+    metrics = measure_stage(WRITERS[json_type], lambda: ((dataframe,), {}), rows, database)
+    assert metrics["statements"] <= statement_budget(rows)
@@ -16,8 +16,40 @@ JSON_FILE_PATH = {
     'path': f'{JSON_FILE_PATH_PREFIX}/{{blob_prefix}}.json'
 }
 
+PARQUET_FILE_PATH_PREFIX = 'EVRoamParquet'
+
+PARQUET_FILE_PATH = {
+    'container': 'incoming-data-staging',
+    'path': (
+        f'{PARQUET_FILE_PATH_PREFIX}/{{json_type}}/'
+        f'IngestionDate={{ingestion_date}}/{{blob_prefix}}.parquet'
+    )
+}
+
+STATE_FILE_PATH = {
+    'container': 'incoming-data-staging',
+    'path': 'EVRoamState/watermarks.json'
+}
+
+# Provider timestamp of each API result used as the incremental fetch high-water mark;
+# None where the API results carry no change timestamp. The charging station
+# `availabilityTime` only dates the availability, so it filters the availabilities
+# while the charging stations themselves are always written
+CHANGE_TIMESTAMP_FIELDS = {
+    'sites': None,
+    'chargingstations': 'availabilityTime'
+}
+
+# Default number of rows written to the SQL database per transaction
 MAX_JSON_INGEST_BATCH = 1000
 
+DEAD_LETTER_FILE_PATH_PREFIX = 'EVRoamDeadLetter'
+
+DEAD_LETTER_FILE_PATH = {
+    'container': 'incoming-data-staging',
+    'path': f'{DEAD_LETTER_FILE_PATH_PREFIX}/{{kind}}/{{blob_prefix}}.json'
+}
+
 CSV_FILE_PATH_PREFIX = 'file-drop/EVRoam'
 
 CSV_FILE_PATH = {
@@ -36,4 +68,8 @@ For these providers we pull AVAILABILITIES_COLUMNS from chargingstations and dro
 assert JSON_TYPES.index('availabilities') > JSON_TYPES.index('chargingstations'), \
        "'availabilities' should come after 'chargingstations' in JSON_TYPES"
 AVAILABILITIES_COLUMNS = ['Operator', 'ChargingStationId', 'AvailabilityStatus', 'KwAvailable', 'AvailabilityTime']
-CHARGINGSTATIONS_DROP_COLUMNS = ['AvailabilityStatus', 'KwAvailable', 'AvailabilityTime']
\ No newline at end of file
+CHARGINGSTATIONS_DROP_COLUMNS = ['AvailabilityStatus', 'KwAvailable', 'AvailabilityTime']
+
+# Status codes of the append-only availability event log; the position in the list
+# is the stored code, so new statuses must only ever be appended
+AVAILABILITY_STATUSES = ['Unknown', 'Available', 'Occupied', 'Unavailable']
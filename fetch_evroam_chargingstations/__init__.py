@@ -9,16 +9,18 @@ the listener fails to receive the data.
 """
 
 import os
-import json
 import logging
 import datetime
-import http.client
-import urllib.parse
 import pandas as pd
-from inflection import camelize
 import azure.functions as func
 from constants import *
+from sharedCode import api_utils
 from sharedCode import database_utils
+from sharedCode import landing_utils
+from sharedCode import metrics_utils
+from sharedCode import pipeline_utils
+from sharedCode import schema_utils
+from sharedCode import watermark_utils
 
 # Ensure the subscription key is available
 SUBSCRIPTION_KEY = os.getenv("EvroamSubscriptionKey")
@@ -38,65 +40,88 @@ def main(mytimer: func.TimerRequest) -> None:
     if mytimer.past_due:
         logging.warning("The timer is past due!")
 
-    try:
-        all_data = fetch_evroam_chargingstations_data()
-        if all_data:
-            availabilities, chargingstations = process_data_to_dataframes(all_data)
-            logging.info("Charging Station and Availability data processed")
-            database_utils.write_availabilities_to_db(availabilities)
-            database_utils.write_chargingstations_to_db(chargingstations)
-            logging.info(
-                "Charging Station and Availability data written to SQL Database"
+    with metrics_utils.invocation("fetch_evroam_chargingstations"):
+        try:
+            fetch = watermark_utils.IncrementalFetch("chargingstations")
+            pages = api_utils.fetch_pages(
+                "ChargingStation",
+                "chargingStations",
+                SUBSCRIPTION_KEY,
+                params=fetch.params,
+                failures=fetch.failed_pages,
+            )
+            row_count = ingest_chargingstations(pages, fetch)
+            if fetch.received:
+                fetch.commit()
+                logging.info(
+                    "Charging Station and Availability data written to SQL Database: %s rows",
+                    row_count,
+                )
+            else:
+                logging.warning("No data was fetched from EVRoam.")
+        except Exception as exc: # pylint: disable=broad-except
+            logging.error(
+                "Failed to fetch and process EVRoam charging stations data: %s", exc
             )
-        else:
-            logging.warning("No data was fetched from EVRoam.")
-    except Exception as exc: # pylint: disable=broad-except
-        logging.error(
-            "Failed to fetch and process EVRoam charging stations data: %s", exc
-        )
 
     logging.info("Python timer trigger function ran at %s", utc_timestamp)
 
 
-def fetch_evroam_chargingstations_data():
+def ingest_chargingstations(pages, fetch=None):
     """
-    Fetches EVRoam charging stations data from the API.
+    Normalises, deduplicates and writes EVRoam charging stations and their
+    availabilities to the database as their pages arrive, a bounded batch of
+    pages at a time. Each raw batch is also landed as a part of one snapshot
+    in the Parquet landing zone.
+
+    Args:
+        pages (iterable): Lists of charging station results, one per API page.
+        fetch (watermark_utils.IncrementalFetch, optional): Selects the
+        availabilities changed since the last fetch. Charging stations are
+        always written, as `availabilityTime` does not date their changes.
+        All results are written if omitted.
+
+    Returns:
+        int: The number of unique charging stations written.
     """
-    headers = {"Ocp-Apim-Subscription-Key": SUBSCRIPTION_KEY}
-    all_data = []
-    result_page = 1
-    while True:
-        params = urllib.parse.urlencode({"resultPage": result_page})
-        try:
-            conn = http.client.HTTPSConnection("evroam.azure-api.net")
-            conn.request(
-                "GET", f"/consumer/api/ChargingStation?{params}", "{body}", headers
+    deduplicate_availabilities = pipeline_utils.KeyDeduplicator(
+        JSON_KEYS["availabilities"]
+    )
+    deduplicate_chargingstations = pipeline_utils.KeyDeduplicator(
+        JSON_KEYS["chargingstations"]
+    )
+    kind = "snapshot" if fetch is None or fetch.is_complete else "increment"
+    run_id = landing_utils.new_run_id()
+    row_count = 0
+    pages = metrics_utils.timed(pages, "fetch")
+    for part, batch in enumerate(pipeline_utils.batch_pages(pages)):
+        metrics_utils.add(received=len(batch))
+        with metrics_utils.stage("land"):
+            landing_utils.land_payload(
+                "chargingstations",
+                batch,
+                kind=kind,
+                source="ChargingStation",
+                run_id=run_id,
+                part=part,
             )
-            response = conn.getresponse()
-            if response.status in (200, 202):
-                data = json.loads(response.read())
-                all_data.extend(data["chargingStations"])
-                logging.info(
-                    "Successfully fetched page %s: %s charging stations",
-                    result_page,
-                    len(data["chargingStations"]),
-                )
-                if not data["hasMoreResults"]:
-                    break
-                result_page += 1
-            else:
-                logging.error(
-                    "Failed to fetch data: HTTP %s - %s",
-                    response.status,
-                    response.reason,
-                )
-                break
-        except http.client.HTTPException as http_exc:
-            logging.error("Error fetching data from EVRoam: %s", http_exc)
-            break
-        finally:
-            conn.close()
-    return all_data
+        changed = fetch.changed(batch) if fetch is not None else None
+        with metrics_utils.stage("normalize"):
+            availabilities, chargingstations = process_data_to_dataframes(batch)
+        with metrics_utils.stage("dedupe"):
+            unique = len(chargingstations)
+            chargingstations = deduplicate_chargingstations(chargingstations)
+            metrics_utils.add(deduped=unique - len(chargingstations))
+        logging.info("Charging Station and Availability data processed")
+        if availabilities is not None and changed is not None:
+            # Both frames keep the positions of `batch` as their index
+            availabilities = availabilities[changed[availabilities.index.to_numpy()]]
+        if availabilities is not None and len(availabilities):
+            availabilities = deduplicate_availabilities(availabilities)
+            database_utils.write_availabilities_to_db(availabilities)
+        database_utils.write_chargingstations_to_db(chargingstations)
+        row_count += len(chargingstations)
+    return row_count
 
 
 def process_data_to_dataframes(all_data):
@@ -105,26 +130,5 @@ def process_data_to_dataframes(all_data):
     charging stations and availabilities.
     """
     dataframe = pd.json_normalize(all_data)
-    corrected_columns = []
-    for col in dataframe.columns:
-        for character in CHARACTERS_TO_REPLACE:
-            col = col.replace(character, " ")
-        col = camelize(col.strip(), uppercase_first_letter=True).replace(" ", "")
-        corrected_columns.append(col)
-    dataframe.columns = corrected_columns
-
-    availabilities_df = dataframe[AVAILABILITIES_COLUMNS].copy()
-    availabilities_df.drop_duplicates(inplace=True, subset=JSON_KEYS["availabilities"])
-    availabilities_df.dropna(
-        inplace=True, subset=JSON_KEYS["availabilities"], how="any"
-    )
-
-    chargingstations_df = dataframe.drop(columns=CHARGINGSTATIONS_DROP_COLUMNS).copy()
-    chargingstations_df.drop_duplicates(
-        inplace=True, subset=JSON_KEYS["chargingstations"]
-    )
-    chargingstations_df.dropna(
-        inplace=True, subset=JSON_KEYS["chargingstations"], how="any"
-    )
-
-    return availabilities_df, chargingstations_df
+    schema_utils.normalize_columns(dataframe)
+    return pipeline_utils.split_chargingstations(dataframe)
@@ -9,16 +9,18 @@ the listener fails to receive the data.
 """
 
 import os
-import json
 import logging
 import datetime
-import http.client
-import urllib.parse
 import pandas as pd
-from inflection import camelize
 import azure.functions as func
 from constants import *
+from sharedCode import api_utils
 from sharedCode import database_utils
+from sharedCode import landing_utils
+from sharedCode import metrics_utils
+from sharedCode import pipeline_utils
+from sharedCode import schema_utils
+from sharedCode import watermark_utils
 
 # Ensure the subscription key is available
 SUBSCRIPTION_KEY = os.getenv("EvroamSubscriptionKey")
@@ -38,58 +40,67 @@ def main(mytimer: func.TimerRequest) -> None:
     if mytimer.past_due:
         logging.warning("The timer is past due!")
 
-    try:
-        all_data = fetch_evroam_sites_data()
-        if all_data:
-            data_frame = process_data_to_dataframe(all_data)
-            logging.info("Collected site data: %s rows", len(data_frame))
-            database_utils.write_sites_to_db(data_frame)
-            logging.info("Site data successfully written to SQL Database")
-        else:
-            logging.warning("No data was fetched from EVRoam.")
-    except Exception as exc:  # pylint: disable=broad-except
-        logging.error("Failed to fetch and process EVRoam sites data: %s", exc)
+    with metrics_utils.invocation("fetch_evroam_sites"):
+        try:
+            fetch = watermark_utils.IncrementalFetch("sites")
+            pages = api_utils.fetch_pages(
+                "Site",
+                "sites",
+                SUBSCRIPTION_KEY,
+                params=fetch.params,
+                failures=fetch.failed_pages,
+            )
+            row_count = ingest_sites(pages, fetch)
+            if fetch.received:
+                fetch.commit()
+                logging.info("Site data successfully written to SQL Database: %s rows", row_count)
+            else:
+                logging.warning("No data was fetched from EVRoam.")
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.error("Failed to fetch and process EVRoam sites data: %s", exc)
 
     logging.info("Python timer trigger function ran at %s", utc_timestamp)
 
 
-def fetch_evroam_sites_data():
+def ingest_sites(pages, fetch=None):
     """
-    Fetches EVRoam sites data from the API.
+    Normalises, deduplicates and writes EVRoam sites to the database as
+    their pages arrive, a bounded batch of pages at a time. Each raw batch is
+    also landed as a part of one snapshot in the Parquet landing zone.
+
+    Args:
+        pages (iterable): Lists of site results, one per API page.
+        fetch (watermark_utils.IncrementalFetch, optional): Selects the
+        results changed since the last fetch. All results are written if omitted.
+
+    Returns:
+        int: The number of unique sites written.
     """
-    headers = {"Ocp-Apim-Subscription-Key": SUBSCRIPTION_KEY}
-    all_data = []
-    result_page = 1
-    while True:
-        params = urllib.parse.urlencode({"resultPage": result_page})
-        try:
-            conn = http.client.HTTPSConnection("evroam.azure-api.net")
-            conn.request("GET", f"/consumer/api/Site?{params}", "{body}", headers)
-            response = conn.getresponse()
-            if response.status in (200, 202):
-                data = json.loads(response.read())
-                all_data.extend(data["sites"])
-                logging.info(
-                    "Successfully fetched page %s: %s sites",
-                    result_page,
-                    len(data["sites"]),
-                )
-                if not data["hasMoreResults"]:
-                    break
-                result_page += 1
-            else:
-                logging.error(
-                    "Failed to fetch data: HTTP %s - %s",
-                    response.status,
-                    response.reason,
-                )
-                break
-        except http.client.HTTPException as http_exc:
-            logging.error("Error fetching data from EVRoam: %s", http_exc)
-            break
-        finally:
-            conn.close()
-    return all_data
+    deduplicate = pipeline_utils.KeyDeduplicator(JSON_KEYS["sites"])
+    kind = "snapshot" if fetch is None or fetch.is_complete else "increment"
+    run_id = landing_utils.new_run_id()
+    row_count = 0
+    pages = metrics_utils.timed(pages, "fetch")
+    for part, batch in enumerate(pipeline_utils.batch_pages(pages)):
+        metrics_utils.add(received=len(batch))
+        with metrics_utils.stage("land"):
+            landing_utils.land_payload(
+                "sites", batch, kind=kind, source="Site", run_id=run_id, part=part
+            )
+        if fetch is not None:
+            batch = fetch.select(batch)
+            if not batch:
+                continue
+        with metrics_utils.stage("normalize"):
+            data_frame = process_data_to_dataframe(batch)
+        with metrics_utils.stage("dedupe"):
+            unique = len(data_frame)
+            data_frame = deduplicate(data_frame)
+            metrics_utils.add(deduped=unique - len(data_frame))
+        logging.info("Collected site data: %s rows", len(data_frame))
+        database_utils.write_sites_to_db(data_frame)
+        row_count += len(data_frame)
+    return row_count
 
 
 def process_data_to_dataframe(all_data):
@@ -97,13 +108,7 @@ def process_data_to_dataframe(all_data):
     Processes raw EVRoam sites data into a pandas DataFrame.
     """
     data_frame = pd.DataFrame(all_data)
-    corrected_columns = []
-    for col in data_frame.columns:
-        for character in CHARACTERS_TO_REPLACE:
-            col = col.replace(character, " ")
-        col = camelize(col.strip(), uppercase_first_letter=True).replace(" ", "")
-        corrected_columns.append(col)
-    data_frame.columns = corrected_columns
+    schema_utils.normalize_columns(data_frame)
     data_frame.drop_duplicates(inplace=True, subset=JSON_KEYS["sites"])
     logging.info("DataFrame prepared with %s unique sites.", len(data_frame))
     return data_frame
@@ -0,0 +1,34 @@
+"""
+This is a blob-triggered function.
+
+It processes the batches of EVRoam events staged by the `evroam_listener`
+function when it runs in "staged" mode: it downloads the data referenced by
+each event and enters it into the SQL database, then removes the staged batch.
+"""
+
+import json
+import logging
+
+import azure.functions as func
+from constants import JSON_FILE_PATH
+from sharedCode import event_utils
+from sharedCode import metrics_utils
+from sharedCode import storage_utils
+
+
+def main(blob: func.InputStream) -> None:
+    """
+    Main function for the Azure blob trigger that processes a staged
+    batch of EVRoam events.
+    """
+    logging.info("Processing staged EVRoam events: %s", blob.name)
+    events = json.loads(blob.read())
+
+    # The trigger reports the name as "<container>/<blob name>"
+    container = JSON_FILE_PATH["container"]
+    blob_name = blob.name.split("/", 1)[1] if "/" in blob.name else blob.name
+    with metrics_utils.invocation("process_evroam_events"):
+        event_utils.process_staged_events(
+            storage_utils.get_blob_store(container), blob_name, events
+        )
+    logging.info("Processed %s staged EVRoam events", len(events))
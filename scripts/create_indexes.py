@@ -0,0 +1,45 @@
+"""
+Script to create the indexes declared on the EVRoam models that are missing from the SQL database.
+
+The functions only log missing indexes when they start, since building an index
+on a large table takes long and every scaled-out worker would race to build it
+(unless `SqlCreateMissingIndexes` is true). Run this script once when deploying
+a change that declares new indexes; indexes that already exist are skipped.
+
+Usage:
+    python scripts/create_indexes.py dev
+    python scripts/create_indexes.py dev --local-database /tmp/evroam.db
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Create the missing EVRoam indexes.')
+parser.add_argument('env', choices=['dev', 'prd'], help='Environment (dev or prd)')
+parser.add_argument('--local-database', metavar='PATH',
+                    help='Use a SQLite file standing in for the SQL database')
+args = parser.parse_args()
+
+# Load environment variables from the repository root
+load_dotenv(dotenv_path=ROOT / '.env')
+os.environ['env'] = args.env
+
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+
+logging.basicConfig(level=logging.INFO)
+if args.local_database:
+    database_utils.set_engine(database_utils.get_local_engine(args.local_database))
+
+created = database_utils.create_missing_indexes(database_utils.get_engine())
+print(json.dumps(created))
@@ -7,15 +7,18 @@ import urllib.parse
 import pandas as pd
 from dotenv import load_dotenv
 from azure.storage.blob import BlobServiceClient
-from inflection import camelize
 from pathlib import Path
 
 sys.path.append(str(Path('..').resolve()))
 from constants import *
+from sharedCode import landing_utils
+from sharedCode import schema_utils
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Get environment (dev or prd)')
 parser.add_argument('env', type=str, help='Environment (dev or prd)')
+parser.add_argument('--from-landing', action='store_true',
+                    help='Read the latest landed snapshot instead of calling the API')
 args = parser.parse_args()
 
 # Load environment variables from the parent directory
@@ -38,32 +41,38 @@ headers = {
     'Ocp-Apim-Subscription-Key': SUBSCRIPTION_KEY,
 }
 
-all_data = []
-result_page = 1
+if args.from_landing:
+    # Read the snapshot last landed by the timer function
+    store = landing_utils.get_landing_store(CONNECTION_STRING)
+    df = landing_utils.read_latest_snapshot('sites', store)
+else:
+    all_data = []
+    result_page = 1
 
-while True:
-    params = urllib.parse.urlencode({
-        # Request parameters
-        'resultPage': result_page,
-    })
+    while True:
+        params = urllib.parse.urlencode({
+            # Request parameters
+            'resultPage': result_page,
+        })
 
-    try:
-        conn = http.client.HTTPSConnection('evroam.azure-api.net')
-        conn.request("GET", "/consumer/api/Site?%s" % params, "{body}", headers)
-        response = conn.getresponse()
-        data = json.loads(response.read())
-        all_data.extend(data["sites"])
-        conn.close()
-        if not data["hasMoreResults"]:
+        try:
+            conn = http.client.HTTPSConnection('evroam.azure-api.net')
+            conn.request("GET", "/consumer/api/Site?%s" % params, "{body}", headers)
+            response = conn.getresponse()
+            data = json.loads(response.read())
+            all_data.extend(data["sites"])
+            conn.close()
+            if not data["hasMoreResults"]:
+                break
+            result_page += 1
+        except Exception as e:
+            print(e)
             break
-        result_page += 1
-    except Exception as e:
-        print(e)
-        break
 
-# Create dataframe and pascal case columns
-df = pd.DataFrame(all_data)
-df.columns = [camelize(col, True) for col in df.columns]
+    # Create dataframe and pascal case columns
+    df = pd.DataFrame(all_data)
+
+schema_utils.normalize_columns(df)
 
 # Remove duplicates
 df.drop_duplicates(inplace=True, subset=JSON_KEYS['sites'])
@@ -0,0 +1,48 @@
+"""
+Script to migrate the EVRoam SCD Type 2 tables to the fixed-width hash keys.
+
+`ODSHashKey` is stored as BINARY(32) and computed from a canonical byte encoding
+of the hashed values. This script alters columns still declared VARBINARY(8000)
+and recomputes the hash key of every current row, so that records which have not
+changed are not versioned again by their next write (see
+`database_utils.migrate_hash_keys`). Run it once when deploying the change; it
+can be run again safely.
+
+Usage:
+    python scripts/migrate_hash_keys.py dev
+    python scripts/migrate_hash_keys.py dev --local-database /tmp/evroam.db
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Migrate the EVRoam tables to fixed-width hash keys.')
+parser.add_argument('env', choices=['dev', 'prd'], help='Environment (dev or prd)')
+parser.add_argument('--local-database', metavar='PATH',
+                    help='Migrate a SQLite file standing in for the SQL database')
+parser.add_argument('--chunk-rows', type=int, help='Current rows read and updated at a time')
+args = parser.parse_args()
+
+# Load environment variables from the repository root
+load_dotenv(dotenv_path=ROOT / '.env')
+os.environ['env'] = args.env
+
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+
+logging.basicConfig(level=logging.INFO)
+if args.local_database:
+    database_utils.set_engine(database_utils.get_local_engine(args.local_database))
+
+totals = database_utils.migrate_hash_keys(database_utils.get_engine(), args.chunk_rows)
+print(json.dumps(totals))
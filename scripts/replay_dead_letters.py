@@ -0,0 +1,63 @@
+"""
+Script to replay the EVRoam webhook events saved to the dead-letter store.
+
+Events that the listener could not download or write to the SQL database are saved
+to the dead-letter store (`EVRoamDeadLetter/events/` in the staging container).
+Once the cause is fixed, this script re-processes them in bulk, downloading the
+events without a saved payload concurrently, instead of waiting for the next
+timer snapshot. Replaying is idempotent, so it can be run again after a failure.
+
+The storage account connection string is read from DEV_CONNECTION_STRING or
+PRD_CONNECTION_STRING in the `.env` file of the repository root. For a local run,
+`--local` reads the dead-letter store from the filesystem stand-in instead, and
+`--local-database` writes to a SQLite file standing in for the database.
+
+Usage:
+    python scripts/replay_dead_letters.py dev
+    python scripts/replay_dead_letters.py dev --local /tmp/blobs --local-database /tmp/evroam.db
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT))
+
+# Parse command line arguments
+parser = argparse.ArgumentParser(description='Replay dead-lettered EVRoam events.')
+parser.add_argument('env', choices=['dev', 'prd'], help='Environment (dev or prd)')
+parser.add_argument('--local', metavar='DIRECTORY',
+                    help='Read the dead-letter store from the filesystem stand-in in DIRECTORY')
+parser.add_argument('--local-database', metavar='PATH',
+                    help='Write to a SQLite file standing in for the SQL database')
+parser.add_argument('--workers', type=int, help='Concurrent downloads')
+parser.add_argument('--batch-events', type=int, help='Events processed together')
+args = parser.parse_args()
+
+# Load environment variables from the repository root
+load_dotenv(dotenv_path=ROOT / '.env')
+os.environ['env'] = args.env
+if args.local:
+    os.environ['LocalBlobStoragePath'] = args.local
+CONNECTION_STRING = os.getenv(f"{args.env.upper()}_CONNECTION_STRING")
+
+# pylint: disable=wrong-import-position
+from sharedCode import database_utils
+from sharedCode import deadletter_utils
+from sharedCode import event_utils
+
+logging.basicConfig(level=logging.INFO)
+if args.local_database:
+    database_utils.set_engine(database_utils.get_local_engine(args.local_database))
+
+store = deadletter_utils.get_dead_letter_store(CONNECTION_STRING)
+totals = event_utils.replay_dead_letters(
+    store, workers=args.workers, batch_events=args.batch_events
+)
+print(json.dumps(totals))
@@ -0,0 +1,224 @@
+"""
+This module provides a paginated client for the EVRoam consumer API, shared by the
+timer-triggered fallback functions. Pages are fetched over a pooled keep-alive
+session; once the first page reports more results, later pages are prefetched
+concurrently, and transient failures are retried with exponential backoff.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+API_BASE_URL = os.getenv(
+    "EvroamApiBaseUrl", "https://evroam.azure-api.net/consumer/api"
+)
+TIMEOUT = 30
+# Number of pages requested concurrently after the first page
+PAGE_CONCURRENCY = int(os.getenv("EvroamPageConcurrency", "4"))
+MAX_RETRIES = int(os.getenv("EvroamMaxRetries", "4"))
+RETRY_BACKOFF = float(os.getenv("EvroamRetryBackoff", "1.0"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_http_session_lock = threading.Lock()
+_http_session = {}
+
+
+def get_http_session():
+    """
+    Returns the process-wide requests session used for the EVRoam API.
+
+    The session keeps enough keep-alive connections for `PAGE_CONCURRENCY`
+    concurrent page requests.
+    """
+    with _http_session_lock:
+        if "session" not in _http_session:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=max(PAGE_CONCURRENCY, 1)
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session["session"] = session
+        return _http_session["session"]
+
+
+def _retry_delay(response, attempt):
+    """Returns how long to wait before retrying, honouring Retry-After."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return RETRY_BACKOFF * 2**attempt
+
+
+def fetch_page(endpoint, result_page, subscription_key, base_url=None, params=None):
+    """
+    Fetches one page of an EVRoam API endpoint, retrying transient failures.
+
+    Responses with a status in `RETRY_STATUSES` and connection errors are
+    retried up to `MAX_RETRIES` times with exponential backoff.
+
+    Args:
+        endpoint (str): The API endpoint, e.g. "Site" or "ChargingStation".
+        result_page (int): The 1-based page number.
+        subscription_key (str): The EVRoam API subscription key.
+        base_url (str, optional): The API base URL. Defaults to `API_BASE_URL`.
+        params (dict, optional): Extra query parameters sent with the request.
+
+    Returns:
+        dict: The decoded page, or None if it could not be fetched.
+    """
+    url = f"{base_url or API_BASE_URL}/{endpoint}"
+    headers = {"Ocp-Apim-Subscription-Key": subscription_key}
+    for attempt in range(MAX_RETRIES + 1):
+        response = None
+        try:
+            response = get_http_session().get(
+                url,
+                params={**(params or {}), "resultPage": result_page},
+                headers=headers,
+                timeout=TIMEOUT,
+            )
+            if response.status_code in (200, 202):
+                return response.json()
+            if response.status_code not in RETRY_STATUSES:
+                logging.error(
+                    "Failed to fetch data: HTTP %s - %s",
+                    response.status_code,
+                    response.reason,
+                )
+                return None
+            error = f"HTTP {response.status_code} - {response.reason}"
+        except (requests.exceptions.RequestException, ValueError) as exc:
+            error = exc
+        if attempt < MAX_RETRIES:
+            delay = _retry_delay(response, attempt)
+            logging.warning(
+                "Retrying page %s of %s in %.1f s after: %s",
+                result_page,
+                endpoint,
+                delay,
+                error,
+            )
+            time.sleep(delay)
+    logging.error(
+        "Error fetching page %s of %s from EVRoam: %s", result_page, endpoint, error
+    )
+    return None
+
+
+def fetch_pages(
+    endpoint, result_key, subscription_key, base_url=None, params=None, failures=None
+):
+    """
+    Fetches every page of an EVRoam API endpoint, yielding the results of
+    each page in page order.
+
+    The first page is fetched on its own. If it reports `hasMoreResults`,
+    later pages are requested concurrently, keeping at most
+    `PAGE_CONCURRENCY` requests in flight, until a page reports that there
+    are no more results. A page that fails after retries is logged and
+    skipped without stopping the remaining pages, and its number is appended
+    to `failures` if given.
+
+    Args:
+        endpoint (str): The API endpoint, e.g. "Site" or "ChargingStation".
+        result_key (str): The key of the result list in each page, e.g. "sites".
+        subscription_key (str): The EVRoam API subscription key.
+        base_url (str, optional): The API base URL. Defaults to `API_BASE_URL`.
+        params (dict, optional): Extra query parameters sent with every request.
+        failures (list, optional): Receives the number of each skipped page.
+
+    Yields:
+        list: The results of each page.
+    """
+    first_page = fetch_page(endpoint, 1, subscription_key, base_url, params)
+    if first_page is None:
+        if failures is not None:
+            failures.append(1)
+        return
+    logging.info(
+        "Successfully fetched page 1: %s %s", len(first_page[result_key]), result_key
+    )
+    yield first_page[result_key]
+    if not first_page["hasMoreResults"]:
+        return
+
+    concurrency = max(PAGE_CONCURRENCY, 1)
+    last_page = None
+    next_page = 2
+    next_to_yield = 2
+    completed = {}
+    failed_pages = set()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        in_flight = {}
+        while True:
+            while len(in_flight) < concurrency and (
+                last_page is None or next_page <= last_page
+            ):
+                future = executor.submit(
+                    fetch_page, endpoint, next_page, subscription_key, base_url, params
+                )
+                in_flight[future] = next_page
+                next_page += 1
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result_page = in_flight.pop(future)
+                data = future.result()
+                completed[result_page] = data
+                end_page = None
+                if data is not None and not data["hasMoreResults"]:
+                    end_page = result_page
+                elif data is None:
+                    failed_pages.add(result_page)
+                    # A run of failed pages means the API is down or past its end
+                    if all(
+                        result_page - offset in failed_pages
+                        for offset in range(concurrency)
+                    ):
+                        end_page = result_page
+                if end_page is not None:
+                    last_page = end_page if last_page is None else min(last_page, end_page)
+            while next_to_yield in completed and (
+                last_page is None or next_to_yield <= last_page
+            ):
+                data = completed.pop(next_to_yield)
+                if data is not None:
+                    logging.info(
+                        "Successfully fetched page %s: %s %s",
+                        next_to_yield,
+                        len(data[result_key]),
+                        result_key,
+                    )
+                    yield data[result_key]
+                elif failures is not None:
+                    failures.append(next_to_yield)
+                next_to_yield += 1
+
+
+def fetch_all(endpoint, result_key, subscription_key, base_url=None, params=None):
+    """
+    Fetches every page of an EVRoam API endpoint.
+
+    Args:
+        endpoint (str): The API endpoint, e.g. "Site" or "ChargingStation".
+        result_key (str): The key of the result list in each page, e.g. "sites".
+        subscription_key (str): The EVRoam API subscription key.
+        base_url (str, optional): The API base URL. Defaults to `API_BASE_URL`.
+        params (dict, optional): Extra query parameters sent with every request.
+
+    Returns:
+        list: The results of all pages.
+    """
+    all_data = []
+    for page in fetch_pages(endpoint, result_key, subscription_key, base_url, params):
+        all_data.extend(page)
+    return all_data
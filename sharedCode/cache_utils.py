@@ -0,0 +1,173 @@
+"""
+This module provides a per-worker cache of the current SCD Type 2 version of records,
+used to drop unchanged incoming rows before any database round trip.
+
+The cache maps a record key (e.g. a ChargingStationId) to the `ODSHashKey` of its
+current row, plus an optional value kept alongside for diagnostics (e.g. the
+AvailabilityStatus). Entries expire after a TTL and the least recently used entries
+are evicted beyond a maximum size. Any failed write must invalidate the cache, since
+the database may then differ from what the cache believes.
+
+It also provides a bounded, expiring set of recently seen keys, used to drop
+redelivered events.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class CurrentRowCache:
+    """
+    A bounded, expiring map of record key to current hash key.
+
+    Args:
+        ttl_seconds (float): How long an entry is trusted after it was stored.
+        max_size (int): Maximum number of entries; 0 disables the cache.
+        clock (callable, optional): Returns the current time in seconds.
+    """
+
+    def __init__(self, ttl_seconds, max_size, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._loaded_at = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        """Whether the cache stores anything at all."""
+        return self.max_size > 0
+
+    @property
+    def is_loaded(self):
+        """Whether the cache has been filled from the database within the TTL."""
+        with self._lock:
+            return (
+                self._loaded_at is not None
+                and self._clock() - self._loaded_at < self.ttl_seconds
+            )
+
+    def load(self, rows):
+        """
+        Replaces the contents of the cache with the current rows of a table.
+
+        Args:
+            rows (iterable): (key, hash key, value) tuples.
+        """
+        with self._lock:
+            now = self._clock()
+            self._entries.clear()
+            for key, hash_key, value in rows:
+                self._store(key, hash_key, value, now)
+            self._loaded_at = now
+            self.loads += 1
+
+    def get(self, key):
+        """
+        Returns the cached (hash key, value) of `key`, or None on a miss.
+
+        Expired entries count as misses and are removed.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._clock() - entry[2] >= self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, hash_key, value=None):
+        """Records `hash_key` as the current hash key of `key`."""
+        with self._lock:
+            self._store(key, hash_key, value, self._clock())
+
+    def _store(self, key, hash_key, value, now):
+        if not self.enabled:
+            return
+        self._entries[key] = (hash_key, value, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        """Empties the cache so it is filled from the database again."""
+        with self._lock:
+            self._entries.clear()
+            self._loaded_at = None
+            self.invalidations += 1
+
+    def stats(self):
+        """Returns the cache counters as a dictionary."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "loads": self.loads,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+            }
+
+
+class RecentKeys:
+    """
+    A bounded set of keys, each forgotten `ttl_seconds` after it was added.
+
+    Args:
+        ttl_seconds (float): How long a key is remembered.
+        max_size (int): Maximum number of keys; the oldest are forgotten first.
+        clock (callable, optional): Returns the current time in seconds.
+    """
+
+    def __init__(self, ttl_seconds, max_size, clock=time.monotonic):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._keys = OrderedDict()
+
+    def _expire(self, now):
+        """Forgets the keys added `ttl_seconds` or more before `now`."""
+        while self._keys:
+            oldest, added = next(iter(self._keys.items()))
+            if now - added < self.ttl_seconds:
+                break
+            del self._keys[oldest]
+
+    def __contains__(self, key):
+        """Whether `key` is remembered."""
+        with self._lock:
+            self._expire(self._clock())
+            return key in self._keys
+
+    def add(self, key):
+        """Remembers `key`, returning whether it was not already remembered."""
+        with self._lock:
+            now = self._clock()
+            self._expire(now)
+            if key in self._keys:
+                return False
+            if self.max_size > 0:
+                self._keys[key] = now
+                while len(self._keys) > self.max_size:
+                    self._keys.popitem(last=False)
+            return True
+
+    def clear(self):
+        """Forgets every key."""
+        with self._lock:
+            self._keys.clear()
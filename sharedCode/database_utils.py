@@ -5,28 +5,117 @@ functions to add or update these entities using SCD Type 2 logic.
 """
 
 import os
+import re
 import json
 import urllib
 import logging
 import hashlib
+import threading
+import time
 from datetime import datetime
+import functools
 from contextlib import contextmanager
+from contextvars import ContextVar
 import pyodbc
 import sqlalchemy
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine, CHAR
+from sqlalchemy import create_engine, event, inspect, text, true, false, CHAR
+from sqlalchemy import select, insert, update, delete, exists, func
+from sqlalchemy import MetaData, Table, case, literal, null
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import String, Float, Boolean, Integer, DateTime
-from sqlalchemy import Column, VARBINARY
+from sqlalchemy import BigInteger, Date, SmallInteger
+from sqlalchemy import Column, Index, BINARY
+from constants import AVAILABILITY_STATUSES, MAX_JSON_INGEST_BATCH
+from sharedCode import deadletter_utils
+from sharedCode import metrics_utils
+from sharedCode.cache_utils import CurrentRowCache
 
 
 env = os.getenv("env", "dev")
 
 SCHEMA = "EECAEVRoam"
 
+# SQL Server accepts at most 2100 parameters per statement, so set-based
+# lookups and expirations are issued in chunks below that limit.
+MERGE_CHUNK_SIZE = 2000
+
+# SCD Type 2 write backend: "merge" works out the changes in Python, "staged"
+# stages the rows in a temporary table and applies them with set-based SQL
+WRITE_BACKEND = os.getenv("SqlWriteBackend", "merge").lower()
+# Send executemany batches to SQL Server as parameter arrays
+FAST_EXECUTEMANY = os.getenv("SqlFastExecutemany", "true").lower() == "true"
+
+# Rows written per transaction by the write_*_to_db functions; 0 writes a
+# DataFrame in a single transaction
+INGEST_BATCH_ROWS = int(os.getenv("SqlIngestBatchRows", str(MAX_JSON_INGEST_BATCH)))
+
+# Availability storage: "scd2" keeps versioned rows in dboEVRoamAvailabilities,
+# "events" appends to an event log and upserts a current-status table
+AVAILABILITY_STORAGE_MODE = os.getenv("AvailabilityStorageMode", "scd2").lower()
+
+# Per-worker cache of current availability hash keys; a size of 0 disables it
+AVAILABILITY_CACHE = CurrentRowCache(
+    ttl_seconds=float(os.getenv("AvailabilityCacheTtl", "900")),
+    max_size=int(os.getenv("AvailabilityCacheSize", "50000")),
+)
+
+# Size of the SHA-256 digests stored in the fixed-width ODSHashKey columns
+HASH_KEY_BYTES = 32
+
+# Connection pool settings for the process-wide engine
+POOL_SIZE = int(os.getenv("SqlPoolSize", "5"))
+POOL_MAX_OVERFLOW = int(os.getenv("SqlPoolMaxOverflow", "5"))
+POOL_PRE_PING = os.getenv("SqlPoolPrePing", "true").lower() == "true"
+# Azure SQL closes idle connections after 30 minutes
+POOL_RECYCLE = int(os.getenv("SqlPoolRecycle", "1800"))
+
+# Opt-in statement profiling of the write_*_to_db functions: the statements of
+# each call are summed by shape and the SqlProfileTop slowest shapes are logged
+SQL_PROFILE = os.getenv("SqlProfileStatements", "false").lower() == "true"
+SQL_PROFILE_TOP = int(os.getenv("SqlProfileTop", "10"))
+# A statement shape executed row by row this many times in one call is an N+1 pattern
+SQL_PROFILE_N_PLUS_ONE = int(os.getenv("SqlProfileNPlusOne", "20"))
+
+ODBC_DRIVERS = [
+    "ODBC Driver 18 for SQL Server",
+    "ODBC Driver 17 for SQL Server",
+    "ODBC Driver 13 for SQL Server",
+]
+
 Base = declarative_base()
 
+# Filter of the current-row indexes: the SCD Type 2 writes only look up the
+# current version of each key, so history does not grow these indexes. Queries
+# compare ODSIsCurrent with `true()`, which renders the literal 1: neither SQL
+# Server nor SQLite matches a filtered index to a bound parameter.
+CURRENT_ROWS = text("ODSIsCurrent = 1")
+
+# Create declared indexes missing from existing tables when the engine is set
+# up; by default they are only reported, and created by scripts/create_indexes.py
+CREATE_MISSING_INDEXES = os.getenv("SqlCreateMissingIndexes", "false").lower() == "true"
+
+
+def current_row_index(name, key, *include):
+    """
+    Declares the filtered index of the current versions of an SCD Type 2
+    table, keyed by its unique key and covering `include` on SQL Server.
+
+    The surrogate primary key is clustered on SQL Server and is the rowid on
+    SQLite, so every index already carries it.
+    """
+    return Index(
+        name,
+        key,
+        mssql_where=CURRENT_ROWS,
+        mssql_include=list(include),
+        sqlite_where=CURRENT_ROWS,
+    )
+
 # pylint: disable=too-few-public-methods
 # pylint: disable=broad-exception-caught
 
@@ -39,7 +128,10 @@ class EVRoamSites(Base):
     """
 
     __tablename__ = "dboEVRoamSites"
-    __table_args__ = {"schema": SCHEMA}
+    __table_args__ = (
+        current_row_index("IX_Sites_Current", "SiteId", "ODSHashKey"),
+        {"schema": SCHEMA},
+    )
     SiteId = Column(
         String(255),
         index=True,
@@ -98,7 +190,7 @@ class EVRoamSites(Base):
     )
     ODSDMLType = Column(CHAR(1), info={"description": "Type of DML operation."})
     ODSHashKey = Column(
-        VARBINARY(8000), info={"description": "Hash key for detecting changes."}
+        BINARY(HASH_KEY_BYTES), info={"description": "Hash key for detecting changes."}
     )
     ODSExternalID = Column(
         String(50), info={"description": "External ID for reference."}
@@ -113,7 +205,10 @@ class EVRoamChargingStations(Base):
     """
 
     __tablename__ = "dboEVRoamChargingStations"
-    __table_args__ = {"schema": SCHEMA}
+    __table_args__ = (
+        current_row_index("IX_ChargingStations_Current", "ChargingStationId", "ODSHashKey"),
+        {"schema": SCHEMA},
+    )
     ChargingStationId = Column(
         String(255),
         index=True,
@@ -248,7 +343,7 @@ class EVRoamChargingStations(Base):
     )
     ODSDMLType = Column(CHAR(1), info={"description": "Type of DML operation."})
     ODSHashKey = Column(
-        VARBINARY(8000), info={"description": "Hash key for detecting changes."}
+        BINARY(HASH_KEY_BYTES), info={"description": "Hash key for detecting changes."}
     )
     ODSExternalID = Column(
         String(50), info={"description": "External ID for reference."}
@@ -263,7 +358,17 @@ class EVRoamAvailabilities(Base):
     """
 
     __tablename__ = "dboEVRoamAvailabilities"
-    __table_args__ = {"schema": SCHEMA}
+    __table_args__ = (
+        current_row_index(
+            "IX_Availabilities_Current",
+            "ChargingStationId",
+            "ODSHashKey",
+            "AvailabilityStatus",
+            "AvailabilityTime",
+        ),
+        Index("IX_Availabilities_Time", "AvailabilityTime"),
+        {"schema": SCHEMA},
+    )
     ChargingStationId = Column(
         String(255),
         info={
@@ -351,7 +456,7 @@ class EVRoamAvailabilities(Base):
         },
     )
     ODSHashKey = Column(
-        VARBINARY(8000),
+        BINARY(HASH_KEY_BYTES),
         info={
             "description": "A hash key generated from the record's contents to detect changes."
         },
@@ -367,46 +472,376 @@ class EVRoamAvailabilities(Base):
     )
 
 
-def get_engine(verbose=False):
+class EVRoamAvailabilityEvents(Base):
+    """
+    Append-only log of EVRoam availability events, used instead of the SCD Type 2
+    availability table when `AvailabilityStorageMode` is "events". Rows are never
+    updated; statuses are stored as codes into `AVAILABILITY_STATUSES`, power as a
+    single-precision float and times as epoch seconds, and every row carries the
+    UTC day it belongs to so the table can be partitioned and purged by day.
     """
-    Creates and returns a SQLAlchemy engine instance configured
-    for Azure SQL Database using Active Directory MSI authentication.
 
-    The function constructs the connection URL dynamically using
-    environment variables to determine the environment ('dev' by
-    default) and constructs the connection string accordingly.
+    __tablename__ = "dboEVRoamAvailabilityEvents"
+    __table_args__ = (
+        Index("IX_AvailabilityEvents_Station", "ChargingStationId", "AvailabilityEpoch"),
+        {"schema": SCHEMA},
+    )
+    EventId = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+        info={"description": "Auto-incremented primary key."},
+    )
+    PartitionDate = Column(
+        Date,
+        index=True,
+        info={"description": "UTC day of the availability event (partition key)."},
+    )
+    ChargingStationId = Column(
+        String(255),
+        info={"description": "The charging station this event pertains to."},
+    )
+    StatusCode = Column(
+        SmallInteger,
+        info={"description": "Index of the availability status in AVAILABILITY_STATUSES."},
+    )
+    KwAvailable = Column(
+        Float(precision=24),
+        info={"description": "The amount of power (in kW) available at the station."},
+    )
+    AvailabilityEpoch = Column(
+        BigInteger,
+        info={"description": "Time of the availability status, in seconds since the epoch."},
+    )
 
-    Returns:
-        sqlalchemy.engine.Engine: An instance of SQLAlchemy engine
-        connected to the specified Azure SQL Database.
+
+class EVRoamAvailabilityStatus(Base):
+    """
+    Holds the latest availability event of every EVRoam charging station. It is kept
+    up to date with an upsert alongside `EVRoamAvailabilityEvents`, so the current
+    status can be read without scanning the event log.
+    """
+
+    __tablename__ = "dboEVRoamAvailabilityStatus"
+    __table_args__ = {"schema": SCHEMA}
+    ChargingStationId = Column(
+        String(255),
+        primary_key=True,
+        info={"description": "The charging station this status pertains to."},
+    )
+    Operator = Column(
+        String(255), info={"description": "Operator of the charging station."}
+    )
+    StatusCode = Column(
+        SmallInteger,
+        info={"description": "Index of the availability status in AVAILABILITY_STATUSES."},
+    )
+    KwAvailable = Column(
+        Float(precision=24),
+        info={"description": "The amount of power (in kW) available at the station."},
+    )
+    AvailabilityEpoch = Column(
+        BigInteger,
+        info={"description": "Time of the availability status, in seconds since the epoch."},
+    )
+    WaterMark = Column(
+        DateTime,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        info={"description": "Timestamp for the last update of this record."},
+    )
+
+
+class PoolStats:
+    """
+    Collects connection pool metrics for the process-wide engine.
+
+    Checkout latency is the time taken to obtain a connection for a session,
+    which includes opening a new connection when the pool has none idle.
+    Saturation is the share of the pool capacity checked out at once.
+    """
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.total_checkout_seconds = 0.0
+        self.max_checkout_seconds = 0.0
+        self.last_checkout_seconds = 0.0
+
+    def on_connect(self, *_):
+        """Pool event handler for a new DBAPI connection."""
+        with self._lock:
+            self.connects += 1
+
+    def on_checkout(self, *_):
+        """Pool event handler for a connection leaving the pool."""
+        with self._lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def on_checkin(self, *_):
+        """Pool event handler for a connection returning to the pool."""
+        with self._lock:
+            self.in_use = max(self.in_use - 1, 0)
+
+    def record_checkout(self, seconds):
+        """Records how long a session waited for its connection."""
+        with self._lock:
+            self.checkouts += 1
+            self.total_checkout_seconds += seconds
+            self.max_checkout_seconds = max(self.max_checkout_seconds, seconds)
+            self.last_checkout_seconds = seconds
+
+    def snapshot(self):
+        """Returns the current metrics as a dictionary."""
+        with self._lock:
+            saturation = self.in_use / self.capacity if self.capacity else None
+            peak_saturation = (
+                self.peak_in_use / self.capacity if self.capacity else None
+            )
+            return {
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "capacity": self.capacity,
+                "saturation": saturation,
+                "peak_saturation": peak_saturation,
+                "last_checkout_ms": self.last_checkout_seconds * 1000,
+                "mean_checkout_ms": (
+                    self.total_checkout_seconds / self.checkouts * 1000
+                    if self.checkouts
+                    else 0.0
+                ),
+                "max_checkout_ms": self.max_checkout_seconds * 1000,
+            }
+
+
+_STATEMENT_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_STATEMENT_PARAMETERS = re.compile(r"\?|%\(\w+\)s|:\w+")
+_STATEMENT_PARAMETER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_STATEMENT_QUOTES = re.compile(r"[\[\]\"]")
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+([\w.\[\]\"#]+)", re.IGNORECASE)
+
+
+def statement_shape(statement):
+    """
+    Returns the shape of a SQL statement: its text with literals and bind
+    parameters replaced by `?`, lists of parameters collapsed to `(?...)` and
+    whitespace collapsed, so that executions differing only in their values or
+    in the length of an IN list share one shape.
     """
+    shape = _STATEMENT_LITERALS.sub("?", statement)
+    shape = _STATEMENT_PARAMETERS.sub("?", shape)
+    shape = _STATEMENT_PARAMETER_LISTS.sub("(?...)", shape)
+    return " ".join(shape.split())
+
+
+def _statement_label(shape):
+    """Returns a short label of a statement shape, e.g. "UPDATE EECAEVRoam.dboEVRoamSites"."""
+    verb = shape.split(" ", 1)[0].upper()
+    table = _STATEMENT_TABLE.search(shape)
+    if table is None:
+        return verb
+    return f"{verb} {_STATEMENT_QUOTES.sub('', table.group(1))}"
+
+
+class StatementProfile:
+    """
+    Sums the time and count of the SQL statements sent during one call of a
+    profiled function, by statement shape (see `statement_shape`).
+
+    A shape executed one row at a time at least `SQL_PROFILE_N_PLUS_ONE` times
+    is flagged as an N+1 pattern: a per-row lookup or flush that a set-based
+    statement could replace.
+
+    Args:
+        name (str): The name of the profiled call.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.shapes = {}
+
+    def record(self, statement, seconds, rows, executemany):
+        """Adds one execution of `statement` handling `rows` parameter sets."""
+        shape = statement_shape(statement)
+        with self._lock:
+            entry = self.shapes.get(shape)
+            if entry is None:
+                entry = self.shapes[shape] = {
+                    "label": _statement_label(shape),
+                    "shape": shape,
+                    "count": 0,
+                    "rows": 0,
+                    "seconds": 0.0,
+                    "executemany": 0,
+                }
+            entry["count"] += 1
+            entry["rows"] += rows
+            entry["seconds"] += seconds
+            entry["executemany"] += int(executemany)
+
+    def report(self, top=None):
+        """Returns the `top` shapes by total time, slowest first, as dictionaries."""
+        with self._lock:
+            entries = sorted(
+                (dict(entry) for entry in self.shapes.values()),
+                key=lambda entry: entry["seconds"],
+                reverse=True,
+            )
+        return entries[:top] if top else entries
+
+    def n_plus_one(self):
+        """Returns the shapes executed row by row often enough to be N+1 patterns."""
+        return [
+            entry
+            for entry in self.report()
+            if entry["count"] >= SQL_PROFILE_N_PLUS_ONE
+            and entry["executemany"] == 0
+            and entry["rows"] <= entry["count"]
+        ]
+
+    def log(self, top=None):
+        """Logs the slowest shapes, and a warning for each N+1 pattern."""
+        entries = self.report()
+        logging.info(
+            "SQL profile of %s: %s statements in %.1f ms",
+            self.name,
+            sum(entry["count"] for entry in entries),
+            sum(entry["seconds"] for entry in entries) * 1000,
+        )
+        for rank, entry in enumerate(entries[: top or SQL_PROFILE_TOP], start=1):
+            logging.info(
+                "  %s. %s: %s executions, %s parameter sets, %.1f ms: %s",
+                rank,
+                entry["label"],
+                entry["count"],
+                entry["rows"],
+                entry["seconds"] * 1000,
+                entry["shape"][:200],
+            )
+        for entry in self.n_plus_one():
+            logging.warning(
+                "Possible N+1 pattern in %s: %s executed %s times one row at a time",
+                self.name,
+                entry["label"],
+                entry["count"],
+            )
+
+
+_statement_profile = ContextVar("statement_profile", default=None)
+
+
+class StatementProfiler:
+    """
+    Times every statement sent through an engine and records it in the
+    `StatementProfile` of the running profiled call, if any.
+    """
+
+    def before_execute(self, _conn, _cursor, _statement, _parameters, context, _executemany):
+        """Engine `before_cursor_execute` handler."""
+        context.profile_started = time.perf_counter()
+
+    def after_execute(self, _conn, _cursor, statement, parameters, context, executemany):
+        """Engine `after_cursor_execute` handler."""
+        seconds = time.perf_counter() - context.profile_started
+        profile = _statement_profile.get()
+        if profile is not None:
+            rows = len(parameters) if executemany else 1
+            profile.record(statement, seconds, rows, executemany)
+
+
+@contextmanager
+def profile_statements(name):
+    """
+    Profiles the SQL statements sent in the enclosed block when `SQL_PROFILE`
+    is enabled, and logs the report when it ends.
+
+    Yields:
+        StatementProfile: The profile of the block, or None when disabled.
+    """
+    if not SQL_PROFILE:
+        yield None
+        return
+    profile = StatementProfile(name)
+    token = _statement_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _statement_profile.reset(token)
+        profile.log()
+
+
+def profiled(function):
+    """Decorator profiling the SQL statements of every call of a function."""
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with profile_statements(function.__name__):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+_engine_lock = threading.RLock()
+_engine_state = {
+    "engine": None,
+    "driver": None,
+    "session_factory": None,
+    "pool_stats": PoolStats(),
+}
+
+
+def _connection_url(driver):
+    """Builds the Azure SQL Database connection URL for an ODBC driver."""
     server = f"eeca-sql-{env}-aue.database.windows.net"
     database = f"eeca-sqldb-{env}-aue-01"
     if os.getenv("WEBSITE_HOSTNAME"):
         auth_method = "Authentication=ActiveDirectoryMsi"
     else:
         auth_method = "Authentication=ActiveDirectoryInteractive"
-    drivers_to_try = [
-        "ODBC Driver 18 for SQL Server",
-        "ODBC Driver 17 for SQL Server",
-        "ODBC Driver 13 for SQL Server",
+    params = urllib.parse.quote_plus(
+        f"Driver={{{driver}}};"
+        f"Server=tcp:{server},1433;"
+        f"Database={database};"
+        f"{auth_method};"
+        "Encrypt=yes;"
+        "TrustServerCertificate=no;"
+        "Connection Timeout=30;"
+    )
+    return f"mssql+pyodbc:///?odbc_connect={params}"
+
+
+def _create_azure_engine(verbose=False):
+    """
+    Creates a pooled engine for the Azure SQL Database, trying each ODBC
+    driver in turn. The driver that worked last time is tried first.
+    """
+    remembered = _engine_state["driver"]
+    drivers_to_try = ([remembered] if remembered else []) + [
+        driver for driver in ODBC_DRIVERS if driver != remembered
     ]
     for driver in drivers_to_try:
         try:
-            params = urllib.parse.quote_plus(
-                f"Driver={{{driver}}};"
-                f"Server=tcp:{server},1433;"
-                f"Database={database};"
-                f"{auth_method};"
-                "Encrypt=yes;"
-                "TrustServerCertificate=no;"
-                "Connection Timeout=30;"
+            engine = create_engine(
+                _connection_url(driver),
+                echo=verbose,
+                pool_size=POOL_SIZE,
+                max_overflow=POOL_MAX_OVERFLOW,
+                pool_pre_ping=POOL_PRE_PING,
+                pool_recycle=POOL_RECYCLE,
+                fast_executemany=FAST_EXECUTEMANY,
             )
-            connection_url = f"mssql+pyodbc:///?odbc_connect={params}"
-            engine = create_engine(connection_url, echo=verbose)
             # Test the connection
             with engine.connect() as _:
                 logging.info("Successfully connected using %s", driver)
+                _engine_state["driver"] = driver
                 return engine
         except sqlalchemy.exc.DBAPIError as error:
             logging.info("Failed to connect using %s: %s", driver, error)
@@ -418,6 +853,110 @@ def get_engine(verbose=False):
     raise Exception("Failed to connect to SQL using any of the drivers tried.")
 
 
+def _pool_capacity(pool):
+    """Returns how many connections a pool hands out at most, if it is bounded."""
+    if isinstance(pool, QueuePool):
+        # pylint: disable=protected-access
+        return pool.size() + max(getattr(pool, "_max_overflow", 0), 0)
+    if isinstance(pool, StaticPool):
+        return 1
+    return None
+
+
+def set_engine(engine):
+    """
+    Installs `engine` as the process-wide engine used by `get_session`.
+
+    The tables are created once, connection pool and statement count
+    instrumentation (and the statement profiler when `SqlProfileStatements`
+    is enabled) is attached and the availability cache is invalidated. Passing None discards the
+    current engine so the next call to `get_engine` connects again.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine to use, or None.
+    """
+    with _engine_lock:
+        previous = _engine_state["engine"]
+        if previous is not None and previous is not engine:
+            previous.dispose()
+        _engine_state["engine"] = engine
+        _engine_state["session_factory"] = None
+        if previous is not engine:
+            AVAILABILITY_CACHE.invalidate()
+        if engine is None:
+            _engine_state["pool_stats"] = PoolStats()
+            return
+        stats = PoolStats(_pool_capacity(engine.pool))
+        event.listen(engine, "connect", stats.on_connect)
+        event.listen(engine, "checkout", stats.on_checkout)
+        event.listen(engine, "checkin", stats.on_checkin)
+        event.listen(engine, "before_cursor_execute", metrics_utils.count_statement)
+        if SQL_PROFILE:
+            profiler = StatementProfiler()
+            event.listen(engine, "before_cursor_execute", profiler.before_execute)
+            event.listen(engine, "after_cursor_execute", profiler.after_execute)
+        _engine_state["pool_stats"] = stats
+        create_tables(engine)
+        _engine_state["session_factory"] = sessionmaker(bind=engine)
+
+
+def get_engine(verbose=False):
+    """
+    Returns the process-wide SQLAlchemy engine for the Azure SQL Database,
+    creating it on first use.
+
+    The engine is created lazily with a connection pool configured by the
+    `SqlPoolSize`, `SqlPoolMaxOverflow`, `SqlPoolPrePing` and `SqlPoolRecycle`
+    environment variables, and is reused by every later call in the worker
+    process. The connection URL is built from the environment ('dev' by
+    default) using Active Directory MSI authentication, and the ODBC driver
+    that connected successfully is remembered.
+
+    Returns:
+        sqlalchemy.engine.Engine: An instance of SQLAlchemy engine
+        connected to the specified Azure SQL Database.
+    """
+    with _engine_lock:
+        if _engine_state["engine"] is None:
+            set_engine(_create_azure_engine(verbose))
+        return _engine_state["engine"]
+
+
+def get_pool_stats():
+    """Returns the connection pool metrics of the process-wide engine."""
+    return _engine_state["pool_stats"].snapshot()
+
+
+def get_local_engine(database=":memory:", verbose=False):
+    """
+    Creates a SQLite engine that stands in for the Azure SQL Database in local
+    tests and benchmarks.
+
+    The `SCHEMA` used by the models is provided by attaching a second database
+    under that name on every new connection. In-memory databases share a single
+    connection so that all sessions see the same tables.
+
+    Args:
+        database (str): Path of the SQLite file, or ":memory:".
+        verbose (bool): Echo the emitted SQL.
+
+    Returns:
+        sqlalchemy.engine.Engine: A SQLite engine with the EVRoam schema attached.
+    """
+    if database == ":memory:":
+        engine = create_engine("sqlite://", echo=verbose, poolclass=StaticPool)
+        schema_database = ":memory:"
+    else:
+        engine = create_engine(f"sqlite:///{database}", echo=verbose)
+        schema_database = f"{database}.{SCHEMA}"
+
+    @event.listens_for(engine, "connect")
+    def attach_schema(dbapi_connection, _):
+        dbapi_connection.execute(f"ATTACH DATABASE '{schema_database}' AS {SCHEMA}")
+
+    return engine
+
+
 def create_tables(engine):
     """
     Creates all tables in the database based on the SQLAlchemy Base metadata.
@@ -426,36 +965,206 @@ def create_tables(engine):
     and associated with the Base metadata object. It uses the engine to connect
     to the database and creates all tables that don't already exist.
 
+    Tables that already exist are not altered. The indexes declared on them
+    and missing from the database are logged, or created by
+    `create_missing_indexes` when `SqlCreateMissingIndexes` is true. Building
+    an index on a large table takes long, so by default this is left to
+    `scripts/create_indexes.py` rather than run by every worker that starts.
+
     Args:
         engine (sqlalchemy.engine.Engine): The SQLAlchemy engine instance used
         for database connection.
 
     """
     Base.metadata.create_all(engine)
+    if CREATE_MISSING_INDEXES:
+        create_missing_indexes(engine)
+        return
+    for index in get_missing_indexes(engine):
+        logging.warning(
+            "Index %s on %s is missing; create it with scripts/create_indexes.py",
+            index.name,
+            index.table.fullname,
+        )
+
+
+def create_missing_indexes(engine):
+    """
+    Creates the indexes declared on the models that are missing from the
+    database. An index that cannot be created is logged and skipped.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database.
+
+    Returns:
+        list: The names of the indexes created.
+    """
+    created = []
+    for index in get_missing_indexes(engine):
+        try:
+            index.create(engine)
+        except sqlalchemy.exc.DBAPIError as error:
+            logging.warning(
+                "Index %s on %s is missing and could not be created: %s",
+                index.name,
+                index.table.fullname,
+                _error_message(error),
+            )
+            continue
+        created.append(index.name)
+        logging.info("Created missing index %s on %s", index.name, index.table.fullname)
+    return created
+
+
+def get_missing_indexes(engine):
+    """
+    Returns the indexes declared on the models that the database lacks.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database to check.
+
+    Returns:
+        list: The missing `sqlalchemy.Index` objects, by table.
+    """
+    inspector = inspect(engine)
+    missing = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name, schema=table.schema):
+            continue
+        existing = {
+            index["name"] for index in inspector.get_indexes(table.name, schema=table.schema)
+        }
+        missing.extend(
+            index
+            for index in sorted(table.indexes, key=lambda index: index.name)
+            if index.name not in existing
+        )
+    return missing
+
+
+def _alter_hash_key_columns(engine):
+    """
+    Alters the `ODSHashKey` columns of a SQL Server database that are not yet
+    BINARY(`HASH_KEY_BYTES`), first dropping the indexes that include them.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for metadata in MODEL_REGISTRY.values():
+            table = metadata.model.__table__
+            columns = inspector.get_columns(table.name, schema=table.schema)
+            hash_column = next(column for column in columns if column["name"] == "ODSHashKey")
+            if isinstance(hash_column["type"], BINARY) and (
+                hash_column["type"].length == HASH_KEY_BYTES
+            ):
+                continue
+            existing = {
+                index["name"] for index in inspector.get_indexes(table.name, schema=table.schema)
+            }
+            for index in table.indexes:
+                include = index.dialect_options["mssql"]["include"] or []
+                if index.name in existing and "ODSHashKey" in include:
+                    index.drop(connection)
+            connection.exec_driver_sql(
+                f"ALTER TABLE [{table.schema}].[{table.name}] "
+                f"ALTER COLUMN [ODSHashKey] BINARY({HASH_KEY_BYTES}) NULL"
+            )
+            logging.info("Altered %s.ODSHashKey to BINARY(%s)", table.fullname, HASH_KEY_BYTES)
+
+
+def migrate_hash_keys(engine, chunk_rows=None):
+    """
+    Migrates the SCD Type 2 tables to the fixed-width hash keys.
+
+    On SQL Server, `ODSHashKey` columns still declared with another type (the
+    former VARBINARY(8000)) are altered to BINARY(`HASH_KEY_BYTES`): the
+    stored SHA-256 digests are all `HASH_KEY_BYTES` long, so none is changed.
+    The indexes including the column are dropped first and created again by
+    `create_missing_indexes`. The hash key of every current row is then recomputed
+    with `generate_hash_key`'s canonical encoding, so that records which have
+    not changed are not versioned again by their next write. Rerunning the
+    migration finds nothing to change.
+
+    Args:
+        engine (sqlalchemy.engine.Engine): The engine of the database to migrate.
+        chunk_rows (int, optional): Current rows read and updated at a time.
+        Defaults to `MERGE_CHUNK_SIZE`.
+
+    Returns:
+        dict: The number of current rows whose hash key was replaced, by table.
+    """
+    chunk_rows = chunk_rows or MERGE_CHUNK_SIZE
+    if engine.dialect.name == "mssql":
+        _alter_hash_key_columns(engine)
+        create_missing_indexes(engine)
+
+    rehashed = {}
+    session_factory = sessionmaker(bind=engine)
+    for metadata in MODEL_REGISTRY.values():
+        model, hash_keys = metadata.model, list(metadata.hash_keys)
+        pk_column = metadata.primary_key_column
+        query = (
+            select(pk_column, model.ODSHashKey, *[metadata.columns[key] for key in hash_keys])
+            .where(model.ODSIsCurrent == true())
+            .order_by(pk_column)
+        )
+        updates = []
+        with session_factory() as session:
+            result = session.execute(query)
+            while True:
+                rows = result.fetchmany(chunk_rows)
+                if not rows:
+                    break
+                frame = pd.DataFrame(rows, columns=[metadata.primary_key, "ODSHashKey", *hash_keys])
+                hashes = generate_hash_keys(frame, hash_keys).tolist()
+                changed = changed_hash_keys(hashes, frame["ODSHashKey"].tolist())
+                updates.extend(
+                    {metadata.primary_key: primary_key, "ODSHashKey": hash_key}
+                    for primary_key, hash_key, is_changed in zip(
+                        frame[metadata.primary_key].tolist(), hashes, changed
+                    )
+                    if is_changed
+                )
+            for chunk in _chunked(updates, chunk_rows):
+                session.execute(update(model), chunk)
+                session.commit()
+        rehashed[model.__tablename__] = len(updates)
+        logging.info("Rehashed %s current rows of %s", len(updates), model.__tablename__)
+    return rehashed
 
 
 def get_session():
     """
-    Creates a new SQLAlchemy session factory bound to the engine and returns
-    a new session instance.
+    Returns a new session from the process-wide session factory.
 
-    This function is a factory that produces new session objects when called,
-    using the engine configuration defined in `get_engine`.
+    The factory is bound to the engine from `get_engine`, whose tables are
+    created once per worker process rather than on every call.
 
     Returns:
         sqlalchemy.orm.session.Session: A new SQLAlchemy session object for
         database operations.
     """
-    engine = get_engine()
-    create_tables(engine)
-    session = sessionmaker(bind=engine)
-    return session()
+    with _engine_lock:
+        if _engine_state["session_factory"] is None:
+            get_engine()
+        session_factory = _engine_state["session_factory"]
+    return session_factory()
 
 
 @contextmanager
 def session_scope():
     """Provide a transactional scope around a series of operations."""
     session = get_session()
+    start = time.perf_counter()
+    session.connection()
+    stats = _engine_state["pool_stats"]
+    stats.record_checkout(time.perf_counter() - start)
+    snapshot = stats.snapshot()
+    logging.info(
+        "SQL connection checkout took %.1f ms (%s of %s pooled connections in use)",
+        snapshot["last_checkout_ms"],
+        snapshot["in_use"],
+        snapshot["capacity"],
+    )
     try:
         yield session
         session.commit()
@@ -466,53 +1175,197 @@ def session_scope():
         session.close()
 
 
-def normalize_arg(arg): # pylint: disable=too-many-return-statements
+# Canonical encoding of the hashed values: a type tag, then the normalised value
+_ENCODED_NONE = b"\x00"
+_ENCODED_TRUE = b"b1"
+_ENCODED_FALSE = b"b0"
+
+
+def _encode_text(text):
+    """Encodes a normalised string, prefixed with its length so values cannot run together."""
+    return f"s{len(text)}:{text}".encode("utf-8")
+
+
+def _encode_str(arg):
+    """Encodes a string, trimmed and lower-cased."""
+    return _encode_text(arg.strip().lower())
+
+
+def _encode_int(arg):
+    """Encodes an integer."""
+    return b"i%d;" % arg
+
+
+def _encode_float(arg):
+    """Encodes a float to 10 decimal places, or NaN as a missing value."""
+    return _ENCODED_NONE if arg != arg else b"f%.10f;" % arg
+
+
+def _encode_bool(arg):
+    """Encodes a boolean."""
+    return _ENCODED_TRUE if arg else _ENCODED_FALSE
+
+
+def _encode_dict(arg):
+    """Encodes a dictionary's items in key order."""
+    parts = [b"d%d:" % len(arg)]
+    for key, value in sorted(arg.items()):
+        parts.append(encode_arg(key))
+        parts.append(encode_arg(value))
+    return b"".join(parts)
+
+
+def _encode_list(arg):
+    """Encodes a list's elements in the order of their encodings."""
+    return b"l%d:" % len(arg) + b"".join(sorted(encode_arg(item) for item in arg))
+
+
+# Encoders of the JSON types, looked up by exact type before the slower checks
+_ENCODERS = {
+    str: _encode_str,
+    int: _encode_int,
+    float: _encode_float,
+    bool: _encode_bool,
+    dict: _encode_dict,
+    list: _encode_list,
+    type(None): lambda _: _ENCODED_NONE,
+}
+
+
+def encode_arg(arg):  # pylint: disable=too-many-return-statements
     """
-    Normalizes an argument for hashing, focusing on floating-point precision, string trimming,
-    and consistent ordering of lists, dictionaries, and mixed content.
+    Returns the canonical byte encoding of a value for hashing.
+
+    Each value is written as a type tag followed by its normalised form:
+    floats to 10 decimal places, datetimes to the second, strings trimmed and
+    lower-cased. Dictionaries are encoded in key order and list elements in
+    the order of their encodings, so neither depends on the payload's order.
+    Nested values are encoded directly rather than through JSON strings.
+    Missing values (None, NaN, NaT, NA) share one encoding.
     """
+    encoder = _ENCODERS.get(type(arg))
+    if encoder is not None:
+        return encoder(arg)
+    if arg is pd.NaT or arg is pd.NA:
+        return _ENCODED_NONE
+    if isinstance(arg, (bool, np.bool_)):
+        return _encode_bool(arg)
+    if isinstance(arg, (int, np.integer)):
+        return _encode_int(arg)
+    if isinstance(arg, (float, np.floating)):
+        return _encode_float(arg)
     if isinstance(arg, datetime):
-        return arg.isoformat(timespec="seconds")
-    if isinstance(arg, float):
-        return f"{arg:.10f}"
+        return b"t" + arg.isoformat(timespec="seconds").encode("ascii") + b";"
     if isinstance(arg, str):
-        return arg.strip().lower()
+        return _encode_str(arg)
     if isinstance(arg, dict):
-        # Sort dictionaries by keys and normalize each value
-        return json.dumps(
-            {k: normalize_arg(v) for k, v in sorted(arg.items())}, separators=(",", ":")
-        )
-    if isinstance(arg, list):
-        # Recursively normalize each element in the list and sort
-        return json.dumps(
-            sorted([normalize_arg(a) for a in arg], key=str), separators=(",", ":")
-        )
-    if arg is None:
-        return "None"
-    return str(arg)
+        return _encode_dict(arg)
+    if isinstance(arg, (list, tuple)):
+        return _encode_list(arg)
+    return b"o" + _encode_text(str(arg))
 
 
 def generate_hash_key(*args):
     """
     Generates a SHA-256 hash key from the provided arguments, with enhancements for consistency.
 
-    This function concatenates all arguments into a single string and
-    generates a SHA-256 hash of this string. It's used to create a unique
-    hash key for database records to facilitate change detection.
+    The canonical encoding of each argument (see `encode_arg`) is fed to the
+    hash in turn, so no normalised string is built for the whole record and
+    the position of each value is part of the hash. It's used to create a
+    unique hash key for database records to facilitate change detection.
 
     Args:
         *args: Variable length argument list used to generate the hash key.
 
     Returns:
-        bytes: The generated SHA-256 hash key.
+        bytes: The generated `HASH_KEY_BYTES` long SHA-256 hash key.
     """
     hash_key = hashlib.sha256()
-    sorted_args = sorted([normalize_arg(arg) for arg in args if arg is not None])
-    for arg in sorted_args:
-        hash_key.update(arg.encode("utf-8"))
+    for arg in args:
+        hash_key.update(encode_arg(arg))
     return hash_key.digest()
 
 
+def _encode_column(column):
+    """
+    Encodes a DataFrame column for hashing with vectorized pandas formatting.
+
+    Returns an object array holding, for every row, the bytes `encode_arg`
+    returns for the value. Missing values of object columns count as None,
+    since they are written as NULL, so a frame need not have NaN replaced by
+    None before it is hashed. Values the vectorized formatting cannot
+    reproduce exactly are passed through `encode_arg` one at a time.
+    """
+    dtype = column.dtype
+    if pd.api.types.is_bool_dtype(dtype) and not column.hasnans:
+        return np.where(column.to_numpy(dtype=bool), _ENCODED_TRUE, _ENCODED_FALSE).astype(
+            object
+        )
+    if pd.api.types.is_integer_dtype(dtype) and not column.hasnans:
+        return np.array([b"i%d;" % value for value in column.tolist()], dtype=object)
+    if pd.api.types.is_float_dtype(dtype):
+        values = column.to_numpy(dtype=float)
+        encoded = np.array([b"f%.10f;" % value for value in values.tolist()], dtype=object)
+        encoded[np.isnan(values)] = _ENCODED_NONE
+        return encoded
+    if pd.api.types.is_datetime64_dtype(dtype):
+        seconds = column.to_numpy(dtype="datetime64[s]")
+        encoded = np.array(
+            [b"t" + text.encode("ascii") + b";" for text in np.datetime_as_string(seconds)],
+            dtype=object,
+        )
+        encoded[np.isnat(seconds)] = _ENCODED_NONE
+        return encoded
+
+    values = column.to_numpy(dtype=object)
+    if dtype == object:
+        none_mask = np.asarray(pd.isna(values), dtype=bool)
+    else:
+        none_mask = np.equal(values, None)
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "empty"):
+        normalized = pd.Series(values, dtype=object).str.strip().str.lower().tolist()
+        encoded = np.array(
+            [_encode_text(text) if isinstance(text, str) else None for text in normalized],
+            dtype=object,
+        )
+        # Missing values other than None (NaN, NaT, pd.NA) are encoded one by one
+        for index in np.flatnonzero(pd.isna(values) & ~none_mask):
+            encoded[index] = encode_arg(values[index])
+    else:
+        encoded = np.array([encode_arg(value) for value in values], dtype=object)
+    encoded[none_mask] = _ENCODED_NONE
+    return encoded
+
+
+def generate_hash_keys(dataframe, hash_keys):
+    """
+    Generates the SHA-256 hash key of every row of a DataFrame.
+
+    This is the batch counterpart of `generate_hash_key`: each hashed column is
+    encoded as a whole, and the digest of each row is byte-for-byte the one
+    `generate_hash_key` returns for the row's values in `hash_keys` order.
+
+    Args:
+        dataframe (pandas.DataFrame): The rows to hash.
+        hash_keys (list): Columns used to generate the hash, e.g. from
+        `get_dynamic_hash_keys`.
+
+    Returns:
+        pandas.Series: The SHA-256 digest (bytes) of each row, aligned with
+        the DataFrame index.
+
+    Raises:
+        ValueError: If a hash key is not a column of the DataFrame.
+    """
+    missing = [key for key in hash_keys if key not in dataframe.columns]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    encoded_columns = [_encode_column(dataframe[key]) for key in hash_keys]
+    sha256 = hashlib.sha256
+    digests = [sha256(b"".join(row)).digest() for row in zip(*encoded_columns)]
+    return pd.Series(digests, index=dataframe.index, dtype=object)
+
+
 def validate_required_fields(model_class, provided_fields):
     """
     Validates that all required fields are present in provided_fields.
@@ -521,16 +1374,10 @@ def validate_required_fields(model_class, provided_fields):
     :param provided_fields: Dictionary of fields provided to the function.
     :raises ValueError: If a required field is missing.
     """
-    # Inspect the model class for column attributes
-    for column in model_class.__table__.columns:
-        # Check if the column is nullable or has a default value
-        is_nullable = column.nullable
-        has_default = column.default is not None or column.server_default is not None
-
-        # If the field is required (not nullable and no default), check it's provided
-        if not is_nullable and not has_default:
-            if column.name not in provided_fields:
-                raise ValueError(f"Missing required field: {column.name}")
+    # Required fields are not nullable and have no default value
+    for name in get_model_metadata(model_class).required:
+        if name not in provided_fields:
+            raise ValueError(f"Missing required field: {name}")
 
 
 def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
@@ -540,7 +1387,8 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
     This function checks if the provided record already exists based on its unique keys.
     If it does and changes are detected (via hash comparison), it marks the existing record
     as historical and inserts a new record with the current data. If the record does not
-    exist, it simply inserts a new record.
+    exist, it simply inserts a new record. The values are first converted to the column
+    types by `coerce_dataframe`, as the bulk writers do.
 
     Args:
         model (Base): The SQLAlchemy model class for the table.
@@ -551,6 +1399,9 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
 
     Returns:
         The primary key of the newly added or updated record.
+
+    Raises:
+        ValueError: If a value cannot be converted to its column type.
     """
     own_session = False
     if session is None:
@@ -558,6 +1409,16 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
         own_session = True
 
     try:
+        # Convert the values as the bulk writers do, so both paths hash the same bytes
+        coerced, errors = coerce_dataframe(model, pd.DataFrame([{**unique_keys, **fields}]))
+        if errors:
+            raise ValueError(errors[0])
+        fields = {
+            name: value
+            for name, value in next(iter_records(coerced)).items()
+            if name not in unique_keys
+        }
+
         # Generate hash key for incoming data
         hash_values = [fields[key] for key in hash_keys]
         incoming_hash = generate_hash_key(*hash_values)
@@ -572,9 +1433,7 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
                 model.__name__,
                 unique_keys,
             )
-            # Assuming a single PK field, dynamically get the PK name and value
-            pk_name = model.__table__.primary_key.columns.keys()[0]
-            return getattr(existing_record, pk_name)
+            return getattr(existing_record, get_model_metadata(model).primary_key)
         logging.debug(
             "Material change detected or new record for %s: %s.", model.__name__, fields
         )
@@ -596,9 +1455,7 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
         if own_session:
             session.commit()
 
-        # Dynamically get the PK name and value for the new record
-        pk_name = model.__table__.primary_key.columns.keys()[0]
-        return getattr(new_record, pk_name)
+        return getattr(new_record, get_model_metadata(model).primary_key)
     except Exception as exception:
         if own_session:
             session.rollback()
@@ -609,6 +1466,311 @@ def add_or_update_record(model, unique_keys, hash_keys, session=None, **fields):
             session.close()
 
 
+def add_or_update_records(model, unique_key, records, session=None):
+    """
+    Adds or updates records one at a time using SCD Type 2 logic.
+
+    This is the per-row counterpart of `merge_records`, taking records as
+    yielded by `iter_records` directly.
+
+    Args:
+        model (Base): The SQLAlchemy model class for the table.
+        unique_key (str): The column identifying a record, e.g. "SiteId".
+        records (iterable): Dictionaries of column values.
+        session (sqlalchemy.orm.session.Session, optional): The SQLAlchemy session to use.
+
+    Returns:
+        list: The primary key of the current version of each record.
+    """
+    hash_keys = get_model_metadata(model, unique_key).hash_keys
+    return [
+        add_or_update_record(
+            model,
+            {unique_key: record[unique_key]},
+            hash_keys,
+            session=session,
+            **{name: value for name, value in record.items() if name != unique_key},
+        )
+        for record in records
+    ]
+
+
+def _chunked(values, size):
+    """Yields successive slices of at most `size` items from a list."""
+    for start in range(0, len(values), size):
+        yield values[start : start + size]
+
+
+def merge_records(model, unique_key, hash_keys, records, session, hashes=None):
+    """
+    Adds or updates a batch of records using set-based SCD Type 2 logic.
+
+    This is the bulk counterpart of `add_or_update_record`. The current hash of
+    every incoming key is loaded with one query per chunk of keys, inserts and
+    expirations are worked out in memory, and the changes are applied with
+    bulk UPDATE and INSERT statements. Records are applied in order, so a key
+    that appears several times in the batch produces the same chain of
+    versions as calling `add_or_update_record` for each record in turn.
+
+    Args:
+        model (Base): The SQLAlchemy model class for the table.
+        unique_key (str): Name of the column identifying a record.
+        hash_keys (list): List of keys used to generate the hash for change detection.
+        records (list): Dictionaries of column values, including `unique_key`.
+        session (sqlalchemy.orm.session.Session): The SQLAlchemy session to use.
+        hashes (list, optional): Precomputed hash key of each record, e.g. from
+        `generate_hash_keys`. Computed with `generate_hash_key` if omitted.
+
+    Returns:
+        dict: Counts of "inserted", "expired" and "unchanged" records.
+
+    Raises:
+        ValueError: If the records do not match the model columns.
+    """
+    counts = {"inserted": 0, "expired": 0, "unchanged": 0}
+    if not records:
+        return counts
+
+    metadata = get_model_metadata(model, unique_key)
+    columns = metadata.columns
+    missing = [key for key in [unique_key, *hash_keys] if key not in records[0]]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    unknown = [key for key in records[0] if key not in columns]
+    if unknown:
+        raise ValueError(
+            f"Unknown field(s) for {model.__name__}: {', '.join(unknown)}"
+        )
+
+    pk_column = metadata.primary_key_column
+    key_column = columns[unique_key]
+
+    # Load the current version of every incoming key
+    current = {}
+    keys = list(dict.fromkeys(record[unique_key] for record in records))
+    for chunk in _chunked(keys, MERGE_CHUNK_SIZE):
+        query = select(key_column, pk_column, model.ODSHashKey).where(
+            key_column.in_(chunk), model.ODSIsCurrent == true()
+        )
+        for key, primary_key, hash_key in session.execute(query):
+            current.setdefault(key, (primary_key, hash_key))
+
+    # Work out inserts, expirations and no-ops
+    now = datetime.now()
+    inserts = []
+    pending = {}
+    expire_keys = []
+    if hashes is None:
+        hashes = [
+            generate_hash_key(*[record[name] for name in hash_keys])
+            for record in records
+        ]
+    for record, incoming_hash in zip(records, hashes):
+        key = record[unique_key]
+        if key in pending:
+            previous = inserts[pending[key]]
+            if previous["ODSHashKey"] == incoming_hash:
+                counts["unchanged"] += 1
+                continue
+            previous["ODSEffectiveTo"] = now
+            previous["ODSIsCurrent"] = False
+        elif key in current:
+            if current[key][1] == incoming_hash:
+                counts["unchanged"] += 1
+                continue
+            expire_keys.append(current[key][0])
+        pending[key] = len(inserts)
+        inserts.append(
+            {
+                **record,
+                "ODSEffectiveFrom": now,
+                "ODSEffectiveTo": None,
+                "ODSIsCurrent": True,
+                "ODSHashKey": incoming_hash,
+            }
+        )
+
+    # Apply the changes
+    for chunk in _chunked(expire_keys, MERGE_CHUNK_SIZE):
+        session.execute(
+            update(model)
+            .where(pk_column.in_(chunk))
+            .values(ODSEffectiveTo=now, ODSIsCurrent=False)
+            .execution_options(synchronize_session=False)
+        )
+    if inserts:
+        # Bind None as NULL, so that rows missing different values share one
+        # executemany batch; by default the ORM leaves None columns out of the
+        # INSERT and sends one batch per pattern of missing values. Defaulted
+        # columns given as None are filled in, as leaving them out would have.
+        values = metadata.default_values()
+        for row in inserts:
+            for name, value in values.items():
+                if name in row and row[name] is None:
+                    row[name] = value
+        session.execute(insert(model).execution_options(render_nulls=True), inserts)
+
+    counts["inserted"] = len(inserts)
+    counts["expired"] = len(expire_keys) + len(inserts) - len(pending)
+    logging.debug("Merged %s records into %s: %s", len(records), model.__name__, counts)
+    return counts
+
+
+def _stage_table(model, columns, dialect_name):
+    """
+    Describes the temporary table used to stage records for `model`.
+
+    SQL Server temporary tables are named with a leading `#`; other databases
+    (SQLite) declare them with the TEMPORARY prefix.
+    """
+    name = f"Stage{model.__tablename__}"
+    prefixes = []
+    if dialect_name == "mssql":
+        name = f"#{name}"
+    else:
+        prefixes = ["TEMPORARY"]
+    column_types = get_model_metadata(model).column_types
+    return Table(
+        name,
+        MetaData(),
+        Column("StageRow", Integer, primary_key=True, autoincrement=False),
+        Column("StageIsFirst", Boolean),
+        Column("StageIsLast", Boolean),
+        *[Column(name, column_types[name]) for name in columns],
+        prefixes=prefixes,
+    )
+
+
+def merge_records_staged(model, unique_key, hash_keys, records, session, hashes=None):
+    """
+    Adds or updates a batch of records using set-based SCD Type 2 logic,
+    applied by the database from a temporary staging table.
+
+    The records are bulk inserted into a temporary table (as parameter arrays
+    on SQL Server with `fast_executemany`), then three set-based statements
+    drop the records matching the current version, expire the current
+    versions of the changed keys and insert the new versions. Versions of a
+    key repeated within the batch are chained as in `merge_records`, which
+    this function can replace; the `SqlWriteBackend` setting selects between
+    them.
+
+    Args:
+        model (Base): The SQLAlchemy model class for the table.
+        unique_key (str): Name of the column identifying a record.
+        hash_keys (list): List of keys used to generate the hash for change detection.
+        records (list): Dictionaries of column values, including `unique_key`.
+        session (sqlalchemy.orm.session.Session): The SQLAlchemy session to use.
+        hashes (list, optional): Precomputed hash key of each record, e.g. from
+        `generate_hash_keys`. Computed with `generate_hash_key` if omitted.
+
+    Returns:
+        dict: Counts of "inserted", "expired" and "unchanged" records.
+
+    Raises:
+        ValueError: If the records do not match the model columns.
+    """
+    counts = {"inserted": 0, "expired": 0, "unchanged": 0}
+    if not records:
+        return counts
+
+    metadata = get_model_metadata(model, unique_key)
+    columns = metadata.columns
+    missing = [key for key in [unique_key, *hash_keys] if key not in records[0]]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+    unknown = [key for key in records[0] if key not in columns]
+    if unknown:
+        raise ValueError(
+            f"Unknown field(s) for {model.__name__}: {', '.join(unknown)}"
+        )
+    if hashes is None:
+        hashes = [
+            generate_hash_key(*[record[name] for name in hash_keys])
+            for record in records
+        ]
+
+    # Chain the versions of each key, dropping repeats of the previous version
+    rows = []
+    last_row = {}
+    for record, incoming_hash in zip(records, hashes):
+        key = record[unique_key]
+        is_first = key not in last_row
+        if not is_first:
+            previous = rows[last_row[key]]
+            if previous["ODSHashKey"] == incoming_hash:
+                counts["unchanged"] += 1
+                continue
+            previous["StageIsLast"] = False
+        last_row[key] = len(rows)
+        rows.append(
+            {
+                **record,
+                "StageRow": len(rows),
+                "StageIsFirst": is_first,
+                "StageIsLast": True,
+                "ODSHashKey": incoming_hash,
+            }
+        )
+
+    record_columns = [name for name in records[0] if name != "ODSHashKey"]
+    connection = session.connection()
+    stage = _stage_table(
+        model, [*record_columns, "ODSHashKey"], connection.dialect.name
+    )
+    stage.drop(connection, checkfirst=True)
+    stage.create(connection)
+    session.execute(insert(stage), rows)
+
+    key_column = columns[unique_key]
+    stage_key = stage.c[unique_key]
+    now = datetime.now()
+    # The first version of a key is a no-op if it matches the current version
+    counts["unchanged"] += session.execute(
+        delete(stage).where(
+            stage.c.StageIsFirst == true(),
+            exists().where(
+                key_column == stage_key,
+                model.ODSIsCurrent == true(),
+                model.ODSHashKey == stage.c.ODSHashKey,
+            ),
+        )
+    ).rowcount
+    expired = session.execute(
+        update(model)
+        .where(model.ODSIsCurrent == true(), key_column.in_(select(stage_key)))
+        .values(ODSEffectiveTo=now, ODSIsCurrent=False)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    new_versions = select(
+        *[stage.c[name] for name in record_columns],
+        stage.c.ODSHashKey,
+        literal(now, DateTime),
+        case((stage.c.StageIsLast == true(), null()), else_=literal(now, DateTime)),
+        stage.c.StageIsLast,
+    ).order_by(stage.c.StageRow)
+    target_columns = [*record_columns, "ODSHashKey"]
+    target_columns += ["ODSEffectiveFrom", "ODSEffectiveTo", "ODSIsCurrent"]
+    if "WaterMark" in columns and "WaterMark" not in record_columns:
+        new_versions = new_versions.add_columns(literal(datetime.utcnow(), DateTime))
+        target_columns.append("WaterMark")
+    counts["inserted"] = session.execute(
+        insert(model).from_select(target_columns, new_versions)
+    ).rowcount
+    superseded = session.execute(
+        select(func.count()).select_from(stage).where(stage.c.StageIsLast == false())
+    ).scalar()
+    stage.drop(connection)
+
+    counts["expired"] = expired + superseded
+    logging.debug(
+        "Merged %s staged records into %s: %s", len(records), model.__name__, counts
+    )
+    return counts
+
+
+MERGE_BACKENDS = {"merge": merge_records, "staged": merge_records_staged}
+
+
 def get_dynamic_hash_keys(model, exclude=None):
     """
     Generate a list of hash keys for a given SQLAlchemy model,
@@ -632,6 +1794,89 @@ def get_dynamic_hash_keys(model, exclude=None):
     return hash_keys
 
 
+class ModelMetadata:
+    """
+    Column metadata of an SCD Type 2 model, worked out once so that the write
+    paths do not reflect on the table for every record or batch.
+
+    Args:
+        model (Base): The SQLAlchemy model class for the table.
+        unique_key (str, optional): The column identifying a record, which is
+        left out of the hash keys.
+
+    Attributes:
+        hash_keys (tuple): The columns hashed for change detection, in table
+        order, as returned by `get_dynamic_hash_keys`.
+        primary_key (str): The name of the surrogate primary key column.
+        unique_keys (tuple): The columns identifying a record.
+        columns: The table's columns by name.
+        column_types (dict): The SQLAlchemy type of each column by name.
+        string_lengths (dict): The maximum length of each bounded string column.
+        required (tuple): The columns that are neither nullable nor defaulted.
+        defaults (dict): The Python-side default of each defaulted column by name.
+    """
+
+    def __init__(self, model, unique_key=None):
+        table = model.__table__
+        self.model = model
+        self.unique_key = unique_key
+        self.unique_keys = (unique_key,) if unique_key else ()
+        self.hash_keys = tuple(
+            get_dynamic_hash_keys(model, exclude=["WaterMark", "ODS", *self.unique_keys])
+        )
+        self.primary_key_column = list(table.primary_key.columns)[0]
+        self.primary_key = self.primary_key_column.name
+        self.columns = table.columns
+        self.column_types = {column.name: column.type for column in table.columns}
+        self.string_lengths = {
+            column.name: column.type.length
+            for column in table.columns
+            if isinstance(column.type, String) and column.type.length
+        }
+        self.required = tuple(
+            column.name
+            for column in table.columns
+            if not column.nullable
+            and column.default is None
+            and column.server_default is None
+        )
+        self.defaults = {
+            column.name: column.default
+            for column in table.columns
+            if column.default is not None and not column.default.is_sequence
+        }
+
+    def default_values(self):
+        """Returns the value each defaulted column would be given by an INSERT now."""
+        return {
+            name: default.arg(None) if default.is_callable else default.arg
+            for name, default in self.defaults.items()
+        }
+
+
+MODEL_REGISTRY = {
+    model: ModelMetadata(model, unique_key)
+    for model, unique_key in (
+        (EVRoamSites, "SiteId"),
+        (EVRoamChargingStations, "ChargingStationId"),
+        (EVRoamAvailabilities, "ChargingStationId"),
+    )
+}
+
+
+def get_model_metadata(model, unique_key=None):
+    """
+    Returns the `ModelMetadata` of a model from `MODEL_REGISTRY`.
+
+    Models that are not registered, or a different unique key, are described
+    on the fly.
+    """
+    metadata = MODEL_REGISTRY.get(model)
+    if metadata is None or unique_key not in (None, metadata.unique_key):
+        metadata = ModelMetadata(model, unique_key)
+    return metadata
+
+
 def add_or_update_evroam_site(site_id, name, address, session=None, **other_fields):
     """
     Adds a new EVRoam site or updates an existing one using SCD
@@ -659,9 +1904,7 @@ def add_or_update_evroam_site(site_id, name, address, session=None, **other_fiel
         Exception: If any database operation fails.
     """
     unique_keys = {"SiteId": site_id}
-    hash_keys = get_dynamic_hash_keys(
-        EVRoamSites, exclude=["WaterMark", "ODS", "SiteId"]
-    )
+    hash_keys = MODEL_REGISTRY[EVRoamSites].hash_keys
 
     return add_or_update_record(
         EVRoamSites,
@@ -708,9 +1951,7 @@ def add_or_update_charging_station(
         Exception: If any database operation fails.
     """
     unique_keys = {"ChargingStationId": charging_station_id}
-    hash_keys = get_dynamic_hash_keys(
-        EVRoamChargingStations, exclude=["WaterMark", "ODS", "ChargingStationId"]
-    )
+    hash_keys = MODEL_REGISTRY[EVRoamChargingStations].hash_keys
 
     fields = {
         "SiteId": site_id,
@@ -756,9 +1997,7 @@ def add_or_update_availability(
         Exception: If any database operation fails.
     """
     unique_keys = {"ChargingStationId": charging_station_id}
-    hash_keys = get_dynamic_hash_keys(
-        EVRoamAvailabilities, exclude=["WaterMark", "ODS", "ChargingStationId"]
-    )
+    hash_keys = MODEL_REGISTRY[EVRoamAvailabilities].hash_keys
 
     fields = {
         "AvailabilityStatus": availability_status,
@@ -770,88 +2009,857 @@ def add_or_update_availability(
     )
 
 
-def write_sites_to_db(dataframe):
+# Values accepted for Boolean columns, after strings are trimmed and lower-cased
+_BOOLEAN_VALUES = {True: True, False: False, "true": True, "false": False, "1": True, "0": False}
+
+
+def _coerce_datetimes(column):
+    """
+    Parses a column as naive UTC datetimes, the way DateTime columns store
+    them. Strings are parsed as ISO 8601 and aware values converted to UTC.
+    """
+    dtype = column.dtype
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return column
+    if not isinstance(dtype, pd.DatetimeTZDtype):
+        column = pd.to_datetime(column, utc=True, errors="coerce", format="ISO8601")
+    return column.dt.tz_convert("UTC").dt.tz_localize(None)
+
+
+def _coerce_integers(column):
+    """Casts a column to nullable integers, rounding any fractional numbers."""
+    if pd.api.types.is_integer_dtype(column.dtype):
+        return column
+    return pd.to_numeric(column, errors="coerce").round().astype("Int64")
+
+
+def _coerce_floats(column):
+    """Casts a column to floats."""
+    if pd.api.types.is_float_dtype(column.dtype):
+        return column
+    return pd.to_numeric(column, errors="coerce").astype(float)
+
+
+def _coerce_booleans(column):
+    """Casts a column to nullable booleans, accepting "true"/"false" and 1/0."""
+    if pd.api.types.is_bool_dtype(column.dtype):
+        return column
+    values = column.astype(object)
+    if pd.api.types.infer_dtype(values, skipna=True) in ("string", "mixed"):
+        values = values.map(
+            lambda value: value.strip().lower() if isinstance(value, str) else value
+        )
+    return values.map(_BOOLEAN_VALUES).astype("boolean")
+
+
+def _canonical_json(value):
+    """
+    Returns a nested value with the items of every list sorted by their
+    `encode_arg` encoding, the order in which they are hashed.
     """
-    Writes charging station site data to the database.
+    if isinstance(value, dict):
+        return {key: _canonical_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted((_canonical_json(item) for item in value), key=encode_arg)
+    return value
+
+
+def _encode_json(value):
+    """
+    Encodes a value that is not a string as compact JSON, with dictionary
+    keys and list items sorted, so a provider reordering a nested list does
+    not change the stored value or its hash.
+    """
+    return json.dumps(
+        _canonical_json(value), sort_keys=True, separators=(",", ":"), default=str
+    )
+
+
+def _coerce_strings(column):
+    """
+    Casts a column to strings: nested lists and dictionaries, numbers and
+    booleans are encoded as JSON.
+    """
+    if pd.api.types.is_string_dtype(column.dtype) and column.dtype != object:
+        return column
+    values = column.to_numpy(dtype=object)
+    if column.dtype == object and pd.api.types.infer_dtype(values, skipna=True) in (
+        "string",
+        "empty",
+    ):
+        return column
+    missing = np.asarray(pd.isna(values), dtype=bool)
+    encoded = np.array(
+        [
+            value if is_missing or isinstance(value, str) else _encode_json(value)
+            for value, is_missing in zip(values.tolist(), missing.tolist())
+        ],
+        dtype=object,
+    )
+    encoded[missing] = None
+    return pd.Series(encoded, index=column.index, dtype=object)
+
+
+# Coercion of the columns of each SQLAlchemy type, checked in order
+_COERCIONS = (
+    (DateTime, _coerce_datetimes, "datetime"),
+    (Boolean, _coerce_booleans, "boolean"),
+    (Integer, _coerce_integers, "integer"),
+    (Float, _coerce_floats, "number"),
+    (String, _coerce_strings, "string"),
+)
+
+
+@metrics_utils.instrumented("coerce")
+def coerce_dataframe(model, dataframe):
+    """
+    Converts the columns of a DataFrame to the types of the model's columns,
+    one column at a time, before the rows are hashed and written.
+
+    DateTime columns are parsed with `pd.to_datetime` into naive UTC
+    datetimes, Integer columns are rounded to nullable integers, Float and
+    Boolean columns are cast, and nested values in String columns are
+    encoded as JSON. Values are then hashed the way they are stored, rather
+    than by the JSON type they arrived as, and pyodbc binds them without
+    converting each value.
+
+    Values that cannot be converted, and strings longer than their column,
+    would be rejected by the database, so their rows are reported instead.
+    Columns that are not in the model are left as they are.
 
     Args:
-        dataframe (pandas.DataFrame): A DataFrame containing charging station site data.
+        model (Base): The SQLAlchemy model class for the table.
+        dataframe (pandas.DataFrame): The rows to convert.
 
     Returns:
-        None
+        tuple: The converted DataFrame, and the error of each invalid row by
+        its position in the DataFrame.
+    """
+    metadata = get_model_metadata(model)
+    coerced = {}
+    errors = {}
+
+    def reject(name, invalid, message):
+        positions = np.flatnonzero(invalid)
+        if len(positions):
+            logging.warning(
+                "Rejecting %s rows of %s: %s", len(positions), model.__tablename__, message
+            )
+        for position in positions.tolist():
+            errors.setdefault(position, message)
+
+    for name in dataframe.columns:
+        column_type = metadata.column_types.get(name)
+        if column_type is None:
+            continue
+        column = dataframe[name]
+        for sql_type, coerce, kind in _COERCIONS:
+            if isinstance(column_type, sql_type):
+                values = coerce(column)
+                break
+        else:
+            continue
+        if values is not column:
+            invalid = (values.isna() & column.notna()).to_numpy()
+            reject(name, invalid, f"Invalid {kind} value for {name}")
+            coerced[name] = values
+        length = metadata.string_lengths.get(name)
+        if length is not None:
+            too_long = (values.str.len() > length).to_numpy(dtype=bool, na_value=False)
+            reject(name, too_long, f"Value for {name} longer than {length} characters")
+
+    if coerced:
+        dataframe = dataframe.assign(**coerced)
+    return dataframe, dict(sorted(errors.items()))
+
+
+def _hash_dataframe(model, unique_key, dataframe):
     """
-    # Replace `nan` values with `None` for proper SQL NULL handling
-    dataframe = dataframe.where(pd.notnull(dataframe), None)
+    Prepares a DataFrame for an SCD Type 2 merge into a model table.
 
-    with session_scope() as session:
-        for _, row in dataframe.iterrows():
-            site_data = row.to_dict()
-            try:
-                add_or_update_evroam_site(
-                    site_data.pop("SiteId"),
-                    site_data.pop("Name"),
-                    site_data.pop("Address"),
-                    session=session,
-                    **site_data,
+    The columns are converted to the model's types by `coerce_dataframe`,
+    and the rows it reports as invalid are set aside for the dead-letter
+    store with their original values. The DataFrame is not otherwise copied:
+    missing values are hashed as `None` by `generate_hash_keys` and bound as
+    `None` by `iter_records`.
+
+    Returns:
+        tuple: The DataFrame, the hash keys of the model, the hash key of
+        every row, and the (record, error) pairs of the invalid rows.
+    """
+    coerced, errors = coerce_dataframe(model, dataframe)
+    rejected = []
+    if errors:
+        positions = list(errors)
+        rejected = list(
+            zip(iter_records(dataframe.iloc[positions]), errors.values())
+        )
+        valid = np.ones(len(coerced), dtype=bool)
+        valid[positions] = False
+        coerced = coerced[valid]
+    with metrics_utils.stage("hash"):
+        hash_keys = get_model_metadata(model, unique_key).hash_keys
+        hashes = generate_hash_keys(coerced, hash_keys)
+    return coerced, hash_keys, hashes, rejected
+
+
+def _column_values(column):
+    """
+    Returns the values of a DataFrame column as a list of native Python
+    objects for binding: missing values become None, numpy scalars become
+    int, float or bool, and datetimes become `datetime.datetime`.
+    """
+    dtype = column.dtype
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return column.to_numpy(dtype="datetime64[us]").tolist()
+    if isinstance(dtype, np.dtype) and dtype.kind in "biuf":
+        values = column.to_numpy()
+        native = values.tolist()
+        if dtype.kind == "f":
+            for index in np.flatnonzero(np.isnan(values)):
+                native[index] = None
+        return native
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        return [
+            None if value is pd.NaT else value.to_pydatetime()
+            for value in column.astype(object)
+        ]
+    values = column.to_numpy(dtype=object, copy=True)
+    values[np.asarray(pd.isna(values), dtype=bool)] = None
+    return [value.item() if isinstance(value, np.generic) else value for value in values]
+
+
+def iter_records(dataframe, columns=None):
+    """
+    Iterates over the rows of a DataFrame as dictionaries of native Python
+    values, with missing values as None for proper SQL NULL handling.
+
+    This replaces `DataFrame.iterrows`: each column is converted once as a
+    whole and the columns are zipped into plain dictionaries, so no Series is
+    built per row and column dtypes are not lost to an object row.
+
+    Args:
+        dataframe (pandas.DataFrame): The rows to iterate over.
+        columns (list, optional): The columns to include. Defaults to all.
+
+    Yields:
+        dict: The column values of one row.
+    """
+    columns = list(dataframe.columns if columns is None else columns)
+    values = [_column_values(dataframe[name]) for name in columns]
+    for row in zip(*values):
+        yield dict(zip(columns, row))
+
+
+def _is_row_error(error):
+    """
+    Whether a database error is caused by the values of some rows of a batch,
+    i.e. a constraint violation or invalid data, so that retrying smaller
+    batches can isolate them. Other errors (connection failures, deadlocks,
+    missing objects or permissions) would fail every row and are raised.
+    """
+    return isinstance(error, (IntegrityError, DataError)) and not getattr(
+        error, "connection_invalidated", False
+    )
+
+
+def _error_message(error):
+    """Returns the driver error of a database error, without its statement and parameters."""
+    return str(getattr(error, "orig", None) or error)
+
+
+def write_in_batches(model, unique_key, dataframe, prepared=None, batch_rows=None):
+    """
+    Merges the rows of a DataFrame into a model table with SCD Type 2 logic,
+    committing every `batch_rows` rows.
+
+    A batch the database rejects with a constraint violation or invalid data
+    is rolled back, split in half and retried, until the rows causing the
+    failure are isolated. Those rows, and the rows `coerce_dataframe` found
+    invalid before writing, are saved to the dead-letter store (see
+    `deadletter_utils.dead_letter_rows`) and the rest are written. The
+    returned array marks the rows of the prepared DataFrame, which leaves out
+    the invalid rows. Rows are applied in order, so the versions of a key
+    repeated in the DataFrame are chained as in a single merge. Validation
+    errors and any other database error are raised without retrying.
+
+    Args:
+        model (Base): The SQLAlchemy model class for the table.
+        unique_key (str): The column identifying a record.
+        dataframe (pandas.DataFrame): The rows to write.
+        prepared (tuple, optional): The result of `_hash_dataframe`.
+        batch_rows (int, optional): Rows per transaction. Defaults to
+        `INGEST_BATCH_ROWS`; 0 writes all rows in one transaction.
+
+    Returns:
+        tuple: Counts of "inserted", "expired", "unchanged" and
+        "dead_lettered" records, and a boolean array marking the rows that
+        were written.
+
+    Raises:
+        ValueError: If the rows do not match the model or the write backend is unknown.
+    """
+    if prepared is None:
+        prepared = _hash_dataframe(model, unique_key, dataframe)
+    dataframe, hash_keys, hashes, invalid = prepared
+    if WRITE_BACKEND not in MERGE_BACKENDS:
+        raise ValueError(f"Unknown SqlWriteBackend: {WRITE_BACKEND}")
+    merge = MERGE_BACKENDS[WRITE_BACKEND]
+    records = list(iter_records(dataframe))
+    hashes = hashes.tolist()
+    batch_rows = INGEST_BATCH_ROWS if batch_rows is None else batch_rows
+    batch_rows = batch_rows if batch_rows > 0 else max(len(records), 1)
+
+    counts = {"inserted": 0, "expired": 0, "unchanged": 0, "dead_lettered": 0}
+    written = np.ones(len(records), dtype=bool)
+    rejected = []
+
+    def write_batch(start, stop):
+        try:
+            with session_scope() as session:
+                batch_counts = merge(
+                    model,
+                    unique_key,
+                    hash_keys,
+                    records[start:stop],
+                    session,
+                    hashes=hashes[start:stop],
                 )
-            except Exception as exception:
-                logging.error("Error adding or updating site: %s", exception)
+        except Exception as error:  # pylint: disable=broad-except
+            if not _is_row_error(error):
+                raise
+            if stop - start == 1:
+                rejected.append((start, _error_message(error)))
+                written[start] = False
+                return
+            middle = (start + stop) // 2
+            logging.warning(
+                "Retrying rows %s-%s of %s in halves after error: %s",
+                start,
+                stop - 1,
+                model.__tablename__,
+                _error_message(error),
+            )
+            write_batch(start, middle)
+            write_batch(middle, stop)
+            return
+        for name, count in batch_counts.items():
+            counts[name] += count
+
+    with metrics_utils.stage("write"):
+        for start in range(0, len(records), batch_rows):
+            write_batch(start, min(start + batch_rows, len(records)))
+
+    rejected = invalid + [(records[index], error) for index, error in rejected]
+    if rejected:
+        counts["dead_lettered"] = len(rejected)
+        deadletter_utils.dead_letter_rows(
+            model.__tablename__,
+            [record for record, _ in rejected],
+            [error for _, error in rejected],
+        )
+    metrics_utils.add(**counts)
+    return counts, written
 
 
+@profiled
+def write_sites_to_db(dataframe):
+    """
+    Writes charging station site data to the database, committing every
+    `INGEST_BATCH_ROWS` rows (see `write_in_batches`).
+
+    Args:
+        dataframe (pandas.DataFrame): A DataFrame containing charging station site data.
+
+    Returns:
+        dict: Counts of "inserted", "expired", "unchanged" and "dead_lettered"
+        records, or None if the rows do not match the model.
+    """
+    try:
+        counts, _ = write_in_batches(EVRoamSites, "SiteId", dataframe)
+    except ValueError as exception:
+        logging.error("Error adding or updating site: %s", exception)
+        return None
+    return counts
+
+
+@profiled
 def write_chargingstations_to_db(dataframe):
     """
-    Writes charging station data to the database.
+    Writes charging station data to the database, committing every
+    `INGEST_BATCH_ROWS` rows (see `write_in_batches`).
 
     Args:
         dataframe (pandas.DataFrame): A DataFrame containing charging station data.
 
     Returns:
-        None
+        dict: Counts of "inserted", "expired", "unchanged" and "dead_lettered"
+        records, or None if the rows do not match the model.
+    """
+    try:
+        counts, _ = write_in_batches(EVRoamChargingStations, "ChargingStationId", dataframe)
+    except ValueError as exception:
+        logging.error("Error adding or updating charging station: %s", exception)
+        return None
+    return counts
+
+
+def _load_availability_cache():
+    """Fills `AVAILABILITY_CACHE` from the current availability rows."""
+    query = select(
+        EVRoamAvailabilities.ChargingStationId,
+        EVRoamAvailabilities.ODSHashKey,
+        EVRoamAvailabilities.AvailabilityStatus,
+    ).where(EVRoamAvailabilities.ODSIsCurrent == true())
+    with session_scope() as session:
+        AVAILABILITY_CACHE.load(session.execute(query))
+    logging.info(
+        "Loaded %s current availabilities into the cache",
+        AVAILABILITY_CACHE.stats()["size"],
+    )
+
+
+def changed_hash_keys(incoming, current):
     """
-    # Replace `nan` values with `None` for proper SQL NULL handling
-    dataframe = dataframe.where(pd.notnull(dataframe), None)
+    Compares incoming hash keys with the current ones as fixed-width byte
+    arrays, each pair up to its first differing byte.
+
+    Args:
+        incoming (list): The hash key of each incoming row.
+        current (list): The current hash key of each row's record, or None.
+
+    Returns:
+        numpy.ndarray: Whether each incoming hash key differs from the current one.
+    """
+    dtype = f"S{HASH_KEY_BYTES}"
+    known = np.array([key is not None for key in current], dtype=bool)
+    current = [key if key is not None else b"" for key in current]
+    return ~known | (np.array(incoming, dtype=dtype) != np.array(current, dtype=dtype))
+
+
+def _drop_unchanged_availabilities(dataframe, hashes):
+    """
+    Drops the availability rows whose hash key matches the cached current
+    version, returning the remaining rows and their hash keys.
+    """
+    cached = [AVAILABILITY_CACHE.get(key) for key in dataframe["ChargingStationId"]]
+    keep = changed_hash_keys(
+        hashes.tolist(), [entry and entry[0] for entry in cached]
+    )
+    if keep.all():
+        return dataframe, hashes
+    return dataframe[keep], hashes[keep]
+
+
+def get_availability_cache_stats():
+    """Returns the hit/miss counters of the availability cache."""
+    return AVAILABILITY_CACHE.stats()
+
+
+@metrics_utils.instrumented("drop_stale")
+def drop_stale_availabilities(dataframe):
+    """
+    Drops the availability rows older than the current availability of their
+    charging station, e.g. when replaying events that failed earlier.
+
+    The SCD Type 2 merge makes any changed row current whatever its time, so
+    late rows are dropped before writing. The event log already keeps a newer
+    current status when a late event arrives, so nothing is dropped when
+    `AvailabilityStorageMode` is "events".
+
+    Args:
+        dataframe (pandas.DataFrame): A DataFrame containing availability data.
 
+    Returns:
+        pandas.DataFrame: The rows that are not older than the current
+        availability, including those whose time cannot be parsed.
+    """
+    if AVAILABILITY_STORAGE_MODE == "events" or dataframe.empty:
+        return dataframe
+    current = {}
+    keys = list(dict.fromkeys(dataframe["ChargingStationId"].dropna()))
     with session_scope() as session:
-        for _, row in dataframe.iterrows():
-            charging_station_data = row.to_dict()
-            try:
-                add_or_update_charging_station(
-                    charging_station_data.pop("ChargingStationId"),
-                    charging_station_data.pop("SiteId"),
-                    charging_station_data.pop("Owner"),
-                    charging_station_data.pop("InstallationStatus"),
-                    session=session,
-                    **charging_station_data,
-                )
-            except Exception as exception:
-                logging.error(
-                    "Error adding or updating charging station: %s", exception
-                )
+        for chunk in _chunked(keys, MERGE_CHUNK_SIZE):
+            query = select(
+                EVRoamAvailabilities.ChargingStationId,
+                EVRoamAvailabilities.AvailabilityTime,
+            ).where(
+                EVRoamAvailabilities.ChargingStationId.in_(chunk),
+                EVRoamAvailabilities.ODSIsCurrent == true(),
+            )
+            current.update(session.execute(query).all())
+    if not current:
+        return dataframe
+    # Malformed times compare as not stale, so coerce_dataframe dead-letters their rows
+    times = pd.to_datetime(
+        dataframe["AvailabilityTime"], utc=True, format="ISO8601", errors="coerce"
+    )
+    current_times = pd.to_datetime(
+        dataframe["ChargingStationId"].map(current), utc=True, format="ISO8601", errors="coerce"
+    )
+    stale = (times < current_times).to_numpy()
+    if not stale.any():
+        return dataframe
+    logging.info("Dropped %s availabilities older than the current ones", stale.sum())
+    return dataframe[~stale]
 
 
+@profiled
 def write_availabilities_to_db(dataframe):
     """
     Writes availability data to the database.
 
+    When `AvailabilityStorageMode` is "events", the rows are appended to the
+    availability event log instead (see `append_availability_events`).
+    Otherwise they are merged into the SCD Type 2 availability table: when the
+    availability cache is enabled, rows whose hash key matches the cached
+    current version of their charging station are dropped before any
+    database round trip. The rows are then committed every
+    `INGEST_BATCH_ROWS` rows (see `write_in_batches`). The cache is filled
+    once from the current rows, updated with the rows written and invalidated
+    when a write fails.
+
     Args:
         dataframe (pandas.DataFrame): A DataFrame containing availability data.
 
     Returns:
-        None
+        dict: The counts of `write_in_batches`, with the rows dropped by the
+        cache counted as "unchanged", or in "events" mode the counts of
+        `append_availability_events`. None if the rows do not match the model.
     """
-    # Replace `nan` values with `None` for proper SQL NULL handling
-    dataframe = dataframe.where(pd.notnull(dataframe), None)
-
-    with session_scope() as session:
-        for _, row in dataframe.iterrows():
-            availability_data = row.to_dict()
+    if AVAILABILITY_STORAGE_MODE == "events":
+        with session_scope() as session:
             try:
-                add_or_update_availability(
-                    availability_data.pop("ChargingStationId"),
-                    availability_data.pop("AvailabilityStatus"),
-                    availability_data.pop("AvailabilityTime"),
-                    session=session,
-                    **availability_data,
-                )
-            except Exception as exception:
-                logging.error("Error adding or updating availability: %s", exception)
+                return append_availability_events(dataframe, session)
+            except ValueError as exception:
+                logging.error("Error appending availability events: %s", exception)
+                return None
+
+    dropped = 0
+    try:
+        prepared = _hash_dataframe(EVRoamAvailabilities, "ChargingStationId", dataframe)
+        dataframe, hash_keys, hashes, invalid = prepared
+        if AVAILABILITY_CACHE.enabled and "ChargingStationId" in dataframe.columns:
+            if not AVAILABILITY_CACHE.is_loaded:
+                _load_availability_cache()
+            received = len(dataframe)
+            dataframe, hashes = _drop_unchanged_availabilities(dataframe, hashes)
+            dropped = received - len(dataframe)
+            logging.info(
+                "Availability cache dropped %s of %s unchanged rows", dropped, received
+            )
+            metrics_utils.add(unchanged=dropped)
+            if dataframe.empty and not invalid:
+                return {"inserted": 0, "expired": 0, "unchanged": dropped, "dead_lettered": 0}
+        counts, written = write_in_batches(
+            EVRoamAvailabilities,
+            "ChargingStationId",
+            dataframe,
+            prepared=(dataframe, hash_keys, hashes, invalid),
+        )
+    except ValueError as exception:
+        logging.error("Error adding or updating availability: %s", exception)
+        return None
+    except Exception:
+        AVAILABILITY_CACHE.invalidate()
+        raise
+    counts["unchanged"] += dropped
+
+    if AVAILABILITY_CACHE.enabled:
+        for charging_station_id, incoming_hash, status, is_written in zip(
+            dataframe["ChargingStationId"],
+            hashes,
+            dataframe["AvailabilityStatus"],
+            written,
+        ):
+            if is_written:
+                AVAILABILITY_CACHE.put(charging_station_id, incoming_hash, status)
+    return counts
+
+
+AVAILABILITY_EVENT_COLUMNS = [
+    "PartitionDate",
+    "ChargingStationId",
+    "StatusCode",
+    "KwAvailable",
+    "AvailabilityEpoch",
+]
+_EPOCH = pd.Timestamp(0, tz="UTC")
+
+
+def _encode_availabilities(dataframe):
+    """
+    Converts availability rows to the compact layout of the event log.
+
+    Statuses not listed in `AVAILABILITY_STATUSES` are logged and stored as
+    "Unknown". Rows without a charging station or a valid availability time
+    are dropped.
+
+    Args:
+        dataframe (pandas.DataFrame): A DataFrame containing availability data.
+
+    Returns:
+        pandas.DataFrame: The `AVAILABILITY_EVENT_COLUMNS` and Operator.
+
+    Raises:
+        ValueError: If a required column is missing.
+    """
+    required = ["ChargingStationId", "AvailabilityStatus", "AvailabilityTime"]
+    missing = [name for name in required if name not in dataframe.columns]
+    if missing:
+        raise ValueError(f"Missing required field(s): {', '.join(missing)}")
+
+    times = pd.to_datetime(
+        dataframe["AvailabilityTime"], utc=True, errors="coerce", format="ISO8601"
+    )
+    valid = times.notna() & dataframe["ChargingStationId"].notna()
+    if not valid.all():
+        logging.warning("Dropping %s availabilities without a valid time", (~valid).sum())
+    dataframe, times = dataframe[valid], times[valid]
+
+    codes = {status.lower(): code for code, status in enumerate(AVAILABILITY_STATUSES)}
+    statuses = dataframe["AvailabilityStatus"].astype("str").str.strip().str.lower()
+    status_codes = statuses.map(codes)
+    unknown = statuses[status_codes.isna()].unique()
+    if len(unknown):
+        logging.warning(
+            "Storing unrecognised availability statuses as Unknown: %s", sorted(unknown)
+        )
+
+    if "KwAvailable" in dataframe.columns:
+        kw_available = pd.to_numeric(dataframe["KwAvailable"], errors="coerce")
+    else:
+        kw_available = pd.Series(np.nan, index=dataframe.index)
+    if "Operator" in dataframe.columns:
+        operators = dataframe["Operator"]
+    else:
+        operators = pd.Series(None, index=dataframe.index, dtype=object)
+    return pd.DataFrame(
+        {
+            "PartitionDate": times.dt.date,
+            "ChargingStationId": dataframe["ChargingStationId"].astype("str"),
+            "StatusCode": status_codes.fillna(0).astype("int16"),
+            "KwAvailable": kw_available.astype("float32"),
+            "AvailabilityEpoch": (times - _EPOCH) // pd.Timedelta(seconds=1),
+            "Operator": operators,
+        }
+    )
+
+
+@metrics_utils.instrumented("write")
+def append_availability_events(dataframe, session):
+    """
+    Appends availability rows to the event log and upserts the current status
+    of each charging station.
+
+    Only INSERTs are issued against the event log, and one lookup, one bulk
+    INSERT and one bulk UPDATE against the current-status table, so the cost
+    of a batch does not grow with the history. Events repeating the stored
+    current status of a station (e.g. a redelivered webhook) and duplicates
+    within the batch are skipped. The current status only moves forward in
+    time, so a late event is logged without replacing a newer status.
+
+    Args:
+        dataframe (pandas.DataFrame): A DataFrame containing availability data.
+        session (sqlalchemy.orm.session.Session): The SQLAlchemy session to use.
+
+    Returns:
+        dict: Counts of "appended" and "skipped" events, and of "inserted"
+        and "updated" current statuses.
+
+    Raises:
+        ValueError: If a required column is missing.
+    """
+    events = _encode_availabilities(dataframe).drop_duplicates(
+        subset=["ChargingStationId", "AvailabilityEpoch", "StatusCode"]
+    )
+    events = events.astype(object).where(events.notna(), None)
+    rows = events.to_dict("records")
+
+    status_table = EVRoamAvailabilityStatus
+    current = {}
+    keys = list(dict.fromkeys(events["ChargingStationId"]))
+    for chunk in _chunked(keys, MERGE_CHUNK_SIZE):
+        query = select(
+            status_table.ChargingStationId,
+            status_table.AvailabilityEpoch,
+            status_table.StatusCode,
+        ).where(status_table.ChargingStationId.in_(chunk))
+        for key, epoch, code in session.execute(query):
+            current[key] = (epoch, code)
+
+    appended = [
+        row
+        for row in rows
+        if current.get(row["ChargingStationId"])
+        != (row["AvailabilityEpoch"], row["StatusCode"])
+    ]
+    if appended:
+        session.execute(
+            insert(EVRoamAvailabilityEvents),
+            [{name: row[name] for name in AVAILABILITY_EVENT_COLUMNS} for row in appended],
+        )
+
+    latest = {}
+    for row in appended:
+        key = row["ChargingStationId"]
+        if key not in latest or row["AvailabilityEpoch"] >= latest[key]["AvailabilityEpoch"]:
+            latest[key] = row
+    now = datetime.utcnow()
+    inserts, updates = [], []
+    for key, row in latest.items():
+        status = {
+            "ChargingStationId": key,
+            "Operator": row["Operator"],
+            "StatusCode": row["StatusCode"],
+            "KwAvailable": row["KwAvailable"],
+            "AvailabilityEpoch": row["AvailabilityEpoch"],
+            "WaterMark": now,
+        }
+        if key not in current:
+            inserts.append(status)
+        elif row["AvailabilityEpoch"] >= current[key][0]:
+            updates.append(status)
+    if inserts:
+        session.execute(insert(status_table), inserts)
+    if updates:
+        session.execute(update(status_table), updates)
+
+    counts = {
+        "appended": len(appended),
+        "skipped": len(rows) - len(appended),
+        "inserted": len(inserts),
+        "updated": len(updates),
+    }
+    logging.info("Appended availability events: %s", counts)
+    metrics_utils.add(appended=counts["appended"], unchanged=counts["skipped"])
+    return counts
+
+
+def _read_frame(query, columns, session=None):
+    """Runs a query and returns its rows as a DataFrame."""
+    if session is None:
+        with session_scope() as own_session:
+            return _read_frame(query, columns, own_session)
+    return pd.DataFrame(session.execute(query).all(), columns=columns)
+
+
+def _decode_availabilities(frame):
+    """Replaces the compact status codes and epochs with labels and times."""
+    labels = np.array(AVAILABILITY_STATUSES, dtype=object)
+    frame["AvailabilityStatus"] = labels[frame.pop("StatusCode").to_numpy(dtype=int)]
+    frame["AvailabilityTime"] = pd.to_datetime(
+        frame.pop("AvailabilityEpoch").astype("int64"), unit="s"
+    )
+    return frame
+
+
+def get_current_availabilities(session=None):
+    """
+    Returns the current status of every charging station from the event store.
+
+    Args:
+        session (sqlalchemy.orm.session.Session, optional): The session to use.
+
+    Returns:
+        pandas.DataFrame: The `AVAILABILITIES_COLUMNS`, with AvailabilityTime
+        as a naive UTC datetime.
+    """
+    status_table = EVRoamAvailabilityStatus
+    columns = ["Operator", "ChargingStationId", "KwAvailable", "StatusCode", "AvailabilityEpoch"]
+    query = select(*[status_table.__table__.columns[name] for name in columns])
+    return _decode_availabilities(_read_frame(query, columns, session))
+
+
+def get_availability_history(charging_station_ids=None, start=None, end=None, session=None):
+    """
+    Rebuilds the SCD Type 2 view of availability from the event log.
+
+    Consecutive events of a station with the same status and power are one
+    version. A version is effective from its availability time until the next
+    version of the same station, and the last version is current.
+
+    The event log does not record the operator, and the status table only
+    holds the current one, so Operator is left out rather than reported for
+    periods before an operator change.
+
+    Args:
+        charging_station_ids (list, optional): Stations to include; all if omitted.
+        start (datetime, optional): Only versions still effective after this
+        naive UTC time are returned.
+        end (datetime, optional): Only events before this naive UTC time are read.
+        session (sqlalchemy.orm.session.Session, optional): The session to use.
+
+    Returns:
+        pandas.DataFrame: ChargingStationId, KwAvailable, AvailabilityStatus,
+        AvailabilityTime, ODSEffectiveFrom, ODSEffectiveTo and ODSIsCurrent,
+        ordered by station and time.
+    """
+    events = EVRoamAvailabilityEvents
+    columns = ["ChargingStationId", "KwAvailable", "StatusCode", "AvailabilityEpoch", "EventId"]
+    query = select(
+        events.ChargingStationId,
+        events.KwAvailable,
+        events.StatusCode,
+        events.AvailabilityEpoch,
+        events.EventId,
+    )
+    if end is not None:
+        end_epoch = (pd.Timestamp(end, tz="UTC") - _EPOCH) // pd.Timedelta(seconds=1)
+        query = query.where(events.AvailabilityEpoch < end_epoch)
+    if charging_station_ids is None:
+        frame = _read_frame(query, columns, session)
+    else:
+        frame = pd.concat(
+            [
+                _read_frame(query.where(events.ChargingStationId.in_(chunk)), columns, session)
+                for chunk in _chunked(list(charging_station_ids), MERGE_CHUNK_SIZE)
+            ]
+            or [pd.DataFrame(columns=columns)],
+            ignore_index=True,
+        )
+
+    frame = frame.sort_values(
+        ["ChargingStationId", "AvailabilityEpoch", "EventId"], kind="stable"
+    ).drop(columns="EventId")
+    station = frame["ChargingStationId"]
+    new_station = station.ne(station.shift())
+    kw_available = frame["KwAvailable"]
+    kw_changed = kw_available.ne(kw_available.shift()) & ~(
+        kw_available.isna() & kw_available.shift().isna()
+    )
+    status_changed = frame["StatusCode"].ne(frame["StatusCode"].shift())
+    versions = _decode_availabilities(
+        frame[new_station | status_changed | kw_changed].reset_index(drop=True)
+    )
+
+    has_next = versions["ChargingStationId"].eq(versions["ChargingStationId"].shift(-1))
+    versions["ODSEffectiveFrom"] = versions["AvailabilityTime"]
+    versions["ODSEffectiveTo"] = versions["AvailabilityTime"].shift(-1).where(has_next)
+    versions["ODSIsCurrent"] = ~has_next
+    if start is not None:
+        versions = versions[
+            versions["ODSEffectiveTo"].isna() | (versions["ODSEffectiveTo"] > start)
+        ].reset_index(drop=True)
+    return versions
+
+
+def purge_availability_events(before, session=None):
+    """
+    Deletes the availability events of the UTC days before `before`.
+
+    Args:
+        before (datetime.date): The first day to keep.
+        session (sqlalchemy.orm.session.Session, optional): The session to use.
+
+    Returns:
+        int: The number of events deleted.
+    """
+    if session is None:
+        with session_scope() as own_session:
+            return purge_availability_events(before, own_session)
+    return session.execute(
+        delete(EVRoamAvailabilityEvents).where(
+            EVRoamAvailabilityEvents.PartitionDate < before
+        )
+    ).rowcount
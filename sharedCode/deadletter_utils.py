@@ -0,0 +1,112 @@
+"""
+This module provides a dead-letter store for EVRoam data that could not be ingested.
+Entries are saved as JSON blobs below `DEAD_LETTER_FILE_PATH_PREFIX`, grouped by kind,
+so that they can be inspected and replayed instead of being lost to the logs.
+
+Rows rejected by the SQL database are dead-lettered with kind "rows": each entry
+holds the table, the record as it was bound and the database error.
+
+Webhook events that could not be downloaded or written are dead-lettered with kind
+"events": each entry holds the Event Grid event, its type and data URL, the
+downloaded payload if there was one, the stage that failed ("download" or
+"process"), the error and the number of attempts made. They are replayed by
+`event_utils.replay_dead_letters`.
+"""
+
+import json
+import uuid
+import logging
+from datetime import datetime, timezone
+
+from constants import DEAD_LETTER_FILE_PATH, DEAD_LETTER_FILE_PATH_PREFIX
+from sharedCode import storage_utils
+
+
+def get_dead_letter_store(connection_string=None):
+    """Returns the blob store holding the dead-letter entries."""
+    return storage_utils.get_blob_store(DEAD_LETTER_FILE_PATH["container"], connection_string)
+
+
+def write_dead_letters(kind, entries, store=None):
+    """
+    Saves dead-letter entries of one kind as one JSON blob.
+
+    Args:
+        kind (str): The kind of entries, e.g. "rows".
+        entries (list): JSON-serialisable dictionaries; values that are not
+        (e.g. datetimes) are saved as strings.
+        store (optional): The blob store to use. Defaults to `get_dead_letter_store()`.
+
+    Returns:
+        str: The name of the written blob, or None if there were no entries.
+    """
+    if not entries:
+        return None
+    store = store or get_dead_letter_store()
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    blob_name = DEAD_LETTER_FILE_PATH["path"].format(
+        kind=kind, blob_prefix=f"{timestamp}-{uuid.uuid4().hex}"
+    )
+    store.upload_blob(blob_name, json.dumps(entries, default=str), overwrite=False)
+    logging.warning("Dead-lettered %s %s as %s", len(entries), kind, blob_name)
+    return blob_name
+
+
+def dead_letter_rows(table, records, errors, store=None):
+    """
+    Saves rows rejected by the SQL database.
+
+    Failures are logged rather than raised, so the dead-letter store never
+    blocks ingestion of the remaining rows.
+
+    Args:
+        table (str): The name of the table the rows were written to.
+        records (list): The rejected records.
+        errors (list): The error raised for each record.
+        store (optional): The blob store to use.
+
+    Returns:
+        str: The name of the written blob, or None.
+    """
+    failed_at = datetime.now(timezone.utc).isoformat()
+    entries = [
+        {"table": table, "record": record, "error": str(error), "failed_at": failed_at}
+        for record, error in zip(records, errors)
+    ]
+    try:
+        return write_dead_letters("rows", entries, store)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error("Failed to dead-letter %s rows of %s: %s", len(entries), table, error)
+        return None
+
+
+def dead_letter_events(entries, store=None):
+    """
+    Saves webhook events that could not be ingested.
+
+    Failures are logged rather than raised, like `dead_letter_rows`.
+
+    Args:
+        entries (list): The dead-letter entries of the events.
+        store (optional): The blob store to use.
+
+    Returns:
+        str: The name of the written blob, or None.
+    """
+    try:
+        return write_dead_letters("events", entries, store)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error("Failed to dead-letter %s events: %s", len(entries), error)
+        return None
+
+
+def list_dead_letters(kind, store=None):
+    """Returns the names of the dead-letter blobs of one kind, oldest first."""
+    store = store or get_dead_letter_store()
+    return store.list_blobs(f"{DEAD_LETTER_FILE_PATH_PREFIX}/{kind}/")
+
+
+def read_dead_letters(blob_name, store=None):
+    """Returns the entries saved in one dead-letter blob."""
+    store = store or get_dead_letter_store()
+    return json.loads(store.download_blob(blob_name))
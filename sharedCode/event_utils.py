@@ -0,0 +1,573 @@
+"""
+This module provides the EVRoam event processing shared by the webhook listener and
+the staged event worker. It downloads the data referenced by Event Grid events,
+transforms it and writes it to the SQL database, and stages event batches in blob
+storage so that the listener can acknowledge a delivery before processing it.
+
+Event Grid delivers at least once, and EVRoam may notify several changes of the
+same charging station within seconds. Events already seen by this worker, by
+Event Grid id or data URL, are dropped, and the payloads of one type processed
+together are written once, with the availability updates of each charging
+station coalesced to the latest within `COALESCE_WINDOW_SECONDS`.
+"""
+
+import os
+import json
+import uuid
+import logging
+import threading
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pandas as pd
+import requests
+
+from constants import (
+    JSON_FILE_PATH,
+    JSON_KEYS,
+    JSON_TYPES,
+)
+from sharedCode import cache_utils
+from sharedCode import database_utils
+from sharedCode import deadletter_utils
+from sharedCode import landing_utils
+from sharedCode import metrics_utils
+from sharedCode import pipeline_utils
+from sharedCode import schema_utils
+from sharedCode import storage_utils
+
+TIMEOUT = 5
+# Number of event payloads downloaded concurrently within one delivery
+DOWNLOAD_WORKERS = int(os.getenv("EvroamDownloadWorkers", "8"))
+# Number of dead-lettered events replayed together
+REPLAY_BATCH_EVENTS = int(os.getenv("EvroamReplayBatchEvents", "100"))
+# Availability updates of a charging station this close to a later one are dropped
+COALESCE_WINDOW_SECONDS = float(os.getenv("EvroamCoalesceWindowSeconds", "60"))
+# How long, and for how many events, event ids and data URLs are remembered
+EVENT_DEDUPE_SECONDS = float(os.getenv("EvroamEventDedupeSeconds", "900"))
+EVENT_DEDUPE_SIZE = int(os.getenv("EvroamEventDedupeSize", "10000"))
+WRITE_TO_DB = {
+    "chargingstations": database_utils.write_chargingstations_to_db,
+    "sites": database_utils.write_sites_to_db,
+    "availabilities": database_utils.write_availabilities_to_db,
+}
+
+
+RECENT_EVENTS = cache_utils.RecentKeys(EVENT_DEDUPE_SECONDS, EVENT_DEDUPE_SIZE)
+
+
+class EventStats:
+    """
+    Counts the events received by this worker and the rows they led to write.
+
+    Counters:
+        events_received: Events delivered to `process_events`.
+        events_duplicate: Events dropped as already seen.
+        events_processed: Events written to the database.
+        events_failed: Events dead-lettered.
+        rows_received: Records in the downloaded payloads.
+        rows_coalesced: Records dropped as superseded within the coalescing window.
+        rows_written: Rows the database writers inserted, or appended to the
+        availability event log.
+    """
+
+    FIELDS = (
+        "events_received",
+        "events_duplicate",
+        "events_processed",
+        "events_failed",
+        "rows_received",
+        "rows_coalesced",
+        "rows_written",
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, **counts):
+        """Adds to the named counters."""
+        with self._lock:
+            for name, count in counts.items():
+                self._counts[name] += count
+
+    def reset(self):
+        """Sets every counter back to zero."""
+        with self._lock:
+            self._counts = dict.fromkeys(self.FIELDS, 0)
+
+    def snapshot(self):
+        """Returns the current counters as a dictionary."""
+        with self._lock:
+            return dict(self._counts)
+
+
+EVENT_STATS = EventStats()
+
+
+def get_event_stats():
+    """Returns the event and row counters of this worker."""
+    return EVENT_STATS.snapshot()
+
+
+def process_json_data(data_url, json_data, skip_stale=False):
+    """
+    JSON data manipulation and insertion into the SQL database
+
+    Args:
+        data_url (str): The data URL
+        json_data (dict): The JSON data to process
+        skip_stale (bool): Drop availabilities older than the current ones,
+        e.g. when replaying dead-lettered events.
+
+    Returns:
+        None: The function does not return anything
+
+    Raises:
+        Exception: If writing to the database fails.
+    """
+    json_types = [json_type for json_type in JSON_TYPES if json_type in data_url.lower()]
+    if json_types:
+        if len(json_types) > 1:
+            logging.warning("Multiple json_type matches found: %s", json_types)
+        landing_utils.land_payload(json_types[0], json_data, kind="event", source=data_url)
+        process_payloads(json_types[0], [(data_url, json_data)], skip_stale)
+
+
+def process_payloads(json_type, payloads, skip_stale=False):
+    """
+    Writes the payloads of several events of one type to the SQL database together.
+
+    The payloads are not landed: `process_json_data` lands its payload, and
+    `process_events` lands each one as it is downloaded. The records are
+    concatenated in delivery order, availability updates are coalesced per charging station
+    within `COALESCE_WINDOW_SECONDS`, and duplicate keys keep their latest row,
+    so only the final state of a burst of events is written.
+
+    Args:
+        json_type (str): The entity type, one of `JSON_TYPES`.
+        payloads (list): (data URL, JSON data) tuples, in delivery order.
+        skip_stale (bool): Drop availabilities older than the current ones,
+        e.g. when replaying dead-lettered events.
+
+    Returns:
+        dict: Counts of "rows_received", "rows_coalesced" and "rows_written".
+
+    Raises:
+        Exception: If writing to the database fails.
+    """
+    logging.info("JSON Type: %s", json_type)
+    records = []
+    for _, json_data in payloads:
+        if isinstance(json_data, list):
+            records.extend(json_data)
+        else:
+            records.append(json_data)
+    counts = {"rows_received": len(records), "rows_coalesced": 0, "rows_written": 0}
+    metrics_utils.add(received=len(records))
+    with metrics_utils.stage("normalize"):
+        # Normalize JSON data to DataFrame and transform to match schema
+        dataframe = pd.json_normalize(records)
+        # Replace characters and PascalCase the columns to match the model
+        schema_utils.normalize_columns(dataframe)
+    if set(JSON_KEYS[json_type]) != set(dataframe.columns.intersection(JSON_KEYS[json_type])):
+        return counts
+    with metrics_utils.stage("coalesce"):
+        dataframe = pipeline_utils.coalesce_availabilities(dataframe, COALESCE_WINDOW_SECONDS)
+    counts["rows_coalesced"] = len(records) - len(dataframe)
+    metrics_utils.add(coalesced=counts["rows_coalesced"])
+    # Drop duplicates and rows with missing keys, keeping the latest
+    # and handling charging stations with availability information
+    if json_type == "chargingstations":
+        with metrics_utils.stage("dedupe"):
+            unique = len(dataframe)
+            availabilities_df, dataframe = pipeline_utils.split_chargingstations(
+                dataframe, keep="last"
+            )
+            metrics_utils.add(deduped=unique - len(dataframe))
+        if availabilities_df is not None:
+            if skip_stale:
+                availabilities_df = database_utils.drop_stale_availabilities(
+                    availabilities_df
+                )
+            counts["rows_written"] += _rows_written(
+                database_utils.write_availabilities_to_db(availabilities_df)
+            )
+            logging.info("Availability data written successfully to SQL Database")
+    else:
+        with metrics_utils.stage("dedupe"):
+            unique = len(dataframe)
+            dataframe = pipeline_utils.select_unique_rows(
+                dataframe, JSON_KEYS[json_type], keep="last"
+            )
+            metrics_utils.add(deduped=unique - len(dataframe))
+        if skip_stale and json_type == "availabilities":
+            dataframe = database_utils.drop_stale_availabilities(dataframe)
+    # Write processed data to database
+    counts["rows_written"] += _rows_written(WRITE_TO_DB[json_type](dataframe))
+    logging.info("%s data written successfully to SQL Database", json_type)
+    return counts
+
+
+def _rows_written(counts):
+    """
+    Returns the rows a `write_*_to_db` function added, from the counts it
+    returned: the SCD Type 2 versions inserted, or the availability events
+    appended. A writer that rejected the rows returns no counts.
+    """
+    if not isinstance(counts, dict):
+        return 0
+    return counts["appended"] if "appended" in counts else counts.get("inserted", 0)
+
+
+_http_session_lock = threading.Lock()
+_http_session = {}
+
+
+def get_http_session():
+    """
+    Returns the process-wide requests session used to download event payloads.
+
+    The session keeps a pool of keep-alive connections large enough for
+    `DOWNLOAD_WORKERS` concurrent downloads.
+    """
+    with _http_session_lock:
+        if "session" not in _http_session:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=DOWNLOAD_WORKERS, pool_maxsize=DOWNLOAD_WORKERS
+            )
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _http_session["session"] = session
+        return _http_session["session"]
+
+
+def get_json_type(data_url):
+    """Returns the first entry of `JSON_TYPES` named in a data URL, or None."""
+    json_types = [json_type for json_type in JSON_TYPES if json_type in data_url.lower()]
+    return json_types[0] if json_types else None
+
+
+def fetch_event(event):
+    """
+    Downloads the data referenced by an EVRoam event.
+
+    Args:
+        event (dict): The Event Grid event.
+
+    Returns:
+        tuple: The data URL and the downloaded JSON data, or None if there is
+        nothing to process.
+
+    Raises:
+        Exception: If the event is malformed or the download fails.
+    """
+    event_type = event["eventType"]
+    data_url = event["data"]["url"]
+
+    logging.info("Event Type: %s", event_type)
+    logging.info("Data URL: %s", data_url)
+
+    if not data_url:
+        logging.info(
+            "This HTTP triggered function executed successfully, "
+            "but data_url is not defined."
+        )
+        return None
+
+    response = get_http_session().get(data_url, timeout=TIMEOUT)
+    response.raise_for_status()
+    json_data = response.json()
+    if json_data:
+        return data_url, json_data
+    logging.warning("No data found in the event.")
+    return None
+
+
+def _failed_event(entry, stage, error, payload=None):
+    """Builds the dead-letter entry of an event that failed at `stage`."""
+    event = entry["event"]
+    data = event.get("data") if isinstance(event, dict) else None
+    return {
+        "event": event,
+        "event_type": event.get("eventType") if isinstance(event, dict) else None,
+        "url": data.get("url") if isinstance(data, dict) else None,
+        "payload": payload,
+        "stage": stage,
+        "error": str(error),
+        "attempts": entry.get("attempts", 0) + 1,
+        "failed_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _download_entry(entry):
+    """
+    Downloads the data of an event entry and lands it, unless the entry
+    already holds it, in which case it was landed when first downloaded.
+
+    Returns:
+        tuple: The entry, the data URL and JSON data (or None), and the
+        dead-letter entry if the download failed (or None).
+    """
+    if entry.get("payload") is not None:
+        return entry, (entry["url"], entry["payload"]), None
+    try:
+        with metrics_utils.stage("download"):
+            download = fetch_event(entry["event"])
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error("Failed to download event data: %s", error)
+        return entry, None, _failed_event(entry, "download", error)
+    if download is not None:
+        # Land the payload here, so the blob writes run concurrently too
+        json_type = get_json_type(download[0])
+        if json_type is not None:
+            with metrics_utils.stage("land"):
+                landing_utils.land_payload(
+                    json_type, download[1], kind="event", source=download[0]
+                )
+    return entry, download, None
+
+
+def _process_entries(entries, workers=None, skip_stale=False, store=None):
+    """
+    Downloads and writes event entries, dead-lettering those that fail.
+
+    The payloads of each type are written together by `process_payloads`, so
+    when that fails every event of the type is dead-lettered.
+
+    Args:
+        entries (list): Dictionaries holding an "event", and optionally its
+        "payload", "url" and previous "attempts".
+        workers (int, optional): Concurrent downloads. Defaults to `DOWNLOAD_WORKERS`.
+        skip_stale (bool): Passed to `process_payloads`.
+        store (optional): The dead-letter blob store to use.
+
+    Returns:
+        tuple: Counts of "events", "processed" and "failed" entries, and
+        whether every failed entry was saved to the dead-letter store.
+    """
+    counts = {"events": len(entries), "processed": 0, "failed": 0}
+    if not entries:
+        return counts, True
+    workers = max(min(workers or DOWNLOAD_WORKERS, len(entries)), 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(metrics_utils.bind(_download_entry), entries))
+
+    failures = [failure for _, _, failure in results if failure is not None]
+    downloads = [(entry, download) for entry, download, _ in results if download is not None]
+    order = {json_type: index for index, json_type in enumerate(JSON_TYPES)}
+    downloads.sort(
+        key=lambda item: order.get(get_json_type(item[1][0]), len(JSON_TYPES))
+    )
+    for json_type, group in groupby(downloads, key=lambda item: get_json_type(item[1][0])):
+        group = list(group)
+        if json_type is None:
+            counts["processed"] += len(group)
+            continue
+        try:
+            rows = process_payloads(
+                json_type, [download for _, download in group], skip_stale=skip_stale
+            )
+            counts["processed"] += len(group)
+            EVENT_STATS.add(**rows)
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error("Error processing %s events: %s", json_type, str(error))
+            failures.extend(
+                _failed_event(entry, "process", error, json_data)
+                for entry, (_, json_data) in group
+            )
+
+    counts["failed"] = len(failures)
+    EVENT_STATS.add(events_processed=counts["processed"], events_failed=counts["failed"])
+    saved = True
+    if failures:
+        saved = deadletter_utils.dead_letter_events(failures, store) is not None
+    return counts, saved
+
+
+def process_events(events):
+    """
+    Processes a batch of EVRoam events.
+
+    Events whose Event Grid id or data URL was seen within
+    `EVENT_DEDUPE_SECONDS` are dropped. An event counts as seen once it was
+    written or dead-lettered, so a batch that fails midway and is retried,
+    e.g. by the blob trigger, is processed again in full. The payloads of the others are
+    downloaded and landed concurrently, with at most `DOWNLOAD_WORKERS`
+    downloads in flight. They are then written one type at a time in the order of
+    `JSON_TYPES`, so charging stations are written before availabilities, with
+    the payloads of each type coalesced into one write. Events whose download
+    or write fails are saved to the dead-letter store, with the payload if it
+    was downloaded, for `replay_dead_letters`.
+
+    Args:
+        events (list): The Event Grid events.
+
+    Returns:
+        dict: Counts of "events", "processed" and "failed" events, where
+        duplicate events count as neither processed nor failed.
+    """
+    batch_keys = set()
+    entries = [{"event": event} for event in events if not _is_duplicate(event, batch_keys)]
+    EVENT_STATS.add(
+        events_received=len(events), events_duplicate=len(events) - len(entries)
+    )
+    counts, saved = _process_entries(entries)
+    # Only events written or dead-lettered count as seen, so that a batch
+    # failing midway is processed in full when it is retried
+    if saved:
+        for key in batch_keys:
+            RECENT_EVENTS.add(key)
+    counts["events"] = len(events)
+    return counts
+
+
+def _event_keys(event):
+    """Returns the keys an event is recognised by when redelivered: its id and data URL."""
+    if not isinstance(event, dict):
+        return []
+    data = event.get("data")
+    keys = []
+    if event.get("id"):
+        keys.append(("id", event["id"]))
+    if isinstance(data, dict) and data.get("url"):
+        keys.append(("url", data["url"]))
+    return keys
+
+
+def _is_duplicate(event, batch_keys):
+    """
+    Returns whether an event's id or data URL was seen recently or earlier in
+    its batch, and adds both to `batch_keys`.
+    """
+    keys = _event_keys(event)
+    # Note every key, even once a duplicate is found
+    seen = [key in RECENT_EVENTS or key in batch_keys for key in keys]
+    batch_keys.update(keys)
+    return any(seen)
+
+
+def replay_dead_letters(store=None, workers=None, batch_events=None):
+    """
+    Re-processes the dead-lettered webhook events, oldest first.
+
+    Dead-letter blobs are read and processed together in batches of about
+    `batch_events` events, downloading the events without a saved payload
+    concurrently. A blob is deleted once its events have been processed;
+    events failing again are dead-lettered anew with their attempt count
+    increased, and if that fails the blobs of the batch are kept. Replaying is idempotent: unchanged rows are skipped by the
+    SCD Type 2 hash check, and availabilities older than the current ones
+    are dropped, so a replay interrupted midway can simply be run again.
+
+    Args:
+        store (optional): The dead-letter blob store. Defaults to
+        `deadletter_utils.get_dead_letter_store()`.
+        workers (int, optional): Concurrent downloads. Defaults to `DOWNLOAD_WORKERS`.
+        batch_events (int, optional): Events processed together. Defaults to
+        `REPLAY_BATCH_EVENTS`.
+
+    Returns:
+        dict: Counts of "blobs", "events", "processed" and "failed" events.
+    """
+    store = store or deadletter_utils.get_dead_letter_store()
+    batch_events = batch_events or REPLAY_BATCH_EVENTS
+    totals = {"blobs": 0, "events": 0, "processed": 0, "failed": 0}
+    blob_names = deadletter_utils.list_dead_letters("events", store)
+
+    def replay(batch_blobs, entries):
+        counts, saved = _process_entries(entries, workers, skip_stale=True, store=store)
+        if saved:
+            for blob_name in batch_blobs:
+                store.delete_blob(blob_name)
+        else:
+            # The events failing again exist nowhere else, so keep their blobs
+            logging.error(
+                "Keeping %s dead-letter blobs, as their failed events could not be saved",
+                len(batch_blobs),
+            )
+        totals["blobs"] += len(batch_blobs)
+        for name, count in counts.items():
+            totals[name] += count
+
+    batch_blobs, entries = [], []
+    for blob_name in blob_names:
+        batch_blobs.append(blob_name)
+        entries.extend(deadletter_utils.read_dead_letters(blob_name, store))
+        if len(entries) >= batch_events:
+            replay(batch_blobs, entries)
+            batch_blobs, entries = [], []
+    if batch_blobs:
+        replay(batch_blobs, entries)
+    logging.info("Replayed dead-lettered events: %s", totals)
+    return totals
+
+
+def validate_events(events):
+    """
+    Validates an Event Grid delivery before it is staged.
+
+    Args:
+        events (list): The Event Grid events.
+
+    Raises:
+        ValueError: If the delivery is not a list of events with a type and data.
+    """
+    if not isinstance(events, list):
+        raise ValueError("Expected a list of Event Grid events.")
+    for event in events:
+        if not isinstance(event, dict) or "eventType" not in event:
+            raise ValueError("Event is missing its eventType.")
+        if not isinstance(event.get("data"), dict):
+            raise ValueError(f"Event {event.get('id')} is missing its data.")
+
+
+def stage_events(events, store=None):
+    """
+    Saves a batch of EVRoam events to the staging container for later processing.
+
+    Args:
+        events (list): The validated Event Grid events.
+        store (optional): The blob store to use. Defaults to the staging
+        container described by `JSON_FILE_PATH`.
+
+    Returns:
+        str: The name of the staged blob.
+    """
+    if store is None:
+        store = storage_utils.get_blob_store(JSON_FILE_PATH["container"])
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    blob_name = JSON_FILE_PATH["path"].format(
+        blob_prefix=f"{timestamp}-{uuid.uuid4().hex}"
+    )
+    store.upload_blob(blob_name, json.dumps(events), overwrite=False)
+    logging.info("Staged %s events as %s", len(events), blob_name)
+    return blob_name
+
+
+def process_staged_events(store, blob_name, events=None):
+    """
+    Processes a staged batch of EVRoam events and removes it from the staging container.
+
+    The blob is kept if processing raises, so the blob trigger retries it.
+    Failing to remove it afterwards is only logged, since its events have
+    been written or dead-lettered.
+
+    Args:
+        store: The blob store holding the staged batch.
+        blob_name (str): The name of the staged blob.
+        events (list, optional): The staged events, when already read.
+        Defaults to the contents of the blob.
+
+    Returns:
+        dict: The counts of `process_events`.
+    """
+    if events is None:
+        events = json.loads(store.download_blob(blob_name))
+    counts = process_events(events)
+    try:
+        store.delete_blob(blob_name)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.warning("Failed to remove staged events %s: %s", blob_name, error)
+    return counts
@@ -0,0 +1,231 @@
+"""
+This module provides a columnar landing zone for raw EVRoam payloads. Every snapshot
+fetched by the timer functions and every payload delivered through the webhook is
+flattened with `pandas.json_normalize` and written as a Parquet file, partitioned by
+entity type (one of `JSON_TYPES`) and ingestion date, so that downstream jobs and the
+scripts can read what was received instead of calling the EVRoam API again.
+
+Files are named `<kind>-<run id>-<part>.parquet` below the partition, where the kind
+is "snapshot" for a full fetch of an API endpoint, "increment" for a fetch of the
+results changed since a time, and "event" for a webhook payload.
+A snapshot streamed in several batches is written as several parts of one run. The
+column names are those of the payload; nested lists and objects are stored as JSON
+strings, and string columns are dictionary-encoded.
+"""
+
+import io
+import os
+import json
+import uuid
+import logging
+from datetime import date, datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from constants import JSON_TYPES, PARQUET_FILE_PATH, PARQUET_FILE_PATH_PREFIX
+from sharedCode import storage_utils
+
+# Whether payloads are written to the landing zone as they are ingested
+LANDING_ENABLED = os.getenv("EvroamLandingZone", "true").lower() == "true"
+KINDS = ("snapshot", "increment", "event")
+
+
+def get_landing_store(connection_string=None):
+    """Returns the blob store holding the landing zone."""
+    return storage_utils.get_blob_store(PARQUET_FILE_PATH["container"], connection_string)
+
+
+def new_run_id():
+    """Returns a unique, time-ordered identifier for a landing run."""
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return f"{timestamp}-{uuid.uuid4().hex}"
+
+
+def _blob_name(json_type, kind, run_id, part):
+    ingestion_date = f"{run_id[:4]}-{run_id[4:6]}-{run_id[6:8]}"
+    return PARQUET_FILE_PATH["path"].format(
+        json_type=json_type,
+        ingestion_date=ingestion_date,
+        blob_prefix=f"{kind}-{run_id}-{part:05d}",
+    )
+
+
+def _parse_blob_name(blob_name):
+    """Returns the json type, ingestion date, kind, run id and part of a blob."""
+    _, json_type, partition, file_name = blob_name.split("/")
+    kind, run_id = file_name[: -len(".parquet")].split("-", 1)
+    run_id, part = run_id.rsplit("-", 1)
+    ingestion_date = date.fromisoformat(partition.split("=", 1)[1])
+    return json_type, ingestion_date, kind, run_id, int(part)
+
+
+def _encode_value(value):
+    """Returns a value of a mixed column as a string, JSON-encoding non-strings."""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _to_table(records, metadata):
+    """
+    Flattens payload records into an Arrow table.
+
+    Columns holding lists or objects after flattening, or mixing value types,
+    are stored as strings, with every non-string value JSON-encoded.
+    """
+    dataframe = pd.json_normalize(records)
+    for name in dataframe.columns:
+        column = dataframe[name]
+        if column.dtype != object:
+            continue
+        types = set(column.dropna().map(type))
+        if len(types) > 1 or types & {list, dict}:
+            dataframe[name] = column.map(_encode_value, na_action="ignore")
+    table = pa.Table.from_pandas(dataframe, preserve_index=False)
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[b"evroam"] = json.dumps(metadata).encode("utf-8")
+    return table.replace_schema_metadata(schema_metadata)
+
+
+def write_payload(
+    json_type, records, kind="event", source=None, run_id=None, part=0, store=None
+):
+    """
+    Writes raw payload records to the landing zone as one Parquet file.
+
+    Args:
+        json_type (str): The entity type, one of `JSON_TYPES`.
+        records (list | dict): The payload records.
+        kind (str): "snapshot" for (part of) a full API fetch, "increment" for
+        (part of) a fetch of changed results, "event" for a webhook payload.
+        source (str, optional): Where the payload came from, e.g. its URL.
+        run_id (str, optional): The run the file belongs to. Defaults to a new run.
+        part (int): The part number within the run.
+        store (optional): The blob store to use. Defaults to `get_landing_store()`.
+
+    Returns:
+        str: The name of the written blob, or None if there were no records.
+
+    Raises:
+        ValueError: If `json_type` or `kind` is not recognised.
+    """
+    if json_type not in JSON_TYPES:
+        raise ValueError(f"Unknown json type: {json_type}")
+    if kind not in KINDS:
+        raise ValueError(f"Unknown landing kind: {kind}")
+    if not records:
+        return None
+    run_id = run_id or new_run_id()
+    metadata = {"json_type": json_type, "kind": kind, "source": source, "run_id": run_id}
+    table = _to_table(records, metadata)
+    string_columns = [
+        field.name
+        for field in table.schema
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+    ]
+    buffer = io.BytesIO()
+    pq.write_table(table, buffer, use_dictionary=string_columns, compression="snappy")
+
+    store = store or get_landing_store()
+    blob_name = _blob_name(json_type, kind, run_id, part)
+    store.upload_blob(blob_name, buffer.getvalue(), overwrite=False)
+    logging.info("Landed %s %s records as %s", table.num_rows, json_type, blob_name)
+    return blob_name
+
+
+def land_payload(json_type, records, **kwargs):
+    """
+    Writes raw payload records to the landing zone if it is enabled.
+
+    Takes the arguments of `write_payload`. Failures are logged rather than
+    raised, so the landing zone never blocks ingestion into the database.
+
+    Returns:
+        str: The name of the written blob, or None.
+    """
+    if not LANDING_ENABLED:
+        return None
+    try:
+        return write_payload(json_type, records, **kwargs)
+    except Exception as error:  # pylint: disable=broad-except
+        logging.error("Failed to land %s payload: %s", json_type, error)
+        return None
+
+
+def list_payloads(json_type, kind=None, start_date=None, end_date=None, store=None):
+    """
+    Lists the landed files of an entity type, oldest first.
+
+    Args:
+        json_type (str): The entity type, one of `JSON_TYPES`.
+        kind (str, optional): Only list files of this kind.
+        start_date (datetime.date, optional): First ingestion date to include.
+        end_date (datetime.date, optional): Last ingestion date to include.
+        store (optional): The blob store to use. Defaults to `get_landing_store()`.
+
+    Returns:
+        list: The blob names.
+    """
+    store = store or get_landing_store()
+    names = []
+    for blob_name in store.list_blobs(f"{PARQUET_FILE_PATH_PREFIX}/{json_type}/"):
+        if not blob_name.endswith(".parquet"):
+            continue
+        _, ingestion_date, blob_kind, _, _ = _parse_blob_name(blob_name)
+        if kind is not None and blob_kind != kind:
+            continue
+        if start_date is not None and ingestion_date < start_date:
+            continue
+        if end_date is not None and ingestion_date > end_date:
+            continue
+        names.append(blob_name)
+    return sorted(names, key=lambda name: _parse_blob_name(name)[3:])
+
+
+def read_payload(blob_name, store=None):
+    """Reads one landed file into a DataFrame."""
+    store = store or get_landing_store()
+    return pq.read_table(io.BytesIO(store.download_blob(blob_name))).to_pandas()
+
+
+def read_payloads(json_type, kind=None, start_date=None, end_date=None, store=None):
+    """
+    Reads the landed files of an entity type into one DataFrame.
+
+    Takes the arguments of `list_payloads`.
+
+    Returns:
+        pandas.DataFrame: The records of every file, oldest first.
+    """
+    store = store or get_landing_store()
+    names = list_payloads(json_type, kind, start_date, end_date, store)
+    frames = [read_payload(name, store) for name in names]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_latest_snapshot(json_type, store=None):
+    """
+    Reads every part of the most recent landed snapshot of an entity type.
+
+    Args:
+        json_type (str): The entity type, one of `JSON_TYPES`.
+        store (optional): The blob store to use. Defaults to `get_landing_store()`.
+
+    Returns:
+        pandas.DataFrame: The snapshot records, empty if none was landed.
+    """
+    store = store or get_landing_store()
+    names = list_payloads(json_type, kind="snapshot", store=store)
+    if not names:
+        return pd.DataFrame()
+    latest_run = _parse_blob_name(names[-1])[3]
+    frames = [
+        read_payload(name, store)
+        for name in names
+        if _parse_blob_name(name)[3] == latest_run
+    ]
+    return pd.concat(frames, ignore_index=True)
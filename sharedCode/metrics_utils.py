@@ -0,0 +1,185 @@
+"""
+This module provides lightweight instrumentation of the ingestion pipeline.
+
+Each function invocation is measured with `invocation`, and its pipeline stages
+with `stage` or the `instrumented` decorator. A stage records how often it ran,
+how long it took and how many SQL statements were sent while it ran, and `add`
+counts rows (received, deduped, coalesced, unchanged, inserted, expired, ...).
+When the invocation ends, its metrics are logged as one structured record whose
+values are also passed as `custom_dimensions`, so Application Insights keeps
+them as queryable properties.
+
+Stages and counts outside an invocation, or while `EvroamMetricsEnabled` is
+"false", are not recorded, at the cost of one context variable lookup.
+"""
+
+import os
+import json
+import time
+import logging
+import functools
+import threading
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+METRICS_ENABLED = os.getenv("EvroamMetricsEnabled", "true").lower() == "true"
+
+_current = ContextVar("evroam_metrics", default=None)
+_NO_STAGE = nullcontext()
+
+
+class Metrics:
+    """
+    The stage timings, SQL statement count and row counters of one invocation.
+
+    Args:
+        name (str): The name of the invocation, e.g. the function name.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self.statements = 0
+        self.counts = {}
+        self.stages = {}
+
+    def add(self, **counts):
+        """Adds to the named row counters."""
+        with self._lock:
+            for name, count in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + int(count)
+
+    def count_statement(self):
+        """Counts one SQL statement, or one executemany batch."""
+        with self._lock:
+            self.statements += 1
+
+    @contextmanager
+    def stage(self, name):
+        """Times the enclosed block as one run of the stage `name`."""
+        statements = self.statements
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(
+                    name, {"calls": 0, "seconds": 0.0, "statements": 0}
+                )
+                stage["calls"] += 1
+                stage["seconds"] += elapsed
+                stage["statements"] += self.statements - statements
+
+    def snapshot(self):
+        """Returns the metrics recorded so far as a dictionary."""
+        with self._lock:
+            return {
+                "invocation": self.name,
+                "seconds": time.perf_counter() - self._started,
+                "statements": self.statements,
+                "counts": dict(self.counts),
+                "stages": {name: dict(stage) for name, stage in self.stages.items()},
+            }
+
+
+def current():
+    """Returns the `Metrics` of the running invocation, or None."""
+    return _current.get()
+
+
+@contextmanager
+def invocation(name):
+    """
+    Records the metrics of the enclosed block as one invocation and logs them
+    when it ends, whether or not it raised.
+
+    Yields:
+        Metrics: The metrics of the invocation, or None when disabled.
+    """
+    if not METRICS_ENABLED:
+        yield None
+        return
+    metrics = Metrics(name)
+    token = _current.set(metrics)
+    try:
+        yield metrics
+    finally:
+        _current.reset(token)
+        snapshot = metrics.snapshot()
+        logging.info(
+            "Invocation metrics: %s",
+            json.dumps(snapshot, default=str),
+            extra={"custom_dimensions": snapshot},
+        )
+
+
+def stage(name):
+    """Returns a context manager timing the enclosed block as the stage `name`."""
+    metrics = _current.get()
+    return _NO_STAGE if metrics is None else metrics.stage(name)
+
+
+def add(**counts):
+    """Adds to the named row counters of the running invocation."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.add(**counts)
+
+
+def count_statement(*_):
+    """Engine `before_cursor_execute` handler counting statements of the running invocation."""
+    metrics = _current.get()
+    if metrics is not None:
+        metrics.count_statement()
+
+
+def instrumented(name):
+    """Decorator timing every call of a function as the stage `name`."""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            metrics = _current.get()
+            if metrics is None:
+                return function(*args, **kwargs)
+            with metrics.stage(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def timed(iterable, name):
+    """Yields the items of `iterable`, timing the wait for each as the stage `name`."""
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def bind(function):
+    """
+    Returns `function` bound to the running invocation, so the stages and
+    counts of calls made on worker threads, e.g. by a `ThreadPoolExecutor`,
+    are recorded with it.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        token = _current.set(metrics)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return wrapper
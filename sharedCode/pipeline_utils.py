@@ -0,0 +1,170 @@
+"""
+This module provides building blocks for streaming EVRoam snapshots into the SQL
+database page by page, so that memory use stays flat as the dataset grows and rows
+are persisted as soon as their page arrives.
+
+Entity frames are selected from the normalised payload without intermediate copies:
+column selections are views of the payload frame under pandas Copy-on-Write, and
+invalid or duplicate rows are removed with a single boolean mask, so each frame is
+materialised at most once. Missing values are left as NaN and only replaced by None
+when rows are bound for the database.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from constants import AVAILABILITIES_COLUMNS, CHARGINGSTATIONS_DROP_COLUMNS, JSON_KEYS
+
+# Number of API results normalised and written together when streaming
+STREAM_BATCH_ROWS = int(os.getenv("EvroamStreamBatchRows", "5000"))
+
+
+def batch_pages(pages, max_rows=None):
+    """
+    Groups the result lists of consecutive pages into batches.
+
+    Args:
+        pages (iterable): Lists of API results, one per page.
+        max_rows (int, optional): Results per batch before it is yielded.
+        Defaults to `STREAM_BATCH_ROWS`. A single page is never split.
+
+    Yields:
+        list: The results of one or more consecutive pages.
+    """
+    max_rows = max_rows or STREAM_BATCH_ROWS
+    batch = []
+    for page in pages:
+        batch.extend(page)
+        if len(batch) >= max_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def unique_rows_mask(dataframe, keys, keep="first"):
+    """
+    Returns a boolean mask of the rows that have every key column set and are
+    the first (or with `keep="last"`, the last) occurrence of their keys, as
+    `drop_duplicates` followed by `dropna(how="any")` on the keys would keep them.
+    """
+    mask = ~dataframe.duplicated(subset=keys, keep=keep).to_numpy()
+    mask &= dataframe[keys].notna().all(axis=1).to_numpy()
+    return mask
+
+
+def select_rows(dataframe, keep):
+    """Returns the rows selected by a boolean mask, or `dataframe` itself if all are."""
+    if keep.all():
+        return dataframe
+    return dataframe[keep]
+
+
+def select_unique_rows(dataframe, keys, keep="first"):
+    """
+    Returns the rows of `dataframe` that have every key column set, without
+    duplicate keys. The frame is only copied if a row is removed.
+    """
+    return select_rows(dataframe, unique_rows_mask(dataframe, keys, keep))
+
+
+def coalesce_availabilities(dataframe, window_seconds):
+    """
+    Collapses the availability updates of each charging station that are at
+    most `window_seconds` older than the next update of the same station,
+    keeping the latest.
+
+    Updates further apart are all kept, in order of `AvailabilityTime`, so the
+    SCD Type 2 history of a station keeps one version per window. The frame is
+    returned unchanged if no station appears twice or the columns are missing.
+
+    Args:
+        dataframe (pandas.DataFrame): Rows with `ChargingStationId` and
+        `AvailabilityTime` columns, e.g. concatenated event payloads.
+        window_seconds (float): The coalescing window.
+
+    Returns:
+        pandas.DataFrame: The coalesced rows.
+    """
+    if not {"ChargingStationId", "AvailabilityTime"} <= set(dataframe.columns):
+        return dataframe
+    stations = dataframe["ChargingStationId"]
+    if not stations.duplicated().any():
+        return dataframe
+    updates = pd.DataFrame(
+        {
+            "station": stations.to_numpy(),
+            "time": pd.to_datetime(
+                dataframe["AvailabilityTime"].to_numpy(),
+                utc=True,
+                format="ISO8601",
+                errors="coerce",
+            ),
+            "position": np.arange(len(dataframe)),
+        }
+    ).sort_values(["time", "position"], kind="stable")
+    next_time = updates.groupby("station", sort=False, dropna=False)["time"].shift(-1)
+    superseded = next_time.notna() & (
+        next_time - updates["time"] <= pd.Timedelta(seconds=window_seconds)
+    )
+    return dataframe.iloc[updates["position"].to_numpy()[~superseded.to_numpy()]]
+
+
+def split_chargingstations(dataframe, keep="first"):
+    """
+    Splits a normalised charging stations DataFrame into availabilities and
+    charging stations in one pass.
+
+    Each entity is deduplicated and stripped of rows with missing keys using
+    its own `JSON_KEYS`. Both frames are views of `dataframe` unless rows have
+    to be removed, in which case each is materialised once.
+
+    Args:
+        dataframe (pandas.DataFrame): Charging stations with PascalCase columns.
+        keep (str): Which occurrence of a duplicated key to keep, "first" or "last".
+
+    Returns:
+        tuple: The availabilities DataFrame, or None if the payload carries no
+        availability information, and the charging stations DataFrame.
+    """
+    availability_keys = JSON_KEYS["availabilities"]
+    availabilities = None
+    if "AvailabilityStatus" in dataframe.columns and set(availability_keys) <= set(
+        dataframe.columns
+    ):
+        columns = [name for name in AVAILABILITIES_COLUMNS if name in dataframe.columns]
+        availabilities = select_rows(
+            dataframe[columns], unique_rows_mask(dataframe, availability_keys, keep)
+        )
+    chargingstations = dataframe.drop(columns=CHARGINGSTATIONS_DROP_COLUMNS, errors="ignore")
+    chargingstations = select_unique_rows(
+        chargingstations, JSON_KEYS["chargingstations"], keep
+    )
+    return availabilities, chargingstations
+
+
+class KeyDeduplicator:
+    """
+    Drops rows whose key columns were already seen in this or an earlier
+    DataFrame of the same stream, keeping the first occurrence as
+    `DataFrame.drop_duplicates` does for a single frame.
+    """
+
+    def __init__(self, keys):
+        self.keys = list(keys)
+        self.seen = set()
+
+    def __call__(self, dataframe):
+        """Returns `dataframe` without rows whose keys have been seen before."""
+        if dataframe.empty:
+            return dataframe
+        if len(self.keys) == 1:
+            keys = dataframe[self.keys[0]].tolist()
+        else:
+            keys = list(dataframe[self.keys].itertuples(index=False, name=None))
+        keep = ~dataframe.duplicated(subset=self.keys).to_numpy()
+        keep &= np.fromiter((key not in self.seen for key in keys), bool, len(keys))
+        self.seen.update(keys)
+        return select_rows(dataframe, keep)
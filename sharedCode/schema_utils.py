@@ -0,0 +1,101 @@
+"""
+This module provides the column name normalisation shared by every EVRoam entry point.
+Raw API field names and `pd.json_normalize` paths (e.g. `location.lat`) are converted
+to the PascalCase column names of the SQL models (e.g. `Locationlat`): the characters
+in `CHARACTERS_TO_REPLACE` are removed and the name is camelized.
+
+Known EVRoam field names are converted once at import, and any other name is memoised
+in a bounded LRU cache, so header handling is a dictionary lookup on warm invocations.
+"""
+
+from functools import lru_cache
+
+from inflection import camelize
+
+from constants import CHARACTERS_TO_REPLACE
+
+COLUMN_NAME_CACHE_SIZE = 1024
+
+# Field names and json_normalize paths returned by the EVRoam consumer API
+KNOWN_JSON_PATHS = [
+    "accessLocations",
+    "address",
+    "assetId",
+    "availabilityStatus",
+    "availabilityTime",
+    "carParkCount",
+    "chargingStationId",
+    "connectors",
+    "current",
+    "dateFirstOperational",
+    "floorLevel",
+    "hasCarparkCost",
+    "hasChargingCost",
+    "hasTouristAttraction",
+    "images",
+    "installationStatus",
+    "is24Hours",
+    "kwAvailable",
+    "kwRated",
+    "location.lat",
+    "location.lon",
+    "manufacturer",
+    "maxTimeLimit",
+    "model",
+    "name",
+    "nextPlannedOutage",
+    "operator",
+    "owner",
+    "providerDeleted",
+    "siteId",
+]
+
+
+def _to_pascal_case(name):
+    """Removes `CHARACTERS_TO_REPLACE` from a raw name and camelizes it."""
+    for character in CHARACTERS_TO_REPLACE:
+        name = name.replace(character, " ")
+    return camelize(name.strip(), uppercase_first_letter=True).replace(" ", "")
+
+
+KNOWN_COLUMN_NAMES = {path: _to_pascal_case(path) for path in KNOWN_JSON_PATHS}
+
+
+@lru_cache(maxsize=COLUMN_NAME_CACHE_SIZE)
+def _cached_to_pascal_case(name):
+    return _to_pascal_case(name)
+
+
+def normalize_column_name(name):
+    """
+    Converts a raw field name or json_normalize path to its PascalCase column name.
+
+    Args:
+        name (str): The raw name, e.g. "location.lat".
+
+    Returns:
+        str: The column name, e.g. "Locationlat".
+    """
+    known = KNOWN_COLUMN_NAMES.get(name)
+    if known is not None:
+        return known
+    return _cached_to_pascal_case(name)
+
+
+def normalize_columns(dataframe):
+    """
+    Renames the columns of a DataFrame to PascalCase column names in place.
+
+    Args:
+        dataframe (pandas.DataFrame): The DataFrame built from API results.
+
+    Returns:
+        pandas.DataFrame: The same DataFrame, for chaining.
+    """
+    dataframe.columns = [normalize_column_name(column) for column in dataframe.columns]
+    return dataframe
+
+
+def column_name_cache_info():
+    """Returns the hit/miss statistics of the column name LRU cache."""
+    return _cached_to_pascal_case.cache_info()
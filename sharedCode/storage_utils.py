@@ -0,0 +1,127 @@
+"""
+This module provides a small blob storage interface for the EVRoam project. It wraps
+an Azure Blob Storage container, and offers a filesystem-backed stand-in with the
+same methods so that staging and landing code can be run and tested locally.
+
+Set the `LocalBlobStoragePath` environment variable to a directory to make
+`get_blob_store` return the filesystem stand-in instead of Azure Blob Storage.
+Stores are cached per container, so the Azure clients and their connections are
+reused across calls.
+"""
+
+import os
+import threading
+from pathlib import Path
+
+from azure.storage.blob import BlobServiceClient
+
+
+class LocalBlobStore:
+    """
+    Stores blobs as files below `<root>/<container>`, mirroring the blob names.
+    """
+
+    def __init__(self, root, container):
+        self.container = container
+        self.path = Path(root) / container
+
+    def _blob_path(self, name):
+        return self.path.joinpath(*name.split("/"))
+
+    def upload_blob(self, name, data, overwrite=True):
+        """Writes `data` (bytes or str) to the blob `name`."""
+        path = self._blob_path(name)
+        if path.exists() and not overwrite:
+            raise FileExistsError(f"Blob already exists: {self.container}/{name}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        temporary_path = path.with_name(f".{path.name}.tmp")
+        temporary_path.write_bytes(data)
+        temporary_path.replace(path)
+
+    def download_blob(self, name):
+        """Returns the contents of the blob `name` as bytes."""
+        path = self._blob_path(name)
+        if not path.exists():
+            raise FileNotFoundError(f"Blob not found: {self.container}/{name}")
+        return path.read_bytes()
+
+    def list_blobs(self, prefix=""):
+        """Returns the sorted names of the blobs starting with `prefix`."""
+        if not self.path.exists():
+            return []
+        names = (
+            path.relative_to(self.path).as_posix()
+            for path in self.path.rglob("*")
+            if path.is_file() and not path.name.startswith(".")
+        )
+        return sorted(name for name in names if name.startswith(prefix))
+
+    def delete_blob(self, name):
+        """Deletes the blob `name` if it exists."""
+        self._blob_path(name).unlink(missing_ok=True)
+
+
+class AzureBlobStore:
+    """
+    Stores blobs in an Azure Blob Storage container.
+    """
+
+    def __init__(self, connection_string, container):
+        self.container = container
+        service_client = BlobServiceClient.from_connection_string(connection_string)
+        self.client = service_client.get_container_client(container)
+
+    def upload_blob(self, name, data, overwrite=True):
+        """Writes `data` (bytes or str) to the blob `name`."""
+        self.client.upload_blob(name, data, overwrite=overwrite)
+
+    def download_blob(self, name):
+        """Returns the contents of the blob `name` as bytes."""
+        return self.client.download_blob(name).readall()
+
+    def list_blobs(self, prefix=""):
+        """Returns the sorted names of the blobs starting with `prefix`."""
+        return sorted(blob.name for blob in self.client.list_blobs(prefix))
+
+    def delete_blob(self, name):
+        """Deletes the blob `name`."""
+        self.client.delete_blob(name)
+
+
+_store_lock = threading.Lock()
+_stores = {}
+
+
+def get_blob_store(container, connection_string=None):
+    """
+    Returns a blob store for `container`, reusing the one created by an earlier
+    call for the same container and account.
+
+    The filesystem stand-in is used when `LocalBlobStoragePath` is set, and the
+    Azure Blob Storage account from `connection_string` or
+    `StorageAccountConnectionString` otherwise.
+
+    Args:
+        container (str): Name of the blob container.
+        connection_string (str, optional): The storage account connection string.
+
+    Returns:
+        LocalBlobStore | AzureBlobStore: The blob store.
+    """
+    local_root = os.getenv("LocalBlobStoragePath")
+    if not local_root:
+        connection_string = connection_string or os.getenv(
+            "StorageAccountConnectionString"
+        )
+        if not connection_string:
+            raise ValueError("StorageAccountConnectionString is not set or is empty!")
+    key = (local_root, connection_string, container)
+    with _store_lock:
+        if key not in _stores:
+            if local_root:
+                _stores[key] = LocalBlobStore(local_root, container)
+            else:
+                _stores[key] = AzureBlobStore(connection_string, container)
+        return _stores[key]
@@ -0,0 +1,195 @@
+"""
+This module provides incremental fetching for the timer-triggered fallback functions.
+A small JSON state file in blob storage keeps, per entity type, the high-water mark of
+the provider change timestamps already ingested and the time of the last full
+reconcile. Between full reconciles only the API results changed since the high-water
+mark are ingested, either filtered by the API itself when `EvroamChangedSinceParam`
+names a query parameter it supports, or filtered on the provider timestamp listed in
+`CHANGE_TIMESTAMP_FIELDS`. An entity type with neither is always fetched in full.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+from azure.core.exceptions import ResourceNotFoundError
+
+from constants import CHANGE_TIMESTAMP_FIELDS, STATE_FILE_PATH
+from sharedCode import storage_utils
+
+# Days between full reconciles, which fetch and ingest every result
+FULL_RECONCILE_DAYS = float(os.getenv("EvroamFullReconcileDays", "7"))
+FORCE_FULL_RECONCILE = os.getenv("EvroamForceFullReconcile", "false").lower() == "true"
+# Name of an API query parameter returning only results changed since a time
+CHANGED_SINCE_PARAM = os.getenv("EvroamChangedSinceParam", "")
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+class WatermarkStore:
+    """
+    Reads and writes the incremental fetch state of every entity type, kept as
+    one JSON blob.
+
+    Args:
+        store (optional): The blob store to use. Defaults to the container
+        described by `STATE_FILE_PATH`.
+        blob_name (str, optional): The name of the state blob.
+    """
+
+    def __init__(self, store=None, blob_name=None):
+        self.store = store or storage_utils.get_blob_store(STATE_FILE_PATH["container"])
+        self.blob_name = blob_name or STATE_FILE_PATH["path"]
+
+    def load(self):
+        """Returns the state of every entity type."""
+        try:
+            return json.loads(self.store.download_blob(self.blob_name))
+        except (FileNotFoundError, ResourceNotFoundError):
+            return {}
+
+    def get(self, json_type):
+        """Returns the state of one entity type."""
+        return self.load().get(json_type, {})
+
+    def update(self, json_type, **values):
+        """Merges `values` into the state of one entity type."""
+        state = self.load()
+        state.setdefault(json_type, {}).update(values)
+        self.store.upload_blob(self.blob_name, json.dumps(state, indent=2), overwrite=True)
+
+
+class IncrementalFetch:
+    """
+    Plans one fetch of an entity type and records its high-water mark.
+
+    The fetch is a full reconcile when forced, when there is no high-water
+    mark yet (or the state cannot be read), when the last full reconcile is
+    `FULL_RECONCILE_DAYS` old, or when the entity type cannot be fetched
+    incrementally. A fetch that skipped a page which failed to download
+    leaves the state unchanged.
+
+    Args:
+        json_type (str): The entity type, one of `JSON_TYPES`.
+        state (WatermarkStore, optional): The state store to use.
+        now (datetime, optional): The start of the fetch, timezone-aware.
+        force_full (bool, optional): Force a full reconcile. Defaults to
+        `FORCE_FULL_RECONCILE`.
+    """
+
+    def __init__(self, json_type, state=None, now=None, force_full=None):
+        self.json_type = json_type
+        self.started_at = now or datetime.now(timezone.utc)
+        self.timestamp_field = CHANGE_TIMESTAMP_FIELDS.get(json_type)
+        self.changed_since_param = CHANGED_SINCE_PARAM
+        try:
+            self.state = state or WatermarkStore()
+            entry = self.state.get(json_type)
+        except Exception as error:  # pylint: disable=broad-except
+            logging.error(
+                "Failed to read the fetch state, fetching %s in full: %s", json_type, error
+            )
+            self.state, entry = None, {}
+        self.since = _parse_time(entry.get("high_water_mark"))
+        self.last_full_reconcile = _parse_time(entry.get("last_full_reconcile"))
+        if force_full is None:
+            force_full = FORCE_FULL_RECONCILE
+        self.full = (
+            force_full
+            or self.since is None
+            or self.last_full_reconcile is None
+            or self.started_at - self.last_full_reconcile
+            >= timedelta(days=FULL_RECONCILE_DAYS)
+            or not (self.timestamp_field or self.changed_since_param)
+        )
+        self.high_water_mark = self.since
+        self.received = 0
+        self.selected = 0
+        # Filled by `api_utils.fetch_pages` with the pages it skipped
+        self.failed_pages = []
+        logging.info(
+            "%s fetch of %s since %s",
+            "Full" if self.full else "Incremental",
+            json_type,
+            self.since,
+        )
+
+    @property
+    def params(self):
+        """The query parameters asking the API for changed results only, if any."""
+        if self.full or not self.changed_since_param:
+            return None
+        return {self.changed_since_param: self.since.isoformat()}
+
+    @property
+    def is_complete(self):
+        """Whether the API returns every result, i.e. is not filtering by time."""
+        return self.params is None
+
+    def changed(self, records):
+        """
+        Returns, for each of one batch of API results, whether it changed since
+        the high-water mark, and advances the mark to the newest provider
+        timestamp seen.
+
+        Every result counts as changed during a full reconcile, as do results
+        without a valid timestamp.
+        """
+        self.received += len(records)
+        changed = np.ones(len(records), dtype=bool)
+        if self.timestamp_field and records:
+            times = pd.to_datetime(
+                pd.Series([record.get(self.timestamp_field) for record in records]),
+                utc=True,
+                errors="coerce",
+                format="ISO8601",
+            )
+            newest = times.max()
+            if pd.notna(newest) and (
+                self.high_water_mark is None or newest > self.high_water_mark
+            ):
+                self.high_water_mark = newest.to_pydatetime()
+            if not self.full:
+                changed = (times.isna() | (times > pd.Timestamp(self.since))).to_numpy()
+        self.selected += int(changed.sum())
+        return changed
+
+    def select(self, records):
+        """Returns the results of one batch of API results changed since the high-water mark."""
+        return [record for record, keep in zip(records, self.changed(records)) if keep]
+
+    def commit(self):
+        """
+        Saves the high-water mark once the fetched results are ingested.
+
+        Nothing is saved if a page of the fetch failed, so the next fetch
+        starts again from the same mark, or is a full reconcile again.
+        """
+        if self.state is None:
+            return
+        if self.failed_pages:
+            logging.warning(
+                "Not advancing the %s high-water mark: pages %s failed to download",
+                self.json_type,
+                self.failed_pages,
+            )
+            return
+        high_water_mark = self.high_water_mark
+        if not self.timestamp_field:
+            high_water_mark = self.started_at
+        values = {"high_water_mark": high_water_mark and high_water_mark.isoformat()}
+        if self.full:
+            values["last_full_reconcile"] = self.started_at.isoformat()
+        self.state.update(self.json_type, **values)
+        logging.info(
+            "Ingested %s of %s %s results; high-water mark %s",
+            self.selected,
+            self.received,
+            self.json_type,
+            values["high_water_mark"],
+        )
@@ -0,0 +1,109 @@
+"""
+A local HTTP server that stands in for the EVRoam endpoints in tests.
+
+Routes are registered as callables that receive the request path and query
+parameters and return a status code and a JSON-serialisable body. Each
+response can be delayed to simulate network latency.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class StubServer:
+    """
+    Serves JSON responses from registered routes on a local port.
+
+    Usage:
+        with StubServer() as server:
+            server.add_route("/sites/1.json", lambda path, query: (200, [...]))
+            requests.get(server.url("/sites/1.json"))
+    """
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Dispatches GET requests to the registered routes."""
+
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                """Handles a GET request."""
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                with stub._lock:  # pylint: disable=protected-access
+                    stub.requests.append((parsed.path, query))
+                route = stub.routes.get(parsed.path)
+                status, body = route(parsed.path, query) if route else (404, {})
+                delay = float(query.get("delay", stub.delay))
+                if delay:
+                    time.sleep(delay)
+                payload = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_):
+                """Silences the default request logging."""
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self):
+        """The "host:port" the server listens on."""
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def url(self, path):
+        """Returns the absolute URL of `path` on the server."""
+        return f"http://{self.host}{path}"
+
+    def add_route(self, path, handler):
+        """Registers `handler(path, query) -> (status, body)` for `path`."""
+        self.routes[path] = handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def paginated_route(result_key, items, page_size, failures=None):
+    """
+    Returns a route handler that serves `items` like the EVRoam consumer API,
+    `page_size` results per `resultPage`, with a `hasMoreResults` flag.
+
+    `failures` maps a page number to a list of HTTP statuses returned, one per
+    request, before the page is served successfully.
+    """
+    failures = {page: list(statuses) for page, statuses in (failures or {}).items()}
+    lock = threading.Lock()
+
+    def handler(_, query):
+        page = int(query.get("resultPage", 1))
+        with lock:
+            pending = failures.get(page)
+            if pending:
+                return pending.pop(0), {"message": "transient failure"}
+        start = (page - 1) * page_size
+        return 200, {
+            result_key: items[start : start + page_size],
+            "hasMoreResults": start + page_size < len(items),
+        }
+
+    return handler
@@ -0,0 +1,136 @@
+"""Module for testing the sharedCode.api_utils functionality."""
+
+import math
+import time
+import unittest
+from unittest import mock
+
+from sharedCode import api_utils
+from tests.http_stub import StubServer, paginated_route
+
+SITES = [{"siteId": f"site-{index}"} for index in range(95)]
+CHARGING_STATIONS = [{"chargingStationId": f"cs-{index}"} for index in range(42)]
+PAGE_SIZE = 10
+
+
+class TestFetchPages(unittest.TestCase):
+    """Tests for the paginated EVRoam API client."""
+
+    def setUp(self):
+        self.server = StubServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.base_url = self.server.url("/consumer/api")
+        for patcher in (
+            mock.patch.object(api_utils, "RETRY_BACKOFF", 0.0),
+            mock.patch.object(api_utils, "PAGE_CONCURRENCY", 4),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def add_endpoint(self, endpoint, result_key, items, failures=None):
+        """Serves `items` from a paginated endpoint of the stub."""
+        self.server.add_route(
+            f"/consumer/api/{endpoint}",
+            paginated_route(result_key, items, PAGE_SIZE, failures),
+        )
+
+    def requested_pages(self, endpoint):
+        """Returns the pages requested from an endpoint, in request order."""
+        return [
+            int(query["resultPage"])
+            for path, query in self.server.requests
+            if path == f"/consumer/api/{endpoint}"
+        ]
+
+    def test_fetches_all_pages_in_order(self):
+        """Every page of both endpoints is returned once, in page order."""
+        self.add_endpoint("Site", "sites", SITES)
+        self.add_endpoint("ChargingStation", "chargingStations", CHARGING_STATIONS)
+        self.assertEqual(
+            api_utils.fetch_all("Site", "sites", "key", self.base_url), SITES
+        )
+        self.assertEqual(
+            api_utils.fetch_all(
+                "ChargingStation", "chargingStations", "key", self.base_url
+            ),
+            CHARGING_STATIONS,
+        )
+        # At most PAGE_CONCURRENCY - 1 pages are requested past the last one
+        self.assertLessEqual(max(self.requested_pages("Site")), 10 + 3)
+
+    def test_extra_params_are_sent_with_every_page(self):
+        """Extra query parameters are sent alongside resultPage."""
+        self.add_endpoint("Site", "sites", SITES[:25])
+        params = {"changedSince": "2024-01-01T00:00:00+00:00"}
+        api_utils.fetch_all("Site", "sites", "key", self.base_url, params=params)
+        self.assertTrue(
+            all(
+                query["changedSince"] == params["changedSince"]
+                for path, query in self.server.requests
+            )
+        )
+
+    def test_transient_failures_are_retried(self):
+        """429 and 5xx responses are retried until the page is served."""
+        self.add_endpoint("Site", "sites", SITES, failures={1: [503], 4: [429, 502]})
+        self.assertEqual(
+            api_utils.fetch_all("Site", "sites", "key", self.base_url), SITES
+        )
+        self.assertEqual(self.requested_pages("Site").count(4), 3)
+
+    def test_failed_page_does_not_drop_the_rest(self):
+        """A page that keeps failing is skipped and later pages are still returned."""
+        self.add_endpoint("Site", "sites", SITES, failures={3: [500] * 10})
+        with mock.patch.object(api_utils, "MAX_RETRIES", 2):
+            data = api_utils.fetch_all("Site", "sites", "key", self.base_url)
+        self.assertEqual(data, SITES[:20] + SITES[30:])
+
+    def test_skipped_pages_are_reported(self):
+        """The numbers of the pages skipped after failing are appended to `failures`."""
+        self.add_endpoint("Site", "sites", SITES, failures={3: [500] * 10})
+        failures = []
+        with mock.patch.object(api_utils, "MAX_RETRIES", 2):
+            pages = list(
+                api_utils.fetch_pages("Site", "sites", "key", self.base_url, failures=failures)
+            )
+        self.assertEqual(sum(pages, []), SITES[:20] + SITES[30:])
+        self.assertEqual(failures, [3])
+
+    def test_pages_are_prefetched_concurrently(self):
+        """Pages after the first are fetched concurrently."""
+        self.add_endpoint("Site", "sites", SITES)
+        self.server.delay = 0.2
+        start = time.perf_counter()
+        api_utils.fetch_all("Site", "sites", "key", self.base_url)
+        elapsed = time.perf_counter() - start
+        # 10 pages one at a time would take 2 seconds
+        self.assertLess(elapsed, 1.5)
+
+
+class TestTimerFetchers(unittest.TestCase):
+    """Tests for the endpoints the timer-triggered fallbacks stream."""
+
+    def test_timer_endpoints_stream_through_the_shared_client(self):
+        """Both timer endpoints are streamed a page at a time from the default base URL."""
+        with StubServer() as server, mock.patch.object(
+            api_utils, "API_BASE_URL", server.url("/consumer/api")
+        ):
+            server.add_route(
+                "/consumer/api/Site", paginated_route("sites", SITES, PAGE_SIZE)
+            )
+            server.add_route(
+                "/consumer/api/ChargingStation",
+                paginated_route("chargingStations", CHARGING_STATIONS, PAGE_SIZE),
+            )
+            for endpoint, result_key, results in (
+                ("Site", "sites", SITES),
+                ("ChargingStation", "chargingStations", CHARGING_STATIONS),
+            ):
+                pages = list(api_utils.fetch_pages(endpoint, result_key, "key"))
+                self.assertEqual(len(pages), math.ceil(len(results) / PAGE_SIZE))
+                self.assertEqual([result for page in pages for result in page], results)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+"""Module for testing the sharedCode.cache_utils functionality."""
+
+import unittest
+
+from sharedCode.cache_utils import CurrentRowCache, RecentKeys
+
+
+class FakeClock:
+    """A manually advanced clock."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestCurrentRowCache(unittest.TestCase):
+    """Tests for the current-row hash cache."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = CurrentRowCache(ttl_seconds=60, max_size=2, clock=self.clock)
+
+    def test_load_and_get(self):
+        """Loaded rows are returned as (hash key, value) and counted as hits."""
+        self.cache.load([("CS1", b"h1", "Available")])
+        self.assertTrue(self.cache.is_loaded)
+        self.assertEqual(self.cache.get("CS1"), (b"h1", "Available"))
+        self.assertIsNone(self.cache.get("CS2"))
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_entries_expire(self):
+        """Entries older than the TTL are misses and the load goes stale."""
+        self.cache.load([("CS1", b"h1", None)])
+        self.clock.now = 30
+        self.cache.put("CS2", b"h2")
+        self.clock.now = 61
+        self.assertFalse(self.cache.is_loaded)
+        self.assertIsNone(self.cache.get("CS1"))
+        self.assertEqual(self.cache.get("CS2"), (b"h2", None))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Entries beyond max_size are evicted least recently used first."""
+        self.cache.put("CS1", b"h1")
+        self.cache.put("CS2", b"h2")
+        self.cache.get("CS1")
+        self.cache.put("CS3", b"h3")
+        self.assertIsNone(self.cache.get("CS2"))
+        self.assertIsNotNone(self.cache.get("CS1"))
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_invalidate_and_disabled(self):
+        """Invalidation empties the cache, and a size of 0 stores nothing."""
+        self.cache.load([("CS1", b"h1", None)])
+        self.cache.invalidate()
+        self.assertFalse(self.cache.is_loaded)
+        self.assertIsNone(self.cache.get("CS1"))
+
+        disabled = CurrentRowCache(ttl_seconds=60, max_size=0)
+        disabled.put("CS1", b"h1")
+        self.assertFalse(disabled.enabled)
+        self.assertEqual(disabled.stats()["size"], 0)
+
+
+class TestRecentKeys(unittest.TestCase):
+    """Tests for the expiring set of recently seen keys."""
+
+    def test_keys_are_forgotten_after_ttl_or_beyond_size(self):
+        """A key is new again once expired or pushed out by newer keys."""
+        clock = FakeClock()
+        keys = RecentKeys(ttl_seconds=60, max_size=2, clock=clock)
+        self.assertTrue(keys.add("a"))
+        self.assertFalse(keys.add("a"))
+        clock.now = 61
+        self.assertTrue(keys.add("a"))
+        keys.add("b")
+        keys.add("c")
+        self.assertTrue(keys.add("a"))
+        self.assertFalse(keys.add("c"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,1005 @@
+"""Module for testing the sharedCode.database_utils functionality."""
+
+import os
+import tempfile
+import unittest
+from datetime import date, datetime, timedelta
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from sqlalchemy import VARBINARY, Index, Integer, event, select, update
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.orm import sessionmaker
+
+from sharedCode import database_utils
+from sharedCode import deadletter_utils
+from sharedCode.database_utils import EVRoamAvailabilities, EVRoamSites
+
+SITE_HASH_KEYS = database_utils.get_dynamic_hash_keys(
+    EVRoamSites, exclude=["WaterMark", "ODS", "SiteId"]
+)
+AVAILABILITY_HASH_KEYS = database_utils.get_dynamic_hash_keys(
+    EVRoamAvailabilities, exclude=["WaterMark", "ODS", "ChargingStationId"]
+)
+
+
+def make_site(site_id, name="Site", **overrides):
+    """Builds a site record with every hashed column populated."""
+    record = {
+        "SiteId": site_id,
+        "AccessLocations": None,
+        "Address": "1 Test Street",
+        "CarParkCount": 2,
+        "HasCarparkCost": False,
+        "HasTouristAttraction": None,
+        "Is24Hours": True,
+        "MaxTimeLimit": None,
+        "Name": name,
+        "Operator": "Operator",
+        "ProviderDeleted": False,
+    }
+    record.update(overrides)
+    return record
+
+
+def make_availability(charging_station_id, status, time):
+    """Builds an availability record."""
+    return {
+        "ChargingStationId": charging_station_id,
+        "AvailabilityStatus": status,
+        "AvailabilityTime": time,
+        "KwAvailable": 22.0,
+        "Operator": "Operator",
+    }
+
+
+def table_contents(session, model, unique_key):
+    """Returns the SCD2-relevant columns of a table in a comparable form."""
+    rows = session.execute(
+        select(
+            model.__table__.columns[unique_key], model.ODSIsCurrent, model.ODSHashKey
+        )
+    ).all()
+    return sorted((tuple(row) for row in rows), key=repr)
+
+
+class TestMergeRecords(unittest.TestCase):
+    """Tests for the set-based SCD Type 2 merge."""
+
+    def setUp(self):
+        self.engine = database_utils.get_local_engine()
+        database_utils.create_tables(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def tearDown(self):
+        self.session.close()
+        self.engine.dispose()
+
+    def merge_sites(self, records):
+        """Merges site records and commits."""
+        counts = database_utils.merge_records(
+            EVRoamSites, "SiteId", SITE_HASH_KEYS, records, self.session
+        )
+        self.session.commit()
+        return counts
+
+    def test_inserts_new_records(self):
+        """New keys are inserted as current records."""
+        counts = self.merge_sites([make_site("A"), make_site("B")])
+        self.assertEqual(counts, {"inserted": 2, "expired": 0, "unchanged": 0})
+        contents = table_contents(self.session, EVRoamSites, "SiteId")
+        self.assertEqual([row[:2] for row in contents], [("A", True), ("B", True)])
+
+    def test_unchanged_records_are_skipped(self):
+        """Records whose hash matches the current version are no-ops."""
+        self.merge_sites([make_site("A"), make_site("B")])
+        counts = self.merge_sites([make_site("A"), make_site("B", name="Renamed")])
+        self.assertEqual(counts, {"inserted": 1, "expired": 1, "unchanged": 1})
+        current = self.session.execute(
+            select(EVRoamSites.SiteId, EVRoamSites.Name).where(
+                EVRoamSites.ODSIsCurrent.is_(True)
+            )
+        ).all()
+        self.assertEqual(sorted(current), [("A", "Site"), ("B", "Renamed")])
+
+    def test_repeated_keys_form_a_version_chain(self):
+        """A key repeated within one batch keeps only its last version current."""
+        records = [
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS1", "Occupied", datetime(2024, 1, 1, 0, 5)),
+        ]
+        counts = database_utils.merge_records(
+            EVRoamAvailabilities,
+            "ChargingStationId",
+            AVAILABILITY_HASH_KEYS,
+            records,
+            self.session,
+        )
+        self.assertEqual(counts, {"inserted": 2, "expired": 1, "unchanged": 1})
+        current = self.session.execute(
+            select(EVRoamAvailabilities.AvailabilityStatus).where(
+                EVRoamAvailabilities.ODSIsCurrent.is_(True)
+            )
+        ).scalars().all()
+        self.assertEqual(current, ["Occupied"])
+
+    def test_matches_per_row_scd2(self):
+        """The bulk merge leaves the same SCD2 state as add_or_update_record."""
+        batches = [
+            [make_site("A"), make_site("B"), make_site("C")],
+            [make_site("A"), make_site("B", Is24Hours=False), make_site("D")],
+            [make_site("B"), make_site("C", name="Other"), make_site("C")],
+        ]
+        for batch in batches:
+            self.merge_sites([dict(record) for record in batch])
+
+        engine = database_utils.get_local_engine()
+        database_utils.create_tables(engine)
+        session = sessionmaker(bind=engine)()
+        for batch in batches:
+            for record in batch:
+                fields = dict(record)
+                site_id = fields.pop("SiteId")
+                database_utils.add_or_update_record(
+                    EVRoamSites,
+                    {"SiteId": site_id},
+                    SITE_HASH_KEYS,
+                    session=session,
+                    **fields,
+                )
+            session.commit()
+
+        self.assertEqual(
+            table_contents(self.session, EVRoamSites, "SiteId"),
+            table_contents(session, EVRoamSites, "SiteId"),
+        )
+        session.close()
+        engine.dispose()
+
+    def test_staged_backend_matches_merge(self):
+        """The temp-table backend leaves the same state and counts as merge_records."""
+        batches = [
+            [make_site("A"), make_site("B"), make_site("C")],
+            [make_site("A"), make_site("B", Is24Hours=False), make_site("D")],
+            [
+                make_site("B"),
+                make_site("C", name="Other"),
+                make_site("C"),
+                make_site("C"),
+                make_site("E"),
+                make_site("E", name="Other"),
+            ],
+        ]
+        expected = [self.merge_sites([dict(record) for record in batch]) for batch in batches]
+
+        engine = database_utils.get_local_engine()
+        database_utils.create_tables(engine)
+        session = sessionmaker(bind=engine)()
+        actual = []
+        for batch in batches:
+            actual.append(
+                database_utils.merge_records_staged(
+                    EVRoamSites,
+                    "SiteId",
+                    SITE_HASH_KEYS,
+                    [dict(record) for record in batch],
+                    session,
+                )
+            )
+            session.commit()
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(
+            table_contents(self.session, EVRoamSites, "SiteId"),
+            table_contents(session, EVRoamSites, "SiteId"),
+        )
+        open_versions = session.execute(
+            select(EVRoamSites.ODSIsCurrent, EVRoamSites.ODSEffectiveTo.is_(None))
+        ).all()
+        self.assertTrue(all(current == is_open for current, is_open in open_versions))
+        session.close()
+        engine.dispose()
+
+    def test_missing_values_share_one_insert(self):
+        """Rows missing different values are inserted in one batch, defaults applied."""
+        statements = []
+        event.listen(
+            self.engine,
+            "before_cursor_execute",
+            lambda *args: statements.append(args[2]),
+        )
+        records = [
+            make_site("A", Address=None, WaterMark=None),
+            make_site("B", Operator=None, WaterMark=None),
+            make_site("C", CarParkCount=None, WaterMark=None),
+        ]
+        self.merge_sites(records)
+        inserts = [statement for statement in statements if statement.startswith("INSERT")]
+        self.assertEqual(len(inserts), 1)
+        rows = self.session.execute(
+            select(EVRoamSites.SiteId, EVRoamSites.Address, EVRoamSites.WaterMark)
+            .order_by(EVRoamSites.SiteId)
+        ).all()
+        self.assertEqual([row[1] for row in rows], [None, "1 Test Street", "1 Test Street"])
+        self.assertTrue(all(row[2] is not None for row in rows))
+
+    def test_rejects_records_missing_hash_keys(self):
+        """Records lacking a hashed column are rejected like the per-row path."""
+        record = make_site("A")
+        del record["Operator"]
+        with self.assertRaises(ValueError):
+            self.merge_sites([record])
+
+
+class TestGenerateHashKeys(unittest.TestCase):
+    """Tests for the vectorized change-hash computation."""
+
+    def test_matches_per_row_hash(self):
+        """Batch digests are byte-for-byte those of generate_hash_key."""
+        dataframe = pd.DataFrame(
+            {
+                "Id": ["a", "b", "c", "d"],
+                "Name": [" Mixed Case ", None, "x", "Y"],
+                "Text": pd.Series(["a", None, "B", ""], dtype="str"),
+                "Kw": [1.5, np.nan, 2.0, -0.0],
+                "Count": [1, 2, 3, 4],
+                "Flag": [True, False, True, False],
+                "Optional": [True, None, False, None],
+                "Time": pd.to_datetime(
+                    ["2024-01-01 10:00:01.5", None, "2024-02-01 00:00:00", None],
+                    format="ISO8601",
+                ),
+                "UtcTime": pd.to_datetime(
+                    ["2024-01-01 10:00:01", None, None, "2024-02-01 00:00:00"],
+                    format="ISO8601",
+                    utc=True,
+                ),
+                "Nested": [[{"b": 1, "a": 2.0}], None, {"k": "V "}, []],
+                "Mixed": [1, "One", None, 2.5],
+            }
+        )
+        dataframe = dataframe.where(pd.notnull(dataframe), None)
+        hash_keys = list(dataframe.columns)
+        expected = [
+            database_utils.generate_hash_key(*[row[key] for key in hash_keys])
+            for _, row in dataframe.iterrows()
+        ]
+        actual = database_utils.generate_hash_keys(dataframe, hash_keys)
+        self.assertEqual(actual.tolist(), expected)
+        self.assertTrue(actual.index.equals(dataframe.index))
+
+    def test_missing_values_need_not_be_replaced(self):
+        """Digests and bound records are the same with or without NaN replaced by None."""
+        dataframe = pd.DataFrame(
+            {
+                "Id": ["a", "b", "c"],
+                "Name": ["x", np.nan, None],
+                "Kw": [1.5, np.nan, 2.0],
+                "Mixed": [1, "One", pd.NaT],
+                "Nested": [[1], None, {"k": np.nan}],
+            }
+        )
+        replaced = dataframe.where(pd.notnull(dataframe), None)
+        hash_keys = list(dataframe.columns)
+        self.assertEqual(
+            database_utils.generate_hash_keys(dataframe, hash_keys).tolist(),
+            database_utils.generate_hash_keys(replaced, hash_keys).tolist(),
+        )
+        records = list(database_utils.iter_records(dataframe))
+        self.assertEqual(
+            [(record["Name"], record["Kw"], record["Mixed"]) for record in records],
+            [("x", 1.5, 1), (None, None, "One"), (None, 2.0, None)],
+        )
+        self.assertEqual(records[0]["Nested"], [1])
+
+    def test_values_are_hashed_by_position_and_type(self):
+        """Swapped values, or a number and its string, no longer share a hash key."""
+        generate = database_utils.generate_hash_key
+        self.assertNotEqual(generate("a", "b"), generate("b", "a"))
+        self.assertNotEqual(generate(1), generate("1"))
+        self.assertNotEqual(generate("a", None), generate(None, "a"))
+        self.assertEqual(generate(" A "), generate("a"))
+        self.assertEqual(generate(float("nan")), generate(None))
+        self.assertEqual(
+            generate([{"b": 1, "a": 2.0}, "x"]), generate(["X", {"a": 2.0, "b": 1}])
+        )
+        self.assertEqual(len(generate("a")), database_utils.HASH_KEY_BYTES)
+
+    def test_changed_hash_keys(self):
+        """Fixed-width comparison flags differing and unknown current hash keys."""
+        first, second = (database_utils.generate_hash_key(value) for value in "ab")
+        self.assertEqual(
+            database_utils.changed_hash_keys([first, first, first], [first, second, None]).tolist(),
+            [False, True, True],
+        )
+
+    def test_rejects_missing_columns(self):
+        """A hash key that is not a column raises ValueError."""
+        with self.assertRaises(ValueError):
+            database_utils.generate_hash_keys(pd.DataFrame({"A": [1]}), ["A", "B"])
+
+
+class TestIterRecords(unittest.TestCase):
+    """Tests for binding DataFrame rows as records."""
+
+    def test_matches_iterrows_with_native_types(self):
+        """Records hold the iterrows values as native Python types, with NULLs as None."""
+        dataframe = pd.DataFrame(
+            {
+                "Id": ["a", "b"],
+                "Count": np.array([1, 2], dtype=np.int64),
+                "Kw": [1.5, np.nan],
+                "Flag": [True, False],
+                "Time": pd.to_datetime(["2024-01-01 10:00:01", None]),
+                "UtcTime": pd.to_datetime(["2024-01-01 10:00:01", None], utc=True),
+                "Nested": [[1], None],
+                "Mixed": [np.int64(3), "x"],
+            }
+        )
+        records = list(database_utils.iter_records(dataframe))
+        expected = [
+            {name: None if pd.isna(value) is True else value for name, value in row.items()}
+            for _, row in dataframe.iterrows()
+        ]
+        self.assertEqual(records, expected)
+        self.assertEqual(
+            [type(value) for value in records[0].values()],
+            [str, int, float, bool, datetime, datetime, list, int],
+        )
+        self.assertEqual(records[0]["UtcTime"].utcoffset(), timedelta(0))
+        self.assertEqual(
+            list(database_utils.iter_records(dataframe, ["Id", "Kw"])),
+            [{"Id": "a", "Kw": 1.5}, {"Id": "b", "Kw": None}],
+        )
+
+    def test_add_or_update_records_takes_records(self):
+        """Records are added or updated one at a time with SCD Type 2 logic."""
+        engine = database_utils.get_local_engine()
+        database_utils.create_tables(engine)
+        session = sessionmaker(bind=engine)()
+        self.addCleanup(engine.dispose)
+        self.addCleanup(session.close)
+        dataframe = pd.DataFrame([make_site("A"), make_site("B")])
+        for name in ("A", "B"):
+            dataframe.loc[dataframe["SiteId"] == "B", "Name"] = name
+            keys = database_utils.add_or_update_records(
+                EVRoamSites, "SiteId", database_utils.iter_records(dataframe), session
+            )
+            session.commit()
+        self.assertEqual(len(keys), 2)
+        current = session.execute(
+            select(EVRoamSites.SiteId, EVRoamSites.Name).where(
+                EVRoamSites.ODSIsCurrent.is_(True)
+            )
+        ).all()
+        self.assertEqual(sorted(current), [("A", "Site"), ("B", "B")])
+        self.assertEqual(session.query(EVRoamSites).count(), 3)
+
+
+class TestCoerceDataframe(unittest.TestCase):
+    """Tests for converting payload values to the model column types."""
+
+    def test_values_are_cast_to_the_column_types(self):
+        """JSON values are converted per column, so they hash like the stored values."""
+        raw = pd.DataFrame(
+            [
+                make_site("A", CarParkCount=2.0, Is24Hours="True", AccessLocations=["b", "a"]),
+                make_site("B", CarParkCount="3", HasCarparkCost=None),
+            ]
+        )
+        sites, errors = database_utils.coerce_dataframe(EVRoamSites, raw)
+        self.assertEqual(errors, {})
+        self.assertEqual(sites["CarParkCount"].tolist(), [2, 3])
+        self.assertEqual(sites["Is24Hours"].tolist(), [True, True])
+        self.assertTrue(pd.isna(sites["HasCarparkCost"].iloc[1]))
+        self.assertEqual(sites["AccessLocations"].tolist(), ['["a","b"]', None])
+        self.assertEqual(raw["CarParkCount"].tolist(), [2.0, "3"])
+
+        availabilities = [
+            make_availability("A", "Available", "2024-01-01T10:00:00Z"),
+            make_availability("B", "Occupied", "2024-01-01T23:30:00+12:00"),
+        ]
+        availabilities[0]["KwAvailable"] = 22
+        coerced, _ = database_utils.coerce_dataframe(
+            EVRoamAvailabilities, pd.DataFrame(availabilities)
+        )
+        self.assertEqual(
+            coerced["AvailabilityTime"].tolist(),
+            [pd.Timestamp("2024-01-01 10:00:00"), pd.Timestamp("2024-01-01 11:30:00")],
+        )
+        stored = [
+            database_utils.generate_hash_key(datetime(2024, 1, 1, 10), "Available", 22.0),
+            database_utils.generate_hash_key(datetime(2024, 1, 1, 11, 30), "Occupied", 22.0),
+        ]
+        hashes = database_utils.generate_hash_keys(
+            coerced, ["AvailabilityTime", "AvailabilityStatus", "KwAvailable"]
+        )
+        self.assertEqual(hashes.tolist(), stored)
+
+    def test_reordered_nested_lists_are_unchanged(self):
+        """Nested list items are stored in canonical order, by both write paths."""
+        database_utils.set_engine(database_utils.get_local_engine())
+        self.addCleanup(database_utils.set_engine, None)
+        connectors = [
+            {"connectorType": "CCS2", "kwRated": 50},
+            {"connectorType": "Type 2", "kwRated": 22},
+        ]
+        database_utils.write_sites_to_db(
+            pd.DataFrame([make_site("A", AccessLocations=connectors)])
+        )
+        counts = database_utils.write_sites_to_db(
+            pd.DataFrame([make_site("A", AccessLocations=connectors[::-1])])
+        )
+        self.assertEqual((counts["inserted"], counts["unchanged"]), (0, 1))
+
+        with database_utils.session_scope() as session:
+            site = make_site("A", AccessLocations=[connectors[1], connectors[0]])
+            database_utils.add_or_update_record(
+                EVRoamSites,
+                {"SiteId": site.pop("SiteId")},
+                SITE_HASH_KEYS,
+                session=session,
+                **site,
+            )
+            self.assertEqual(session.query(EVRoamSites).count(), 1)
+
+    def test_invalid_values_are_reported_by_row(self):
+        """Values that cannot be converted and over-long strings reject their row."""
+        raw = pd.DataFrame(
+            [
+                make_site("A", CarParkCount="many"),
+                make_site("B"),
+                make_site("C", Name="x" * 256),
+            ]
+        )
+        sites, errors = database_utils.coerce_dataframe(EVRoamSites, raw)
+        self.assertEqual(
+            errors,
+            {
+                0: "Invalid integer value for CarParkCount",
+                2: "Value for Name longer than 255 characters",
+            },
+        )
+        self.assertEqual(len(sites), 3)
+
+
+class TestModelRegistry(unittest.TestCase):
+    """Tests for the per-model metadata built at import."""
+
+    def test_registry_describes_the_scd2_models(self):
+        """Hash keys, primary keys and string limits match the table definitions."""
+        metadata = database_utils.MODEL_REGISTRY[EVRoamSites]
+        self.assertEqual(list(metadata.hash_keys), SITE_HASH_KEYS)
+        self.assertEqual(metadata.primary_key, "ODSdboEVRoamSitesSKID")
+        self.assertEqual(metadata.unique_keys, ("SiteId",))
+        self.assertEqual(metadata.string_lengths["Address"], 2048)
+        self.assertIsInstance(metadata.column_types["CarParkCount"], Integer)
+        self.assertEqual(
+            list(database_utils.MODEL_REGISTRY[EVRoamAvailabilities].hash_keys),
+            AVAILABILITY_HASH_KEYS,
+        )
+        self.assertIs(database_utils.get_model_metadata(EVRoamSites), metadata)
+        self.assertEqual(
+            database_utils.get_model_metadata(EVRoamSites, "Name").unique_keys, ("Name",)
+        )
+
+    def test_write_paths_do_not_reflect_on_the_model(self):
+        """Writing rows reads hash keys from the registry rather than the table."""
+        database_utils.set_engine(database_utils.get_local_engine())
+        self.addCleanup(database_utils.set_engine, None)
+        session = database_utils.get_session()
+        self.addCleanup(session.close)
+        with mock.patch.object(
+            database_utils, "get_dynamic_hash_keys", side_effect=AssertionError
+        ):
+            fields = make_site("A")
+            database_utils.add_or_update_evroam_site(
+                fields.pop("SiteId"),
+                fields.pop("Name"),
+                fields.pop("Address"),
+                session=session,
+                **fields,
+            )
+            session.commit()
+            database_utils.write_sites_to_db(pd.DataFrame([make_site("B")]))
+        self.assertEqual(session.query(EVRoamSites).count(), 2)
+
+
+class TestStatementProfiler(unittest.TestCase):
+    """Tests for the opt-in statement profiler of the write functions."""
+
+    def setUp(self):
+        patcher = mock.patch.object(database_utils, "SQL_PROFILE", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        database_utils.set_engine(database_utils.get_local_engine())
+        self.addCleanup(database_utils.set_engine, None)
+
+    def test_shapes_ignore_values_and_list_lengths(self):
+        """Statements differing only in values or IN list lengths share a shape."""
+        shape = database_utils.statement_shape
+        self.assertEqual(
+            shape("SELECT a FROM t WHERE a IN (?, ?, ?) AND b = 'x'"),
+            shape("SELECT a  FROM t WHERE a IN (?) AND b = 'y'"),
+        )
+        self.assertNotEqual(shape("SELECT a FROM t"), shape("SELECT b FROM t"))
+
+    def test_write_is_profiled_by_statement_shape(self):
+        """A write reports its statements grouped by shape, without N+1 patterns."""
+        rows = [make_site(f"S{index}") for index in range(30)]
+        with self.assertLogs(level="INFO") as logs:
+            database_utils.write_sites_to_db(pd.DataFrame(rows))
+        self.assertTrue(
+            any("SQL profile of write_sites_to_db" in line for line in logs.output)
+        )
+        self.assertFalse(any("N+1" in line for line in logs.output))
+
+    def test_per_row_lookups_are_flagged(self):
+        """Looking up the current version row by row is reported as an N+1 pattern."""
+        records = [make_site(f"S{index}") for index in range(25)]
+        with self.assertLogs(level="INFO") as logs:
+            with database_utils.profile_statements("per_row") as profile:
+                with database_utils.session_scope() as session:
+                    database_utils.add_or_update_records(
+                        EVRoamSites, "SiteId", records, session=session
+                    )
+        # Each lookup also autoflushes the previous record's INSERT
+        flagged = {entry["label"]: entry["count"] for entry in profile.n_plus_one()}
+        self.assertEqual(
+            flagged,
+            {"SELECT EECAEVRoam.dboEVRoamSites": 25, "INSERT EECAEVRoam.dboEVRoamSites": 25},
+        )
+        self.assertTrue(any("Possible N+1 pattern in per_row" in line for line in logs.output))
+        report = profile.report(top=1)
+        self.assertEqual(len(report), 1)
+
+
+class TestIndexes(unittest.TestCase):
+    """Tests for the declared indexes and the query plans of the SCD Type 2 lookups."""
+
+    def setUp(self):
+        self.engine = database_utils.get_local_engine()
+        database_utils.set_engine(self.engine)
+        self.addCleanup(database_utils.set_engine, None)
+
+    def capture_queries(self, write, dataframe):
+        """Runs a write and returns the SELECT statements it sent, with their parameters."""
+        queries = []
+
+        def capture(_conn, _cursor, statement, parameters, _context, executemany):
+            if statement.lstrip().upper().startswith("SELECT") and not executemany:
+                queries.append((statement, parameters))
+
+        event.listen(self.engine, "before_cursor_execute", capture)
+        write(dataframe)
+        event.remove(self.engine, "before_cursor_execute", capture)
+        return queries
+
+    def query_plan(self, statement, parameters):
+        """Returns the details of the SQLite query plan of a statement."""
+        with self.engine.connect() as connection:
+            rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            return [row[-1] for row in rows]
+
+    def test_current_row_lookups_seek_the_filtered_index(self):
+        """The current hash keys are read from the current-row index, not the table."""
+        writes = [
+            (database_utils.write_sites_to_db, [make_site("A"), make_site("B")]),
+            (
+                database_utils.write_availabilities_to_db,
+                [make_availability("CS1", "Available", datetime(2024, 1, 1))],
+            ),
+        ]
+        with mock.patch.object(database_utils.AVAILABILITY_CACHE, "max_size", 0):
+            for write, rows in writes:
+                write(pd.DataFrame(rows))
+                (statement, parameters), = self.capture_queries(write, pd.DataFrame(rows))
+                plan = self.query_plan(statement, parameters)
+                self.assertEqual(len(plan), 1, plan)
+                self.assertRegex(plan[0], r"^SEARCH .* USING INDEX IX_\w+_Current \(")
+
+    def test_availability_scans_use_the_declared_indexes(self):
+        """Stale checks seek the current rows, and time ranges seek the time index."""
+        dataframe = pd.DataFrame([make_availability("CS1", "Available", datetime(2024, 1, 1))])
+        (statement, parameters), = self.capture_queries(
+            database_utils.drop_stale_availabilities, dataframe
+        )
+        plan = self.query_plan(statement, parameters)
+        self.assertIn("USING INDEX IX_Availabilities_Current", plan[0])
+        query = select(EVRoamAvailabilities.ChargingStationId).where(
+            EVRoamAvailabilities.AvailabilityTime >= datetime(2024, 1, 1)
+        )
+        with self.engine.connect() as connection:
+            statement = str(query.compile(connection))
+        plan = self.query_plan(statement, (datetime(2024, 1, 1).isoformat(" "),))
+        self.assertIn("USING INDEX IX_Availabilities_Time", plan[0])
+
+    def test_missing_indexes_are_reported_and_created(self):
+        """An index dropped from an existing table is reported, and created on request."""
+        self.assertEqual(database_utils.get_missing_indexes(self.engine), [])
+        with self.engine.begin() as connection:
+            connection.exec_driver_sql(f"DROP INDEX {database_utils.SCHEMA}.IX_Sites_Current")
+        self.assertEqual(
+            [index.name for index in database_utils.get_missing_indexes(self.engine)],
+            ["IX_Sites_Current"],
+        )
+        with self.assertLogs(level="WARNING"):
+            database_utils.create_tables(self.engine)
+        self.assertEqual(len(database_utils.get_missing_indexes(self.engine)), 1)
+        self.assertEqual(
+            database_utils.create_missing_indexes(self.engine), ["IX_Sites_Current"]
+        )
+        self.assertEqual(database_utils.get_missing_indexes(self.engine), [])
+
+
+class TestMigrateHashKeys(unittest.TestCase):
+    """Tests for moving existing rows to the canonical hash keys."""
+
+    def test_current_rows_are_rehashed_once(self):
+        """Rows hashed the old way are rehashed, so an unchanged write is a no-op."""
+        engine = database_utils.get_local_engine()
+        database_utils.set_engine(engine)
+        self.addCleanup(database_utils.set_engine, None)
+        sites = pd.DataFrame([make_site("A"), make_site("B")])
+        database_utils.write_sites_to_db(sites)
+        with database_utils.session_scope() as session:
+            session.execute(update(EVRoamSites).values(ODSHashKey=b"legacy"))
+
+        self.assertEqual(
+            database_utils.migrate_hash_keys(engine, chunk_rows=1),
+            {"dboEVRoamSites": 2, "dboEVRoamChargingStations": 0, "dboEVRoamAvailabilities": 0},
+        )
+        self.assertEqual(database_utils.migrate_hash_keys(engine)["dboEVRoamSites"], 0)
+        counts = database_utils.write_sites_to_db(sites)
+        self.assertEqual((counts["inserted"], counts["unchanged"]), (0, 2))
+
+    def test_sql_server_hash_key_columns_are_altered(self):
+        """On SQL Server the columns are altered after dropping the indexes including them."""
+        engine = mock.MagicMock()
+        engine.dialect.name = "mssql"
+        connection = engine.begin.return_value.__enter__.return_value
+        tables = {
+            metadata.model.__tablename__: metadata.model.__table__
+            for metadata in database_utils.MODEL_REGISTRY.values()
+        }
+        inspector = mock.Mock()
+        inspector.get_columns.return_value = [{"name": "ODSHashKey", "type": VARBINARY(8000)}]
+        inspector.get_indexes.side_effect = lambda name, schema: [
+            {"name": index.name} for index in tables[name].indexes
+        ]
+        session_factory = mock.MagicMock()
+        session = session_factory.return_value.return_value.__enter__.return_value
+        session.execute.return_value.fetchmany.return_value = []
+        with mock.patch.object(database_utils, "inspect", return_value=inspector):
+            with mock.patch.object(database_utils, "sessionmaker", session_factory):
+                with mock.patch.object(database_utils, "create_missing_indexes") as create:
+                    with mock.patch.object(Index, "drop", autospec=True) as drop:
+                        database_utils.migrate_hash_keys(engine)
+
+        self.assertEqual(
+            sorted(call.args[0].name for call in drop.call_args_list),
+            ["IX_Availabilities_Current", "IX_ChargingStations_Current", "IX_Sites_Current"],
+        )
+        self.assertEqual(connection.exec_driver_sql.call_count, 3)
+        self.assertIn("BINARY(32)", connection.exec_driver_sql.call_args.args[0])
+        create.assert_called_once_with(engine)
+
+
+class TestEngineCache(unittest.TestCase):
+    """Tests for the process-wide engine and session factory."""
+
+    def tearDown(self):
+        database_utils.set_engine(None)
+
+    def test_engine_and_schema_are_set_up_once(self):
+        """Sessions reuse one engine and the tables are created only once."""
+        engine = database_utils.get_local_engine()
+        with mock.patch.object(
+            database_utils, "create_tables", wraps=database_utils.create_tables
+        ) as create_tables:
+            database_utils.set_engine(engine)
+            for _ in range(3):
+                with database_utils.session_scope() as session:
+                    self.assertIs(session.get_bind(), engine)
+            self.assertIs(database_utils.get_engine(), engine)
+        create_tables.assert_called_once_with(engine)
+
+    def test_write_backend_is_switchable(self):
+        """SqlWriteBackend selects the merge implementation used by the writers."""
+        database_utils.set_engine(database_utils.get_local_engine())
+        staged = mock.Mock(wraps=database_utils.merge_records_staged)
+        with mock.patch.object(database_utils, "WRITE_BACKEND", "staged"):
+            with mock.patch.dict(database_utils.MERGE_BACKENDS, staged=staged):
+                database_utils.write_sites_to_db(pd.DataFrame([make_site("A")]))
+        staged.assert_called_once()
+        with database_utils.session_scope() as session:
+            self.assertEqual(
+                session.execute(select(EVRoamSites.SiteId)).scalars().all(), ["A"]
+            )
+
+    def test_pool_stats_track_checkouts(self):
+        """Each session scope records a connection checkout."""
+        database_utils.set_engine(database_utils.get_local_engine())
+        dataframe = pd.DataFrame([make_site("A"), make_site("B")])
+        database_utils.write_sites_to_db(dataframe)
+        database_utils.write_sites_to_db(dataframe)
+        stats = database_utils.get_pool_stats()
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["peak_saturation"], 1.0)
+
+
+class TestIngestBatches(unittest.TestCase):
+    """Tests for committing in batches and isolating rows the database rejects."""
+
+    def setUp(self):
+        database_utils.set_engine(database_utils.get_local_engine())
+        self.addCleanup(database_utils.set_engine, None)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = mock.patch.dict(os.environ, {"LocalBlobStoragePath": self.directory.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def current_sites(self):
+        """Returns the current site ids."""
+        with database_utils.session_scope() as session:
+            return sorted(
+                session.execute(
+                    select(EVRoamSites.SiteId).where(EVRoamSites.ODSIsCurrent.is_(True))
+                ).scalars()
+            )
+
+    def test_commits_every_batch(self):
+        """Rows are committed in transactions of at most batch_rows rows."""
+        dataframe = pd.DataFrame([make_site(site_id) for site_id in "ABCDE"])
+        scope = mock.Mock(wraps=database_utils.session_scope)
+        with mock.patch.object(database_utils, "session_scope", scope):
+            counts, written = database_utils.write_in_batches(
+                EVRoamSites, "SiteId", dataframe, batch_rows=2
+            )
+            self.assertEqual(scope.call_count, 3)
+            database_utils.write_in_batches(EVRoamSites, "SiteId", dataframe, batch_rows=0)
+            self.assertEqual(scope.call_count, 4)
+        self.assertEqual(counts["inserted"], 5)
+        self.assertTrue(written.all())
+        self.assertEqual(self.current_sites(), list("ABCDE"))
+
+    def test_rejected_rows_are_isolated_and_dead_lettered(self):
+        """A batch failing on one row is bisected and only that row is dead-lettered."""
+        sites = [make_site(site_id) for site_id in "ABCDEFG"]
+        # Reusing the surrogate key of the first site violates the primary key
+        sites[4]["ODSdboEVRoamSitesSKID"] = 1
+        counts, written = database_utils.write_in_batches(
+            EVRoamSites, "SiteId", pd.DataFrame(sites), batch_rows=4
+        )
+        self.assertEqual(counts["inserted"], 6)
+        self.assertEqual(counts["dead_lettered"], 1)
+        self.assertEqual(written.tolist(), [True] * 4 + [False] + [True] * 2)
+        self.assertEqual(self.current_sites(), list("ABCDFG"))
+
+        store = deadletter_utils.get_dead_letter_store()
+        (blob_name,) = deadletter_utils.list_dead_letters("rows", store)
+        (entry,) = deadletter_utils.read_dead_letters(blob_name, store)
+        self.assertEqual(entry["table"], "dboEVRoamSites")
+        self.assertEqual(entry["record"]["SiteId"], "E")
+        self.assertTrue(entry["error"])
+
+    def test_invalid_rows_are_dead_lettered_before_writing(self):
+        """Rows failing type coercion are dead-lettered with their original values."""
+        sites = [make_site("A"), make_site("B", CarParkCount="many"), make_site("C")]
+        counts, written = database_utils.write_in_batches(
+            EVRoamSites, "SiteId", pd.DataFrame(sites)
+        )
+        self.assertEqual(counts["inserted"], 2)
+        self.assertEqual(counts["dead_lettered"], 1)
+        self.assertEqual(written.tolist(), [True, True])
+        self.assertEqual(self.current_sites(), ["A", "C"])
+
+        store = deadletter_utils.get_dead_letter_store()
+        (blob_name,) = deadletter_utils.list_dead_letters("rows", store)
+        (entry,) = deadletter_utils.read_dead_letters(blob_name, store)
+        self.assertEqual(entry["record"]["CarParkCount"], "many")
+        self.assertEqual(entry["error"], "Invalid integer value for CarParkCount")
+
+    def test_connection_failures_are_not_retried(self):
+        """Errors unrelated to the rows are raised without bisecting the batch."""
+        merge = mock.Mock(side_effect=OperationalError("SELECT 1", {}, Exception("down")))
+        with mock.patch.dict(database_utils.MERGE_BACKENDS, merge=merge):
+            with self.assertRaises(OperationalError):
+                database_utils.write_in_batches(
+                    EVRoamSites, "SiteId", pd.DataFrame([make_site("A"), make_site("B")])
+                )
+        merge.assert_called_once()
+
+    def test_schema_and_permission_errors_are_not_retried(self):
+        """Only constraint and data errors are blamed on rows; others fail the write."""
+        error = ProgrammingError("INSERT", {}, Exception("Invalid object name"))
+        merge = mock.Mock(side_effect=error)
+        with mock.patch.dict(database_utils.MERGE_BACKENDS, merge=merge):
+            with self.assertRaises(ProgrammingError):
+                database_utils.write_in_batches(
+                    EVRoamSites, "SiteId", pd.DataFrame([make_site("A"), make_site("B")])
+                )
+        merge.assert_called_once()
+        store = deadletter_utils.get_dead_letter_store()
+        self.assertEqual(deadletter_utils.list_dead_letters("rows", store), [])
+
+
+class TestAvailabilityCache(unittest.TestCase):
+    """Tests for dropping unchanged availabilities before the merge."""
+
+    def setUp(self):
+        database_utils.set_engine(database_utils.get_local_engine())
+
+    def tearDown(self):
+        database_utils.set_engine(None)
+
+    def write(self, *statuses):
+        """Writes one availability per status, for stations CS0, CS1, ..."""
+        return database_utils.write_availabilities_to_db(
+            pd.DataFrame(
+                [
+                    make_availability(f"CS{index}", status, datetime(2024, 1, 1))
+                    for index, status in enumerate(statuses)
+                ]
+            )
+        )
+
+    def test_unchanged_availabilities_skip_the_database(self):
+        """A delivery with no changes opens no session after the cache load."""
+        hits = database_utils.get_availability_cache_stats()["hits"]
+        self.write("Available", "Occupied")
+        self.assertEqual(database_utils.get_pool_stats()["checkouts"], 2)
+        self.write("Available", "Occupied")
+        self.assertEqual(database_utils.get_pool_stats()["checkouts"], 2)
+        counts = self.write("Available", "Available")
+        self.assertEqual(database_utils.get_pool_stats()["checkouts"], 3)
+        self.assertEqual(
+            counts, {"inserted": 1, "expired": 1, "unchanged": 1, "dead_lettered": 0}
+        )
+
+        with database_utils.session_scope() as session:
+            contents = table_contents(
+                session, EVRoamAvailabilities, "ChargingStationId"
+            )
+        self.assertEqual(
+            [row[:2] for row in contents],
+            [("CS0", True), ("CS1", False), ("CS1", True)],
+        )
+        self.assertEqual(database_utils.get_availability_cache_stats()["hits"] - hits, 4)
+
+    def test_failed_write_invalidates_the_cache(self):
+        """The cache is emptied when a write fails."""
+        self.write("Available")
+        with mock.patch.dict(
+            database_utils.MERGE_BACKENDS,
+            merge=mock.Mock(side_effect=RuntimeError("lost")),
+        ):
+            with self.assertRaises(RuntimeError):
+                self.write("Occupied")
+        self.assertEqual(database_utils.get_availability_cache_stats()["size"], 0)
+        self.write("Occupied")
+        with database_utils.session_scope() as session:
+            current = session.execute(
+                select(EVRoamAvailabilities.AvailabilityStatus).where(
+                    EVRoamAvailabilities.ODSIsCurrent.is_(True)
+                )
+            ).scalars().all()
+        self.assertEqual(current, ["Occupied"])
+
+    def test_stale_availabilities_are_dropped(self):
+        """Rows older than the current availability of their station are dropped."""
+        self.write("Available")
+        dataframe = pd.DataFrame(
+            [
+                make_availability("CS0", "Occupied", "2023-12-31T23:00:00Z"),
+                make_availability("CS0", "Occupied", "2024-01-01T00:00:00Z"),
+                make_availability("CS1", "Occupied", "2023-01-01T00:00:00Z"),
+                make_availability("CS0", "Occupied", "not a time"),
+            ]
+        )
+        fresh = database_utils.drop_stale_availabilities(dataframe)
+        # The malformed time is kept for the writer to dead-letter
+        self.assertEqual(fresh.index.tolist(), [1, 2, 3])
+
+
+class TestAvailabilityEvents(unittest.TestCase):
+    """Tests for the append-only availability event store."""
+
+    def setUp(self):
+        database_utils.set_engine(database_utils.get_local_engine())
+
+    def tearDown(self):
+        database_utils.set_engine(None)
+
+    def append(self, *records):
+        """Appends availability records in one session."""
+        with database_utils.session_scope() as session:
+            return database_utils.append_availability_events(
+                pd.DataFrame(list(records)), session
+            )
+
+    def test_appends_events_and_upserts_current_status(self):
+        """Events are appended, repeats skipped and late events kept out of the status."""
+        counts = self.append(
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS2", "Occupied", "2024-01-01T00:05:00Z"),
+        )
+        self.assertEqual(counts, {"appended": 2, "skipped": 0, "inserted": 2, "updated": 0})
+        counts = self.append(
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS1", "Occupied", datetime(2024, 1, 1, 1, 0)),
+            make_availability("CS2", "Available", datetime(2024, 1, 1, 0, 1)),
+        )
+        self.assertEqual(counts, {"appended": 2, "skipped": 1, "inserted": 0, "updated": 1})
+
+        current = database_utils.get_current_availabilities()
+        self.assertEqual(
+            current.set_index("ChargingStationId")["AvailabilityStatus"].to_dict(),
+            {"CS1": "Occupied", "CS2": "Occupied"},
+        )
+        self.assertEqual(
+            current.set_index("ChargingStationId")["AvailabilityTime"].to_dict(),
+            {
+                "CS1": pd.Timestamp(2024, 1, 1, 1, 0),
+                "CS2": pd.Timestamp(2024, 1, 1, 0, 5),
+            },
+        )
+
+    def test_history_rebuilds_scd2_versions(self):
+        """Consecutive identical events collapse into versions with validity ranges."""
+        self.append(
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 0)),
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 5)),
+            make_availability("CS1", "Occupied", datetime(2024, 1, 1, 0, 10)),
+            make_availability("CS1", "Available", datetime(2024, 1, 1, 0, 20)),
+            make_availability("CS2", "Unavailable", datetime(2024, 1, 1, 0, 0)),
+        )
+        history = database_utils.get_availability_history(["CS1"])
+        self.assertEqual(
+            history["AvailabilityStatus"].tolist(), ["Available", "Occupied", "Available"]
+        )
+        self.assertEqual(
+            history["ODSEffectiveTo"].tolist()[:2],
+            [pd.Timestamp(2024, 1, 1, 0, 10), pd.Timestamp(2024, 1, 1, 0, 20)],
+        )
+        self.assertTrue(pd.isna(history["ODSEffectiveTo"].iloc[-1]))
+        self.assertEqual(history["ODSIsCurrent"].tolist(), [False, False, True])
+        # The event log does not record the operator of past versions
+        self.assertNotIn("Operator", history.columns)
+
+        window = database_utils.get_availability_history(
+            start=datetime(2024, 1, 1, 0, 15), end=datetime(2024, 1, 1, 0, 20)
+        )
+        self.assertEqual(
+            list(zip(window["ChargingStationId"], window["AvailabilityStatus"])),
+            [("CS1", "Occupied"), ("CS2", "Unavailable")],
+        )
+
+    def test_purge_and_storage_mode(self):
+        """The events mode writes to the event store, which is purged by day."""
+        with mock.patch.object(database_utils, "AVAILABILITY_STORAGE_MODE", "events"):
+            database_utils.write_availabilities_to_db(
+                pd.DataFrame(
+                    [
+                        make_availability("CS1", "Available", datetime(2024, 1, 1)),
+                        make_availability("CS1", "Occupied", datetime(2024, 1, 2)),
+                    ]
+                )
+            )
+        with database_utils.session_scope() as session:
+            self.assertEqual(
+                table_contents(session, EVRoamAvailabilities, "ChargingStationId"), []
+            )
+        self.assertEqual(database_utils.purge_availability_events(date(2024, 1, 2)), 1)
+        history = database_utils.get_availability_history()
+        self.assertEqual(history["AvailabilityStatus"].tolist(), ["Occupied"])
+
+
+if __name__ == "__main__":
+    unittest.main()
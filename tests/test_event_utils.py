@@ -0,0 +1,261 @@
+"""Module for testing the sharedCode.event_utils functionality."""
+
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from sharedCode import deadletter_utils
+from sharedCode import event_utils
+from tests.http_stub import StubServer
+
+LATENCY = 0.4
+
+
+def make_event(url, event_id=None):
+    """Builds an EVRoam Event Grid event for a data URL."""
+    event = {"eventType": "EVRoam.Changed", "data": {"url": url}}
+    if event_id is not None:
+        event["id"] = event_id
+    return event
+
+
+class TestProcessEvents(unittest.TestCase):
+    """Tests for downloading and writing a batch of events."""
+
+    def setUp(self):
+        event_utils.RECENT_EVENTS.clear()
+        self.server = StubServer(delay=LATENCY)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        for json_type in ("sites", "chargingstations", "availabilities"):
+            self.server.add_route(
+                f"/{json_type}/1.json",
+                lambda path, query: (200, [{"source": path}]),
+            )
+        self.server.add_route("/sites/missing.json", lambda path, query: (404, {}))
+
+    def test_downloads_run_concurrently(self):
+        """A batch takes about as long as its slowest download, not their sum."""
+        events = [
+            make_event(self.server.url(f"/availabilities/1.json?n={index}"))
+            for index in range(6)
+        ]
+        with mock.patch.object(event_utils, "process_payloads") as process_payloads:
+            start = time.perf_counter()
+            event_utils.process_events(events)
+            elapsed = time.perf_counter() - start
+        self.assertEqual(len(self.server.requests), 6)
+        # The six payloads of one type are written together
+        self.assertEqual(len(process_payloads.call_args.args[1]), 6)
+        self.assertLess(elapsed, LATENCY * 3)
+
+    def test_writes_follow_json_types_order(self):
+        """Charging stations are written before availabilities whatever the delivery order."""
+        events = [
+            make_event(self.server.url("/availabilities/1.json")),
+            make_event(self.server.url("/sites/missing.json")),
+            make_event(self.server.url("/chargingstations/1.json")),
+            make_event(self.server.url("/sites/1.json")),
+            make_event(None),
+        ]
+        with mock.patch.object(event_utils, "process_payloads") as process_payloads:
+            event_utils.process_events(events)
+        self.assertEqual(
+            [
+                (call.args[0], [payload for _, payload in call.args[1]])
+                for call in process_payloads.call_args_list
+            ],
+            [
+                ("sites", [[{"source": "/sites/1.json"}]]),
+                ("chargingstations", [[{"source": "/chargingstations/1.json"}]]),
+                ("availabilities", [[{"source": "/availabilities/1.json"}]]),
+            ],
+        )
+
+    def test_failed_batch_is_processed_in_full_when_retried(self):
+        """Events of a batch that raised are not dropped as duplicates on its retry."""
+        events = [make_event(self.server.url("/sites/1.json"), event_id="event-1")]
+        with mock.patch.object(event_utils, "process_payloads") as process_payloads:
+            with mock.patch.object(
+                event_utils.landing_utils, "land_payload", side_effect=[OSError("down"), None]
+            ):
+                with self.assertRaises(OSError):
+                    event_utils.process_events(events)
+                counts = event_utils.process_events(events)
+            self.assertEqual(counts["processed"], 1)
+            self.assertEqual(process_payloads.call_count, 1)
+            # Once written, a redelivery is dropped
+            self.assertEqual(event_utils.process_events(events)["processed"], 0)
+            self.assertEqual(process_payloads.call_count, 1)
+
+
+class TestCoalescing(unittest.TestCase):
+    """Tests for deduplicating and coalescing a burst of events."""
+
+    def setUp(self):
+        event_utils.RECENT_EVENTS.clear()
+        event_utils.EVENT_STATS.reset()
+        self.server = StubServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def serve_update(self, number, statuses, time):
+        """Serves an availabilities payload and returns its event."""
+        path = f"/availabilities/{number}.json"
+        payload = [
+            {
+                "chargingStationId": f"cs-{index}",
+                "availabilityStatus": status,
+                "availabilityTime": time,
+            }
+            for index, status in enumerate(statuses)
+        ]
+        self.server.add_route(path, lambda path, query: (200, payload))
+        return make_event(self.server.url(path), event_id=f"event-{number}")
+
+    def test_burst_writes_only_the_final_state(self):
+        """Redelivered events are dropped and each station's burst is written once."""
+        stations = 20
+        burst = [
+            self.serve_update(
+                number,
+                ["Occupied" if (index + number) % 2 else "Available" for index in range(stations)],
+                f"2024-01-01T00:00:{number * 5:02d}Z",
+            )
+            for number in range(4)
+        ]
+        late = self.serve_update(4, ["Faulted"], "2024-01-01T00:10:00Z")
+        # Event Grid redelivers the first events, once with the same id and once
+        # with a new id for the same data URL
+        redelivered = [dict(burst[0]), dict(burst[1], id="event-1-retry")]
+        events = burst[:2] + redelivered + burst[2:] + [late]
+
+        write_availabilities = mock.Mock(
+            side_effect=lambda dataframe: {"inserted": len(dataframe) - 1, "unchanged": 1}
+        )
+        with mock.patch.dict(
+            event_utils.WRITE_TO_DB, availabilities=write_availabilities
+        ), mock.patch.object(event_utils, "COALESCE_WINDOW_SECONDS", 60):
+            counts = event_utils.process_events(events)
+            # A later delivery of an event already processed is dropped too
+            event_utils.process_events([burst[3]])
+
+        self.assertEqual(counts, {"events": 7, "processed": 5, "failed": 0})
+        self.assertEqual(len(self.server.requests), 5)
+        write_availabilities.assert_called_once()
+        written = write_availabilities.call_args.args[0]
+        final = {
+            f"cs-{index}": "Occupied" if (index + 3) % 2 else "Available"
+            for index in range(stations)
+        }
+        rows = list(
+            zip(
+                written["ChargingStationId"],
+                written["AvailabilityStatus"],
+                written["AvailabilityTime"],
+            )
+        )
+        self.assertEqual(len(rows), stations + 1)
+        self.assertEqual(
+            {station: status for station, status, time in rows if time.endswith(":15Z")},
+            final,
+        )
+        self.assertEqual(rows[-1], ("cs-0", "Faulted", "2024-01-01T00:10:00Z"))
+        self.assertEqual(
+            event_utils.get_event_stats(),
+            {
+                "events_received": 8,
+                "events_duplicate": 3,
+                "events_processed": 5,
+                "events_failed": 0,
+                "rows_received": 4 * stations + 1,
+                "rows_coalesced": 3 * stations,
+                "rows_written": stations,
+            },
+        )
+
+
+class TestDeadLetters(unittest.TestCase):
+    """Tests for dead-lettering failed events and replaying them."""
+
+    def setUp(self):
+        event_utils.RECENT_EVENTS.clear()
+        self.server = StubServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        patcher = mock.patch.dict(os.environ, {"LocalBlobStoragePath": self.directory.name})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = deadletter_utils.get_dead_letter_store()
+        self.server.add_route("/sites/1.json", lambda path, query: (200, [{"siteId": "a"}]))
+
+    def dead_letters(self):
+        """Returns every dead-lettered event entry."""
+        return [
+            entry
+            for blob_name in deadletter_utils.list_dead_letters("events", self.store)
+            for entry in deadletter_utils.read_dead_letters(blob_name, self.store)
+        ]
+
+    def test_failed_events_are_dead_lettered_and_replayed(self):
+        """Download and write failures are saved, then replayed once the cause is fixed."""
+        events = [
+            make_event(self.server.url("/sites/1.json")),
+            make_event(self.server.url("/sites/2.json")),
+        ]
+        outage = OperationalError("INSERT", {}, Exception("database unavailable"))
+        with mock.patch.dict(event_utils.WRITE_TO_DB, sites=mock.Mock(side_effect=outage)):
+            counts = event_utils.process_events(events)
+        self.assertEqual(counts, {"events": 2, "processed": 0, "failed": 2})
+        failures = sorted(self.dead_letters(), key=lambda entry: entry["stage"])
+        self.assertEqual([entry["stage"] for entry in failures], ["download", "process"])
+        self.assertIsNone(failures[0]["payload"])
+        self.assertEqual(failures[1]["payload"], [{"siteId": "a"}])
+        self.assertEqual(failures[1]["url"], self.server.url("/sites/1.json"))
+        self.assertIn("database unavailable", failures[1]["error"])
+
+        self.server.add_route("/sites/2.json", lambda path, query: (200, [{"siteId": "b"}]))
+        requests_before = len(self.server.requests)
+        write_sites = mock.Mock()
+        with mock.patch.dict(event_utils.WRITE_TO_DB, sites=write_sites):
+            totals = event_utils.replay_dead_letters(self.store, batch_events=1)
+        self.assertEqual(totals, {"blobs": 1, "events": 2, "processed": 2, "failed": 0})
+        self.assertEqual(
+            sorted(
+                site for call in write_sites.call_args_list for site in call.args[0]["SiteId"]
+            ),
+            ["a", "b"],
+        )
+        # The saved payload is written without downloading it again
+        self.assertEqual(self.server.requests[requests_before:], [("/sites/2.json", {})])
+        self.assertEqual(self.dead_letters(), [])
+
+    def test_events_failing_again_stay_dead_lettered(self):
+        """A replayed event that fails again is saved with its attempt count increased."""
+        event_utils.process_events([make_event(self.server.url("/sites/missing.json"))])
+        event_utils.replay_dead_letters(self.store)
+        (entry,) = self.dead_letters()
+        self.assertEqual(entry["attempts"], 2)
+        self.assertEqual(entry["stage"], "download")
+
+    def test_blobs_are_kept_when_failures_cannot_be_saved(self):
+        """A replayed blob is not deleted if its failing events cannot be re-saved."""
+        event_utils.process_events([make_event(self.server.url("/sites/missing.json"))])
+        with mock.patch.object(
+            deadletter_utils, "write_dead_letters", side_effect=OSError("unavailable")
+        ), self.assertLogs(level="ERROR"):
+            totals = event_utils.replay_dead_letters(self.store)
+        self.assertEqual(totals["failed"], 1)
+        (entry,) = self.dead_letters()
+        self.assertEqual(entry["attempts"], 1)
+
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,111 @@
 """Module for testing the evroam_listener functionality."""
 
+import os
+import json
+import tempfile
 import unittest
+from unittest import mock
+
+import azure.functions as func
+
+import evroam_listener
+import process_evroam_events
+from constants import JSON_FILE_PATH, JSON_FILE_PATH_PREFIX
+from sharedCode import event_utils, storage_utils
+
+EVENTS = [
+    {
+        "id": "event-1",
+        "eventType": "EVRoam.ChargingStationAvailabilityChanged",
+        "data": {"url": "https://example.invalid/availabilities/1.json"},
+    },
+    {
+        "id": "event-2",
+        "eventType": "EVRoam.SiteChanged",
+        "data": {"url": "https://example.invalid/sites/2.json"},
+    },
+]
+
+
+def make_request(body):
+    """Builds an Event Grid delivery request."""
+    return func.HttpRequest(
+        method="POST",
+        url="/api/evroam_listener",
+        body=json.dumps(body).encode("utf-8"),
+    )
+
 
 class TestEvroamListener(unittest.TestCase):
     """Tests for the evroam_listener function."""
 
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        patcher = mock.patch.dict(
+            os.environ, {"LocalBlobStoragePath": self.directory.name}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.directory.cleanup)
+        self.store = storage_utils.get_blob_store(JSON_FILE_PATH["container"])
+
     def test_basic_assertion(self):
         """Test to ensure basic assertions work."""
         self.assertEqual(1, 1)
+
+    def test_subscription_validation(self):
+        """The validation code is echoed back."""
+        request = make_request(
+            [{"eventType": evroam_listener.SUBSCRIBE, "data": {"validationCode": "abc"}}]
+        )
+        response = evroam_listener.main(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.get_body()), {"validationResponse": "abc"})
+
+    @mock.patch.object(evroam_listener, "LISTENER_MODE", "staged")
+    def test_staged_mode_acknowledges_before_processing(self):
+        """In staged mode events are saved to the staging container, not processed."""
+        with mock.patch.object(event_utils, "process_events") as process_events:
+            response = evroam_listener.main(make_request(EVENTS))
+        self.assertEqual(response.status_code, 200)
+        process_events.assert_not_called()
+        blob_names = self.store.list_blobs(f"{JSON_FILE_PATH_PREFIX}/")
+        self.assertEqual(len(blob_names), 1)
+        self.assertEqual(json.loads(self.store.download_blob(blob_names[0])), EVENTS)
+
+    @mock.patch.object(evroam_listener, "LISTENER_MODE", "staged")
+    def test_staged_mode_rejects_invalid_delivery(self):
+        """A delivery with malformed events is rejected and nothing is staged."""
+        response = evroam_listener.main(make_request([{"data": {}}]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.store.list_blobs(), [])
+
+    @mock.patch.object(evroam_listener, "LISTENER_MODE", "staged")
+    def test_staged_events_are_processed_by_the_worker(self):
+        """The blob-triggered worker processes each staged batch once, in order."""
+        evroam_listener.main(make_request(EVENTS))
+        evroam_listener.main(make_request(EVENTS[:1]))
+        with mock.patch.object(event_utils, "process_events") as process_events:
+            for blob_name in self.store.list_blobs(f"{JSON_FILE_PATH_PREFIX}/"):
+                blob = func.blob.InputStream(
+                    data=self.store.download_blob(blob_name),
+                    name=f"{JSON_FILE_PATH['container']}/{blob_name}",
+                )
+                process_evroam_events.main(blob)
+        self.assertEqual(
+            [call.args[0] for call in process_events.call_args_list],
+            [EVENTS, EVENTS[:1]],
+        )
+        self.assertEqual(self.store.list_blobs(), [])
+
+    def test_inline_mode_processes_events(self):
+        """By default events are processed before the response is returned."""
+        with mock.patch.object(event_utils, "process_events") as process_events:
+            response = evroam_listener.main(make_request(EVENTS))
+        self.assertEqual(response.status_code, 200)
+        process_events.assert_called_once_with(EVENTS)
+        self.assertEqual(self.store.list_blobs(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Module for testing the sharedCode.landing_utils functionality."""
+
+import io
+import os
+import tempfile
+import unittest
+from datetime import date
+from unittest import mock
+
+import pyarrow.parquet as pq
+
+from constants import JSON_TYPES
+from sharedCode import event_utils
+from sharedCode import landing_utils
+from sharedCode import storage_utils
+from sharedCode.storage_utils import LocalBlobStore
+from tests.http_stub import StubServer
+from tests.test_pipeline_utils import import_timer, make_station
+
+
+class TestLandingZone(unittest.TestCase):
+    """Tests for writing and reading the Parquet landing zone."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = LocalBlobStore(self.directory.name, "incoming-data-staging")
+
+    def write(self, records, **kwargs):
+        """Writes records to the test store."""
+        return landing_utils.write_payload(
+            "chargingstations", records, store=self.store, **kwargs
+        )
+
+    def test_round_trip_flattens_and_encodes_nested_values(self):
+        """Nested objects are flattened, lists JSON-encoded and strings dictionary-encoded."""
+        station = make_station("cs-1")
+        station["location"] = {"lat": -41.2, "lon": 174.8}
+        station["connectors"] = [{"connectorType": "Type 2", "kwRated": 22}]
+        blob_name = self.write([station, make_station("cs-2")], source="http://example")
+
+        self.assertRegex(
+            blob_name,
+            r"^EVRoamParquet/chargingstations/IngestionDate=\d{4}-\d{2}-\d{2}/event-",
+        )
+        dataframe = landing_utils.read_payload(blob_name, self.store)
+        self.assertEqual(dataframe["chargingStationId"].tolist(), ["cs-1", "cs-2"])
+        self.assertEqual(dataframe["location.lat"].tolist()[0], -41.2)
+        self.assertEqual(
+            dataframe["connectors"].tolist()[0],
+            '[{"connectorType": "Type 2", "kwRated": 22}]',
+        )
+
+        parquet = pq.ParquetFile(io.BytesIO(self.store.download_blob(blob_name)))
+        column = parquet.schema_arrow.get_field_index("operator")
+        encodings = parquet.metadata.row_group(0).column(column).encodings
+        self.assertTrue(any("DICTIONARY" in encoding for encoding in encodings))
+
+    def test_latest_snapshot_reads_every_part_of_the_newest_run(self):
+        """Parts of the newest snapshot run are combined; events and older runs are not."""
+        self.write([make_station("old")], kind="snapshot")
+        run_id = landing_utils.new_run_id()
+        self.write([make_station("cs-1")], kind="snapshot", run_id=run_id, part=0)
+        self.write([make_station("cs-2")], kind="snapshot", run_id=run_id, part=1)
+        self.write([make_station("event")], kind="event")
+
+        latest = landing_utils.read_latest_snapshot("chargingstations", self.store)
+        self.assertEqual(latest["chargingStationId"].tolist(), ["cs-1", "cs-2"])
+        everything = landing_utils.read_payloads("chargingstations", store=self.store)
+        self.assertEqual(len(everything), 4)
+        events = landing_utils.list_payloads("chargingstations", kind="event", store=self.store)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(
+            landing_utils.list_payloads(
+                "chargingstations", start_date=date(2999, 1, 1), store=self.store
+            ),
+            [],
+        )
+
+    def test_ingestion_lands_raw_payloads(self):
+        """Webhook payloads and timer snapshots are landed as they are ingested."""
+        fetch_evroam_chargingstations = import_timer("fetch_evroam_chargingstations")
+        with mock.patch.dict(os.environ, {"LocalBlobStoragePath": self.directory.name}):
+            with mock.patch.dict(
+                event_utils.WRITE_TO_DB, {json_type: mock.Mock() for json_type in JSON_TYPES}
+            ), mock.patch(
+                "sharedCode.database_utils.write_availabilities_to_db"
+            ), mock.patch("sharedCode.database_utils.write_chargingstations_to_db"):
+                event_utils.process_json_data(
+                    "https://example/availabilities/1.json", [make_station("cs-1")]
+                )
+                fetch_evroam_chargingstations.ingest_chargingstations(
+                    iter([[make_station("cs-2")], [make_station("cs-3")]])
+                )
+
+        self.assertEqual(
+            landing_utils.read_payloads("availabilities", store=self.store)[
+                "chargingStationId"
+            ].tolist(),
+            ["cs-1"],
+        )
+        snapshot = landing_utils.read_latest_snapshot("chargingstations", self.store)
+        self.assertEqual(snapshot["chargingStationId"].tolist(), ["cs-2", "cs-3"])
+
+    def test_webhook_payloads_are_landed_as_downloaded(self):
+        """Each downloaded event payload is landed once, before the grouped write."""
+        event_utils.RECENT_EVENTS.clear()
+        with StubServer() as server, mock.patch.dict(
+            os.environ, {"LocalBlobStoragePath": self.directory.name}
+        ), mock.patch.dict(event_utils.WRITE_TO_DB, sites=mock.Mock()):
+            for site_id in "ab":
+                server.add_route(
+                    f"/sites/{site_id}.json",
+                    lambda path, query, site_id=site_id: (200, [{"siteId": site_id}]),
+                )
+            event_utils.process_events(
+                [
+                    {"eventType": "EVRoam.Changed", "data": {"url": server.url(f"/sites/{name}")}}
+                    for name in ("a.json", "b.json")
+                ]
+            )
+        events = landing_utils.list_payloads("sites", kind="event", store=self.store)
+        self.assertEqual(len(events), 2)
+        self.assertEqual(
+            sorted(landing_utils.read_payloads("sites", store=self.store)["siteId"]),
+            ["a", "b"],
+        )
+
+    def test_blob_stores_are_reused(self):
+        """A container's store is created once per account."""
+        with mock.patch.dict(os.environ, {"LocalBlobStoragePath": self.directory.name}):
+            store = storage_utils.get_blob_store("incoming-data-staging")
+            self.assertIs(storage_utils.get_blob_store("incoming-data-staging"), store)
+            self.assertIsNot(storage_utils.get_blob_store("other"), store)
+
+    def test_landing_failures_are_logged(self):
+        """A failing store does not raise out of land_payload."""
+        store = mock.Mock()
+        store.upload_blob.side_effect = OSError("unavailable")
+        with self.assertLogs(level="ERROR"):
+            result = landing_utils.land_payload("sites", [{"siteId": "a"}], store=store)
+        self.assertIsNone(result)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Module for testing the sharedCode.metrics_utils functionality."""
+
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pandas as pd
+
+from sharedCode import database_utils
+from sharedCode import event_utils
+from sharedCode import metrics_utils
+from tests.test_database_utils import make_site
+
+
+class TestMetrics(unittest.TestCase):
+    """Tests for recording the stages and counters of an invocation."""
+
+    def test_stages_and_counts_are_logged_when_the_invocation_ends(self):
+        """Each stage is timed per call and the counters are summed."""
+        with self.assertLogs(level="INFO") as logs:
+            with metrics_utils.invocation("test") as metrics:
+                for _ in range(2):
+                    with metrics_utils.stage("normalize"):
+                        metrics_utils.add(received=3, deduped=1)
+        snapshot = metrics.snapshot()
+        self.assertEqual(snapshot["counts"], {"received": 6, "deduped": 2})
+        self.assertEqual(snapshot["stages"]["normalize"]["calls"], 2)
+        record = next(
+            record for record in logs.records if record.getMessage().startswith("Invocation")
+        )
+        self.assertEqual(record.custom_dimensions["counts"], snapshot["counts"])
+
+    def test_nothing_is_recorded_outside_an_invocation_or_when_disabled(self):
+        """Without a running invocation the helpers are no-ops."""
+        self.assertIs(metrics_utils.stage("normalize"), metrics_utils.stage("dedupe"))
+        metrics_utils.add(received=1)
+        with mock.patch.object(metrics_utils, "METRICS_ENABLED", False):
+            with metrics_utils.invocation("test") as metrics:
+                self.assertIsNone(metrics)
+                self.assertIsNone(metrics_utils.current())
+
+        @metrics_utils.instrumented("hash")
+        def double(value):
+            return value * 2
+
+        self.assertEqual(double(2), 4)
+
+    def test_bound_functions_record_on_worker_threads(self):
+        """Stages run by a thread pool are recorded with the invocation that started them."""
+
+        def download(_):
+            with metrics_utils.stage("download"):
+                metrics_utils.add(received=1)
+
+        with metrics_utils.invocation("test") as metrics:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(metrics_utils.bind(download), range(8)))
+        self.assertEqual(metrics.counts, {"received": 8})
+        self.assertEqual(metrics.stages["download"]["calls"], 8)
+
+    def test_timed_iteration_records_the_wait_for_each_item(self):
+        """Each item taken from a timed iterable is one call of the stage."""
+        with metrics_utils.invocation("test") as metrics:
+            self.assertEqual(list(metrics_utils.timed(iter([1, 2]), "fetch")), [1, 2])
+        self.assertEqual(metrics.stages["fetch"]["calls"], 3)
+
+
+class TestPipelineMetrics(unittest.TestCase):
+    """Tests for the metrics recorded by the ingestion pipeline."""
+
+    def setUp(self):
+        database_utils.set_engine(database_utils.get_local_engine())
+        self.addCleanup(database_utils.set_engine, None)
+
+    def test_writes_record_rows_and_statements(self):
+        """The writers count the rows they insert, expire and leave unchanged."""
+        with metrics_utils.invocation("test") as metrics:
+            database_utils.write_sites_to_db(pd.DataFrame([make_site("A"), make_site("B")]))
+            database_utils.write_sites_to_db(
+                pd.DataFrame([make_site("A"), make_site("B", name="Renamed")])
+            )
+        self.assertEqual(
+            metrics.counts,
+            {"inserted": 3, "expired": 1, "unchanged": 1, "dead_lettered": 0},
+        )
+        self.assertEqual(metrics.stages["hash"]["calls"], 2)
+        self.assertGreater(metrics.stages["write"]["statements"], 0)
+        self.assertEqual(metrics.statements, metrics.stages["write"]["statements"])
+
+    def test_payload_stages_are_recorded(self):
+        """A webhook payload is measured from normalisation to the write."""
+        payload = [{"siteId": "A", "name": "Site"}, {"siteId": "A", "name": "Site"}]
+        write = mock.Mock(return_value={"inserted": 1})
+        with mock.patch.dict(event_utils.WRITE_TO_DB, {"sites": write}):
+            with metrics_utils.invocation("test") as metrics:
+                event_utils.process_payloads("sites", [("https://x/sites/1.json", payload)])
+        self.assertEqual(metrics.counts, {"received": 2, "coalesced": 0, "deduped": 1})
+        self.assertLessEqual({"normalize", "coalesce", "dedupe"}, set(metrics.stages))
+
+
+if __name__ == "__main__":
+    unittest.main()
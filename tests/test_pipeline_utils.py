@@ -0,0 +1,212 @@
+"""Module for testing the sharedCode.pipeline_utils functionality."""
+
+import os
+import importlib
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from constants import AVAILABILITIES_COLUMNS, CHARGINGSTATIONS_DROP_COLUMNS, JSON_KEYS
+from sharedCode import pipeline_utils
+from sharedCode import schema_utils
+
+
+def import_timer(name):
+    """Imports a timer function module, which requires a subscription key."""
+    with mock.patch.dict(os.environ, {"EvroamSubscriptionKey": "key"}):
+        return importlib.import_module(name)
+
+
+def make_station(charging_station_id, status="Available"):
+    """Builds a charging station result as returned by the EVRoam API."""
+    return {
+        "chargingStationId": charging_station_id,
+        "siteId": "site-1",
+        "operator": "Operator",
+        "availabilityStatus": status,
+        "kwAvailable": 22.0,
+        "availabilityTime": "2024-01-01T00:00:00Z",
+    }
+
+
+class TestBatchPages(unittest.TestCase):
+    """Tests for grouping API pages into bounded batches."""
+
+    def test_groups_whole_pages_up_to_the_row_limit(self):
+        """Pages are combined until a batch reaches the row limit."""
+        pages = [[1, 2], [3, 4], [5], [6, 7, 8], [9]]
+        self.assertEqual(
+            list(pipeline_utils.batch_pages(iter(pages), max_rows=4)),
+            [[1, 2, 3, 4], [5, 6, 7, 8], [9]],
+        )
+
+
+def normalise_stations(stations):
+    """Normalises charging station results as the timer and listener do."""
+    dataframe = pd.json_normalize(stations)
+    schema_utils.normalize_columns(dataframe)
+    return dataframe
+
+
+class TestSplitChargingStations(unittest.TestCase):
+    """Tests for splitting charging stations and availabilities in one pass."""
+
+    def test_matches_copying_each_entity_frame(self):
+        """Rows kept match copying, deduplicating and dropping NaN keys per entity."""
+        stations = [make_station(f"cs-{index}") for index in range(4)]
+        stations.append(make_station("cs-1"))
+        stations[2]["availabilityTime"] = None
+        stations[3]["chargingStationId"] = None
+        dataframe = normalise_stations(stations)
+
+        availabilities, chargingstations = pipeline_utils.split_chargingstations(dataframe)
+
+        expected = dataframe[AVAILABILITIES_COLUMNS].drop_duplicates(
+            subset=JSON_KEYS["availabilities"]
+        ).dropna(subset=JSON_KEYS["availabilities"])
+        pd.testing.assert_frame_equal(availabilities, expected)
+        expected = dataframe.drop(columns=CHARGINGSTATIONS_DROP_COLUMNS).drop_duplicates(
+            subset=JSON_KEYS["chargingstations"]
+        ).dropna(subset=JSON_KEYS["chargingstations"])
+        pd.testing.assert_frame_equal(chargingstations, expected)
+
+    def test_clean_payloads_are_not_copied(self):
+        """Without rows to remove both frames share the payload's memory."""
+        stations = [dict(make_station(f"cs-{index}"), maxKw=50.0) for index in range(3)]
+        dataframe = normalise_stations(stations)
+        availabilities, chargingstations = pipeline_utils.split_chargingstations(dataframe)
+        self.assertTrue(
+            np.shares_memory(
+                availabilities["KwAvailable"].to_numpy(), dataframe["KwAvailable"].to_numpy()
+            )
+        )
+        self.assertTrue(
+            np.shares_memory(chargingstations["MaxKw"].to_numpy(), dataframe["MaxKw"].to_numpy())
+        )
+        self.assertNotIn("KwAvailable", chargingstations.columns)
+
+    def test_payloads_without_availability(self):
+        """Stations without availability columns yield no availabilities."""
+        station = make_station("cs-1")
+        for name in ("availabilityStatus", "kwAvailable", "availabilityTime"):
+            del station[name]
+        availabilities, chargingstations = pipeline_utils.split_chargingstations(
+            normalise_stations([station])
+        )
+        self.assertIsNone(availabilities)
+        self.assertEqual(chargingstations["ChargingStationId"].tolist(), ["cs-1"])
+
+
+class TestCoalesceAvailabilities(unittest.TestCase):
+    """Tests for collapsing bursts of availability updates."""
+
+    def test_keeps_latest_update_per_window(self):
+        """Updates within the window of a later one are dropped, older ones kept in order."""
+        updates = [
+            ("cs-1", "Occupied", "2024-01-01T00:10:00Z"),
+            ("cs-1", "Available", "2024-01-01T00:00:00Z"),
+            ("cs-2", "Available", "2024-01-01T00:00:00Z"),
+            ("cs-1", "Available", "2024-01-01T00:10:30Z"),
+            ("cs-1", "Occupied", "2024-01-01T00:00:20Z"),
+        ]
+        stations = []
+        for station_id, status, time in updates:
+            station = make_station(station_id, status)
+            station["availabilityTime"] = time
+            stations.append(station)
+        dataframe = normalise_stations(stations)
+
+        coalesced = pipeline_utils.coalesce_availabilities(dataframe, 60)
+        self.assertEqual(
+            list(
+                zip(
+                    coalesced["ChargingStationId"],
+                    coalesced["AvailabilityStatus"],
+                    coalesced["AvailabilityTime"],
+                )
+            ),
+            [
+                ("cs-2", "Available", "2024-01-01T00:00:00Z"),
+                ("cs-1", "Occupied", "2024-01-01T00:00:20Z"),
+                ("cs-1", "Available", "2024-01-01T00:10:30Z"),
+            ],
+        )
+
+    def test_single_updates_are_not_copied(self):
+        """A payload with one update per station is returned as is."""
+        dataframe = normalise_stations([make_station("cs-1"), make_station("cs-2")])
+        self.assertIs(pipeline_utils.coalesce_availabilities(dataframe, 60), dataframe)
+
+
+class TestKeyDeduplicator(unittest.TestCase):
+    """Tests for deduplication across the DataFrames of a stream."""
+
+    def test_drops_keys_seen_in_earlier_frames(self):
+        """The first occurrence of a key wins across frames."""
+        deduplicate = pipeline_utils.KeyDeduplicator(["Id"])
+        first = deduplicate(pd.DataFrame({"Id": ["a", "b", "a"], "V": [1, 2, 3]}))
+        second = deduplicate(pd.DataFrame({"Id": ["b", "c"], "V": [4, 5]}))
+        self.assertEqual(first.to_dict("records"), [{"Id": "a", "V": 1}, {"Id": "b", "V": 2}])
+        self.assertEqual(second.to_dict("records"), [{"Id": "c", "V": 5}])
+
+    def test_composite_keys(self):
+        """Keys made of several columns are compared as a whole."""
+        deduplicate = pipeline_utils.KeyDeduplicator(["Id", "Status"])
+        deduplicate(pd.DataFrame({"Id": ["a"], "Status": ["Available"]}))
+        second = deduplicate(
+            pd.DataFrame({"Id": ["a", "a"], "Status": ["Available", "Occupied"]})
+        )
+        self.assertEqual(second["Status"].tolist(), ["Occupied"])
+
+
+class TestStreamingIngestion(unittest.TestCase):
+    """Tests for the page-by-page ingestion of the timer functions."""
+
+    def test_sites_are_written_per_batch(self):
+        """Each batch is written as it arrives, without repeating sites."""
+        fetch_evroam_sites = import_timer("fetch_evroam_sites")
+        pages = [
+            [{"siteId": "a", "name": "A"}, {"siteId": "b", "name": "B"}],
+            [{"siteId": "b", "name": "B again"}, {"siteId": "c", "name": "C"}],
+        ]
+        with mock.patch.object(pipeline_utils, "STREAM_BATCH_ROWS", 2), mock.patch(
+            "sharedCode.database_utils.write_sites_to_db"
+        ) as write_sites_to_db:
+            self.assertEqual(fetch_evroam_sites.ingest_sites(iter(pages)), 3)
+        written = [call.args[0]["SiteId"].tolist() for call in write_sites_to_db.call_args_list]
+        self.assertEqual(written, [["a", "b"], ["c"]])
+
+    def test_chargingstations_and_availabilities_are_written_per_batch(self):
+        """Both entity frames are deduplicated across batches and written per batch."""
+        fetch_evroam_chargingstations = import_timer("fetch_evroam_chargingstations")
+        pages = [
+            [make_station("cs-1"), make_station("cs-2")],
+            [make_station("cs-2"), make_station("cs-2", "Occupied"), make_station("cs-3")],
+        ]
+        with mock.patch.object(pipeline_utils, "STREAM_BATCH_ROWS", 2), mock.patch(
+            "sharedCode.database_utils.write_availabilities_to_db"
+        ) as write_availabilities, mock.patch(
+            "sharedCode.database_utils.write_chargingstations_to_db"
+        ) as write_chargingstations:
+            row_count = fetch_evroam_chargingstations.ingest_chargingstations(iter(pages))
+        self.assertEqual(row_count, 3)
+        self.assertEqual(
+            [
+                call.args[0]["ChargingStationId"].tolist()
+                for call in write_chargingstations.call_args_list
+            ],
+            [["cs-1", "cs-2"], ["cs-3"]],
+        )
+        self.assertEqual(
+            [
+                call.args[0]["AvailabilityStatus"].tolist()
+                for call in write_availabilities.call_args_list
+            ],
+            [["Available", "Available"], ["Occupied", "Available"]],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
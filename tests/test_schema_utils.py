@@ -0,0 +1,59 @@
+"""Module for testing the sharedCode.schema_utils functionality."""
+
+import unittest
+
+import pandas as pd
+from inflection import camelize
+
+from constants import CHARACTERS_TO_REPLACE
+from sharedCode import schema_utils
+
+
+def reference_column_name(col):
+    """The column renaming previously inlined in every entry point."""
+    for character in CHARACTERS_TO_REPLACE:
+        col = col.replace(character, " ")
+    return camelize(col.strip(), uppercase_first_letter=True).replace(" ", "")
+
+
+class TestNormalizeColumnName(unittest.TestCase):
+    """Tests for the shared column name normalisation."""
+
+    def test_matches_previous_renaming(self):
+        """Known and unknown names are converted as before."""
+        names = schema_utils.KNOWN_JSON_PATHS + [
+            "location.address-line (1)",
+            " padded name ",
+            "a/b",
+            "connectors.0.kwRated",
+        ]
+        for name in names:
+            self.assertEqual(
+                schema_utils.normalize_column_name(name), reference_column_name(name)
+            )
+
+    def test_known_paths(self):
+        """json_normalize paths map to the model column names."""
+        self.assertEqual(schema_utils.normalize_column_name("location.lat"), "Locationlat")
+        self.assertEqual(
+            schema_utils.normalize_column_name("chargingStationId"), "ChargingStationId"
+        )
+
+    def test_unknown_names_are_memoised(self):
+        """Repeated unknown names are served from the LRU cache."""
+        before = schema_utils.column_name_cache_info()
+        for _ in range(3):
+            schema_utils.normalize_column_name("someNewField.value")
+        after = schema_utils.column_name_cache_info()
+        self.assertEqual(after.misses - before.misses, 1)
+        self.assertEqual(after.hits - before.hits, 2)
+
+    def test_normalize_columns(self):
+        """DataFrame columns are renamed in place."""
+        dataframe = pd.json_normalize([{"siteId": "a", "location": {"lat": 1.0}}])
+        self.assertIs(schema_utils.normalize_columns(dataframe), dataframe)
+        self.assertEqual(list(dataframe.columns), ["SiteId", "Locationlat"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Module for testing the sharedCode.watermark_utils functionality."""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from sharedCode import api_utils
+from sharedCode import watermark_utils
+from sharedCode.storage_utils import LocalBlobStore
+from tests.http_stub import StubServer, paginated_route
+from tests.test_pipeline_utils import import_timer, make_station
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_stations(count, changed=(), time="2024-01-01T00:00:00Z"):
+    """Builds API results, with a later availability time for `changed` stations."""
+    stations = []
+    for index in range(count):
+        station = make_station(f"cs-{index}")
+        station["availabilityTime"] = "2024-01-02T00:00:00Z" if index in changed else time
+        stations.append(station)
+    return stations
+
+
+class TestIncrementalFetch(unittest.TestCase):
+    """Tests for planning fetches from the high-water mark state."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.state = watermark_utils.WatermarkStore(
+            LocalBlobStore(self.directory.name, "incoming-data-staging")
+        )
+
+    def run_fetch(self, records, now, **kwargs):
+        """Runs one fetch of charging stations and returns it with the selected results."""
+        fetch = watermark_utils.IncrementalFetch(
+            "chargingstations", self.state, now=now, **kwargs
+        )
+        selected = fetch.select(records)
+        fetch.commit()
+        return fetch, selected
+
+    def test_first_fetch_is_full_then_incremental(self):
+        """Only results newer than the high-water mark are selected between reconciles."""
+        fetch, selected = self.run_fetch(make_stations(5), START)
+        self.assertTrue(fetch.full)
+        self.assertEqual(len(selected), 5)
+        self.assertEqual(
+            self.state.get("chargingstations"),
+            {
+                "high_water_mark": "2024-01-01T00:00:00+00:00",
+                "last_full_reconcile": START.isoformat(),
+            },
+        )
+
+        fetch, selected = self.run_fetch(
+            make_stations(5, changed={1, 3}), START + timedelta(days=1)
+        )
+        self.assertFalse(fetch.full)
+        self.assertEqual([record["chargingStationId"] for record in selected], ["cs-1", "cs-3"])
+        self.assertEqual(
+            self.state.get("chargingstations")["high_water_mark"],
+            "2024-01-02T00:00:00+00:00",
+        )
+
+    def test_full_reconcile_runs_periodically_or_when_forced(self):
+        """A full reconcile is due after FULL_RECONCILE_DAYS, or on demand."""
+        self.run_fetch(make_stations(3), START)
+        fetch, selected = self.run_fetch(make_stations(3), START + timedelta(days=1))
+        self.assertEqual(selected, [])
+        fetch, selected = self.run_fetch(
+            make_stations(3), START + timedelta(days=1), force_full=True
+        )
+        self.assertTrue(fetch.full)
+        self.assertEqual(len(selected), 3)
+        with mock.patch.object(watermark_utils, "FULL_RECONCILE_DAYS", 2):
+            fetch, _ = self.run_fetch(make_stations(3), START + timedelta(days=3))
+        self.assertTrue(fetch.full)
+
+    def test_entities_without_timestamps_are_fetched_in_full(self):
+        """Sites have no change timestamp, so only an API filter makes them incremental."""
+        for _ in range(2):
+            fetch = watermark_utils.IncrementalFetch("sites", self.state, now=START)
+            fetch.select([{"siteId": "a"}])
+            fetch.commit()
+        self.assertTrue(fetch.full)
+        with mock.patch.object(watermark_utils, "CHANGED_SINCE_PARAM", "changedSince"):
+            fetch = watermark_utils.IncrementalFetch(
+                "sites", self.state, now=START + timedelta(days=1)
+            )
+        self.assertFalse(fetch.full)
+        self.assertEqual(fetch.params, {"changedSince": START.isoformat()})
+
+    def test_unreadable_state_falls_back_to_full_fetch(self):
+        """A state store that cannot be read forces a full fetch and is not written."""
+        state = mock.Mock()
+        state.get.side_effect = OSError("unavailable")
+        fetch = watermark_utils.IncrementalFetch("chargingstations", state, now=START)
+        self.assertTrue(fetch.full)
+        fetch.commit()
+        state.update.assert_not_called()
+
+
+class TestIncrementalTimer(unittest.TestCase):
+    """Tests for the charging station timer against a mock API and a local state file."""
+
+    def setUp(self):
+        self.server = StubServer()
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        for patcher in (
+            mock.patch.object(api_utils, "API_BASE_URL", self.server.url("/consumer/api")),
+            mock.patch.dict(os.environ, {"LocalBlobStoragePath": self.directory.name}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.timer = import_timer("fetch_evroam_chargingstations")
+
+    def run_timer(self, stations, failures=None):
+        """
+        Serves `stations` from the mock API and runs the timer function, returning
+        the ids of the charging stations and of the availabilities written.
+        """
+        self.server.add_route(
+            "/consumer/api/ChargingStation",
+            paginated_route("chargingStations", stations, 2, failures=failures),
+        )
+        with mock.patch(
+            "sharedCode.database_utils.write_availabilities_to_db"
+        ) as write_availabilities, mock.patch(
+            "sharedCode.database_utils.write_chargingstations_to_db"
+        ) as write_chargingstations, mock.patch.object(api_utils, "MAX_RETRIES", 0):
+            self.timer.main(mock.Mock(past_due=False))
+        return [
+            [
+                station
+                for call in write.call_args_list
+                for station in call.args[0]["ChargingStationId"]
+            ]
+            for write in (write_chargingstations, write_availabilities)
+        ]
+
+    def test_second_run_writes_only_changed_availabilities(self):
+        """The timer records its high-water mark and then filters availabilities only."""
+        stations = [f"cs-{index}" for index in range(5)]
+        self.assertEqual(self.run_timer(make_stations(5)), [stations, stations])
+        self.assertEqual(self.run_timer(make_stations(5, changed={4})), [stations, ["cs-4"]])
+        self.assertEqual(self.run_timer(make_stations(5, changed={4})), [stations, []])
+
+    def test_failed_page_keeps_the_high_water_mark(self):
+        """Changes on a page that failed to download are fetched again by the next run."""
+        self.run_timer(make_stations(6))
+        _, availabilities = self.run_timer(
+            make_stations(6, changed={2, 4}), failures={2: [500]}
+        )
+        self.assertEqual(availabilities, ["cs-4"])
+        _, availabilities = self.run_timer(make_stations(6, changed={2, 4}))
+        self.assertEqual(availabilities, ["cs-2", "cs-4"])
+
+if __name__ == "__main__":
+    unittest.main()